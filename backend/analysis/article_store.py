@@ -0,0 +1,270 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import struct
+import zlib
+from text_cache import content_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows: single O_APPEND writes, no cross-process lock
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ========== CONFIG ==========
+STORE_FILE = "articles.pack"
+LEGACY_CACHE_DIR = "cache"
+
+log = logging.getLogger(__name__)
+
+# ========== PACK FORMAT ==========
+# articles.pack is an append-only sequence of records:
+#
+#   magic "ART1" | codec u8 | id length u16 | blob length u32 |
+#   raw length u32 | blake2b-128 of the raw XML | pmc id | compressed XML
+#
+# The pack is the source of truth. articles.pack.idx is a JSON snapshot of
+# the offset index covering the first `covered` bytes; anything appended
+# after that is picked up by scanning record headers on open. If the same
+# PMC id is written twice the later record wins.
+
+MAGIC = b"ART1"
+HEADER = struct.Struct("<4sBHII16s")
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+
+def compress(data):
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=9).compress(data)
+    return CODEC_ZLIB, zlib.compress(data, 6)
+
+
+def decompress(codec, blob):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(blob)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError(
+                "articles.pack contains zstd records; pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown codec {codec} in article store")
+
+
+def read_blob(path, offset, length, codec):
+    # Module-level so parse workers can read straight from the pack.
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return decompress(codec, f.read(length))
+
+
+class ArticleStore:
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self.index_path = path + ".idx"
+        # pmc_id -> [blob offset, blob length, codec, xml hash, raw length]
+        self.index = {}
+        self.end = 0
+        self._load_index()
+        self.refresh()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if snapshot.get("covered", 0) > size:
+            # pack was replaced or truncated behind our back; rescan it all
+            return
+        self.index = snapshot["entries"]
+        self.end = snapshot["covered"]
+
+    def refresh(self):
+        # Scans headers appended since the last scan (by us or by another
+        # writer). Blobs are skipped with a seek, never read.
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size <= self.end:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.end)
+            pos = self.end
+            while pos + HEADER.size <= size:
+                header = f.read(HEADER.size)
+                magic, codec, id_len, blob_len, raw_len, digest = \
+                    HEADER.unpack(header)
+                if magic != MAGIC:
+                    raise ValueError(
+                        f"Corrupt article store {self.path} at byte {pos}")
+                record_end = pos + HEADER.size + id_len + blob_len
+                if record_end > size:
+                    break  # record still being written
+                pmc_id = f.read(id_len).decode("ascii")
+                blob_offset = pos + HEADER.size + id_len
+                self.index[pmc_id] = [blob_offset, blob_len, codec,
+                                      digest.hex(), raw_len]
+                f.seek(record_end)
+                pos = record_end
+        self.end = pos
+
+    def __contains__(self, pmc_id):
+        return pmc_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def ids(self):
+        return list(self.index)
+
+    def location(self, pmc_id):
+        entry = self.index.get(pmc_id)
+        if entry is None:
+            return None
+        return self.path, entry[0], entry[1], entry[2]
+
+    def get_hash(self, pmc_id):
+        entry = self.index.get(pmc_id)
+        return entry[3] if entry else None
+
+    def get_bytes(self, pmc_id):
+        entry = self.index.get(pmc_id)
+        if entry is None:
+            return None
+        return read_blob(self.path, entry[0], entry[1], entry[2])
+
+    def get(self, pmc_id):
+        data = self.get_bytes(pmc_id)
+        return data.decode("utf-8") if data is not None else None
+
+    def put(self, pmc_id, xml_content):
+        if isinstance(xml_content, str):
+            xml_content = xml_content.encode("utf-8")
+        codec, blob = compress(xml_content)
+        id_bytes = pmc_id.encode("ascii")
+        digest = bytes.fromhex(content_hash(xml_content))
+        record = HEADER.pack(MAGIC, codec, len(id_bytes), len(blob),
+                             len(xml_content), digest) + id_bytes + blob
+
+        # One write per record on an O_APPEND descriptor, serialised across
+        # processes by an exclusive lock, so concurrent writers never
+        # interleave bytes.
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                self._truncate_torn_tail(fd)
+            os.write(fd, record)
+            os.fsync(fd)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+        # indexes our record along with anything other writers appended
+        self.refresh()
+
+    def _truncate_torn_tail(self, fd):
+        # Only called under the write lock, when no writer is mid-append:
+        # bytes past the last complete record were left by one that died
+        # part way through, and a record appended after them would never be
+        # found by refresh(). Cut them off first.
+        self.refresh()
+        size = os.fstat(fd).st_size
+        if size > self.end:
+            log.warning("Truncating %d bytes of a torn record at the end of "
+                        "%s", size - self.end, self.path)
+            os.ftruncate(fd, self.end)
+
+    def save_index(self):
+        # per process: workers sharing the pack each snapshot their index
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"covered": self.end, "entries": self.index}, f)
+        os.replace(tmp, self.index_path)
+
+
+_article_store = None
+
+
+def get_article_store():
+    global _article_store
+    if _article_store is None:
+        _article_store = ArticleStore()
+    return _article_store
+
+
+def use_article_store(path):
+    # Points the shared store at another pack (benchmarks, scratch runs).
+    global _article_store
+    close_article_store()
+    _article_store = ArticleStore(path)
+    return _article_store
+
+
+def close_article_store():
+    global _article_store
+    if _article_store is not None:
+        _article_store.save_index()
+        _article_store = None
+
+
+# ========== MIGRATION ==========
+
+
+def migrate(cache_dir=LEGACY_CACHE_DIR, path=STORE_FILE, delete=False):
+    store = ArticleStore(path)
+    paths = sorted(glob.glob(os.path.join(cache_dir, "*.xml")))
+    added = 0
+    raw_bytes = 0
+    for cache_path in paths:
+        pmc_id = os.path.basename(cache_path)[:-4]
+        with open(cache_path, "rb") as f:
+            data = f.read()
+        raw_bytes += len(data)
+        if store.get_hash(pmc_id) != content_hash(data):
+            store.put(pmc_id, data)
+            added += 1
+    store.save_index()
+    if delete:
+        for cache_path in paths:
+            os.remove(cache_path)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    print(f"Migrated {added} of {len(paths)} articles from {cache_dir}/ "
+          f"into {path} ({raw_bytes / 1e6:.1f} MB -> {size / 1e6:.1f} MB)")
+
+
+def stats(path=STORE_FILE):
+    store = ArticleStore(path)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    raw = sum(entry[4] for entry in store.index.values())
+    print(f"{path}: {len(store)} articles, {size / 1e6:.1f} MB on disk, "
+          f"{raw / 1e6:.1f} MB uncompressed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compressed article store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("migrate", help="import the legacy cache/ directory")
+    p.add_argument("--cache", default=LEGACY_CACHE_DIR)
+    p.add_argument("--store", default=STORE_FILE)
+    p.add_argument("--delete", action="store_true",
+                   help="remove the loose XML files after importing")
+    p = sub.add_parser("stats", help="print store size and article count")
+    p.add_argument("--store", default=STORE_FILE)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(args.cache, args.store, args.delete)
+    else:
+        stats(args.store)
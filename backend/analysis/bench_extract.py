@@ -0,0 +1,98 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from article_store import STORE_FILE, ArticleStore
+
+# Compares the streaming extractor in extract.py against the old
+# BeautifulSoup path over every article in the article store. Each
+# implementation runs in its own subprocess so peak RSS is measured
+# independently.
+#
+#   python bench_extract.py --mode abstract
+#   python bench_extract.py --mode paragraphs --store articles.pack
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_bs4(store, pmc_ids, mode):
+    from bs4 import BeautifulSoup
+    tag = "abstract" if mode == "abstract" else "p"
+    total = 0
+    for pmc_id in pmc_ids:
+        soup = BeautifulSoup(store.get(pmc_id), "xml")
+        total += len("\n".join(p.get_text() for p in soup.find_all(tag)))
+    return total
+
+
+def run_stream(store, pmc_ids, mode):
+    from extract import extract_text
+    total = 0
+    for pmc_id in pmc_ids:
+        total += len(extract_text(store.get(pmc_id), mode))
+    return total
+
+
+def child(impl, store_path, mode):
+    store = ArticleStore(store_path)
+    pmc_ids = store.ids()
+    run = run_bs4 if impl == "bs4" else run_stream
+    # warm the imports so they don't count towards parse time
+    run(store, pmc_ids[:1], mode)
+    base_rss = peak_rss_mb()
+    start = time.perf_counter()
+    chars = run(store, pmc_ids, mode)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "impl": impl,
+        "files": len(pmc_ids),
+        "chars": chars,
+        "seconds": elapsed,
+        "base_rss_mb": base_rss,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default=STORE_FILE)
+    parser.add_argument("--mode", default="abstract",
+                        choices=["abstract", "paragraphs"])
+    parser.add_argument("--child", choices=["bs4", "stream"])
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.store, args.mode)
+        return
+
+    results = []
+    for impl in ("bs4", "stream"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", impl,
+             "--store", args.store, "--mode", args.mode],
+            check=True, capture_output=True, text=True,
+        )
+        results.append(json.loads(out.stdout))
+
+    files = results[0]["files"]
+    print(f"{files} articles in {args.store}, mode={args.mode}")
+    print(f"{'impl':<8}{'seconds':>10}{'files/s':>10}"
+          f"{'peak RSS MB':>14}{'parse RSS MB':>14}")
+    for r in results:
+        rate = r["files"] / r["seconds"] if r["seconds"] else 0.0
+        print(f"{r['impl']:<8}{r['seconds']:>10.2f}{rate:>10.1f}"
+              f"{r['peak_rss_mb']:>14.1f}"
+              f"{r['peak_rss_mb'] - r['base_rss_mb']:>14.1f}")
+    if results[0]["chars"] != results[1]["chars"]:
+        print("WARNING: extracted text length differs between implementations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import httpx
+import ncbi
+from article_store import (STORE_FILE, ArticleStore, close_article_store,
+                           use_article_store)
+from extract import extract_text
+from ratelimit import TokenBucket
+from stub_eutils import StubEutils
+
+# Cold-corpus fetch against the local efetch stub: one request per PMC id
+# versus batched efetch. Every run starts from an empty scratch store (and
+# no legacy cache/ directory, which would answer every id) and checks that
+# every article extracts to the same text as in the source store (batch
+# splitting may change whitespace between articles).
+#
+#   python bench_fetch.py --latency 0.2 --batch-size 50 --drop-rate 0.02
+
+
+async def cold_fetch(pmc_ids, batch_size):
+    limits = httpx.Limits(max_connections=ncbi.MAX_CONCURRENT)
+    async with httpx.AsyncClient(timeout=60.0, limits=limits) as client_http:
+        await ncbi.prefetch_articles(pmc_ids, client_http, batch_size)
+        semaphore = asyncio.Semaphore(ncbi.MAX_CONCURRENT)
+
+        async def sem_fetch(pid):
+            async with semaphore:
+                await ncbi.fetch_article(pid, client_http)
+
+        await asyncio.gather(*(sem_fetch(pid) for pid in pmc_ids))
+
+
+def run(source, pmc_ids, batch_size, args):
+    stub = StubEutils(source, latency=args.latency, drop_rate=args.drop_rate,
+                      throttle_rate=args.throttle_rate, max_rps=args.max_rps)
+    ncbi.EFETCH_URL = f"{stub.start()}/efetch.fcgi"
+    with tempfile.TemporaryDirectory() as tmp:
+        store = use_article_store(os.path.join(tmp, "articles.pack"))
+        ncbi.LEGACY_CACHE_DIR = os.path.join(tmp, "cache")
+        start = time.perf_counter()
+        asyncio.run(cold_fetch(pmc_ids, batch_size))
+        elapsed = time.perf_counter() - start
+        assert stub.requests > 0, "nothing was fetched; the run was not cold"
+        identical = all(
+            store.get_hash(pid) == source.get_hash(pid)
+            or extract_text(store.get(pid), "paragraphs")
+            == extract_text(source.get(pid), "paragraphs")
+            for pid in pmc_ids)
+        close_article_store()
+    stub.stop()
+    return stub.requests, elapsed, identical
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default=STORE_FILE,
+                        help="source store the stub serves from")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--batch-size", type=int,
+                        default=ncbi.EFETCH_BATCH_SIZE)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-rps", type=int)
+    parser.add_argument("--rps", type=float, default=ncbi.REQUESTS_PER_SECOND,
+                        help="client-side request rate limit")
+    args = parser.parse_args()
+
+    source = ArticleStore(args.store)
+    pmc_ids = source.ids()
+    if args.limit:
+        pmc_ids = pmc_ids[:args.limit]
+
+    print(f"{len(pmc_ids)} articles, {args.latency * 1000:.0f}ms per request, "
+          f"{args.rps:g} requests/s")
+    rows = []
+    for label, batch_size in (("single", 1), (f"batch={args.batch_size}",
+                                              args.batch_size)):
+        ncbi.rate_limiter = TokenBucket(args.rps)
+        ncbi.stats = dict.fromkeys(ncbi.stats, 0)
+        requests, elapsed, identical = run(source, pmc_ids, batch_size, args)
+        rows.append((label, requests, ncbi.stats["throttled"],
+                     ncbi.stats["retries"], elapsed, identical))
+    print(f"{'mode':<12}{'requests':>10}{'throttled':>11}{'retries':>9}"
+          f"{'seconds':>10}{'identical':>11}")
+    for label, requests, throttled, retries, elapsed, identical in rows:
+        print(f"{label:<12}{requests:>10}{throttled:>11}{retries:>9}"
+              f"{elapsed:>10.2f}{str(identical):>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import time
+import numpy as np
+from bench_projection import synthetic_scores
+from neighbors import NEIGHBORS_K, NeighborIndex
+
+# Latency and recall of the pynndescent index in neighbors.py against exact
+# NumPy search, on synthetic 15-dim topic-score vectors. Recall is the share
+# of the exact top-k that the approximate index also returns.
+#
+#   python bench_neighbors.py --sizes 1000 10000 100000 --metric cosine
+
+
+def median_latency_ms(index, queries, k):
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        index.query(q, k)
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
+
+
+def run(n, metric, k, n_queries):
+    X = synthetic_scores(n)
+    rng = np.random.default_rng(1)
+    queries = X[rng.choice(n, size=min(n_queries, n), replace=False)]
+
+    start = time.perf_counter()
+    exact = NeighborIndex(X, metric, exact=True)
+    t_exact_build = time.perf_counter() - start
+    start = time.perf_counter()
+    ann = NeighborIndex(X, metric, exact=False)
+    t_ann_build = time.perf_counter() - start
+
+    truth, _ = exact.query(queries, k)
+    found, _ = ann.query(queries, k)
+    recall = np.mean([len(np.intersect1d(t, f)) / k
+                      for t, f in zip(truth, found)])
+    return {
+        "n": n,
+        "exact_build": t_exact_build,
+        "ann_build": t_ann_build,
+        "exact_ms": median_latency_ms(exact, queries[:200], k),
+        "ann_ms": median_latency_ms(ann, queries[:200], k),
+        "recall": recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--metric", default="cosine",
+                        choices=["cosine", "euclidean"])
+    parser.add_argument("-k", type=int, default=NEIGHBORS_K)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    # compile pynndescent's numba kernels before timing anything
+    run(500, args.metric, args.k, 10)
+
+    print(f"metric={args.metric}, k={args.k}; build in s, query median in ms")
+    print(f"{'rows':>8}{'exact build':>13}{'ANN build':>11}"
+          f"{'exact query':>13}{'ANN query':>11}{'recall':>8}")
+    for n in args.sizes:
+        r = run(n, args.metric, args.k, args.queries)
+        print(f"{r['n']:>8}{r['exact_build']:>13.3f}{r['ann_build']:>11.2f}"
+              f"{r['exact_ms']:>13.3f}{r['ann_ms']:>11.3f}{r['recall']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from article_store import STORE_FILE, ArticleStore
+from stub_eutils import StubEutils
+from stub_gemini import StubGemini
+
+# End-to-end throughput of the pipeline (main.py's scores stage by default)
+# with no network: efetch is served by stub_eutils.py and Gemini by
+# stub_gemini.py, both with configurable latency and error injection. Each
+# corpus size runs cold, in its own subprocess and scratch directory, so the
+# article store and caches start empty and peak RSS is per size. The
+# synthetic articles are the store's fixtures re-numbered, with a unique
+# line in the abstract so no two of them share a cache entry.
+#
+#   python bench_pipeline.py --sizes 100 1000 10000 50000
+#   python bench_pipeline.py --sizes 1000 --gemini-latency 2 --quota-rate 0.05
+#   python bench_pipeline.py --sizes 1000 --stages scores labels
+
+FIRST_SYNTHETIC_ID = 90000000
+ABSTRACT_TAG = re.compile(r"<abstract(?:\s[^>]*)?>")
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class SyntheticCorpus:
+    # Read-only store stand-in for StubEutils: n articles generated on
+    # demand from the fixtures, so even 50k of them take no disk.
+
+    def __init__(self, store, n):
+        self.templates = [(pmc_id, store.get(pmc_id)) for pmc_id in store.ids()]
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def ids(self):
+        return [str(FIRST_SYNTHETIC_ID + i) for i in range(self.n)]
+
+    def get(self, pmc_id):
+        i = int(pmc_id) - FIRST_SYNTHETIC_ID
+        if not 0 <= i < self.n:
+            return None
+        template_id, xml = self.templates[i % len(self.templates)]
+        xml = xml.replace(template_id, pmc_id)
+        return ABSTRACT_TAG.sub(
+            lambda m: f"{m.group(0)}<p>Synthetic article {pmc_id}.</p>", xml,
+            count=1)
+
+
+# ========== ONE RUN (child process) ==========
+
+
+def child(args):
+    # Imported here so the parent never loads the pipeline itself.
+    import asyncio
+    import gemini
+    import ncbi
+    from journal import load_json
+    from metrics import metrics, setup_logging
+    from pipeline import run_pipeline
+    from pipeline.stages import PROCESSED_FILE, SUMMARY_FILE
+    from ratelimit import TokenBucket
+
+    setup_logging()
+    ncbi.EFETCH_URL = f"{args.eutils_url}/efetch.fcgi"
+    ncbi.rate_limiter = TokenBucket(args.ncbi_rps, name="ncbi")
+    gemini.GEMINI_BASE_URL = args.gemini_url
+    gemini.OVERLOAD_WAIT = args.overload_wait
+    os.environ.setdefault("GENAI_API_KEY", "bench")
+
+    pmc_ids = [str(FIRST_SYNTHETIC_ID + i) for i in range(args.child)]
+    start = time.perf_counter()
+    asyncio.run(run_pipeline(pmc_ids, tuple(args.stages)))
+    elapsed = time.perf_counter() - start
+
+    done = len(load_json(SUMMARY_FILE if "scores" in args.stages
+                         else PROCESSED_FILE, {}))
+    latency = {}
+    for (name, labels), hist in metrics.histograms.items():
+        labels = dict(labels)
+        key = labels.get("stage") if name == "stage_seconds" else {
+            "ncbi_request_seconds": "ncbi",
+            "gemini_request_seconds": "gemini",
+        }.get(name)
+        if key and labels.get("status", labels.get("outcome")) in (
+                None, "200", "ok"):
+            latency[key] = [hist.quantile(0.5), hist.quantile(0.99)]
+    print(json.dumps({
+        "articles": args.child,
+        "done": done,
+        "seconds": elapsed,
+        "latency": latency,
+        "peak_rss_mb": peak_rss_mb(),
+        "workers_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "ncbi_throttled": ncbi.stats["throttled"],
+        "gemini_retry_wait": sum(
+            value for (name, _), value in metrics.counters.items()
+            if name == "gemini_retry_wait_seconds_total"),
+    }))
+
+# ========== MAIN ==========
+
+
+def run_size(n, source, args):
+    eutils = StubEutils(SyntheticCorpus(source, n), latency=args.ncbi_latency,
+                        throttle_rate=args.throttle_rate)
+    gemini = StubGemini(latency=args.gemini_latency,
+                        quota_rate=args.quota_rate,
+                        overload_rate=args.overload_rate,
+                        malformed_rate=args.malformed_rate,
+                        retry_delay=args.retry_delay)
+    # the synthetic articles are renumbered copies of the fixtures, which
+    # near-duplicate reuse would answer without classifying them
+    env = dict(os.environ, METRICS_FILE="", DEDUP_REUSE="0",
+               LOG_LEVEL="INFO" if args.verbose else "WARNING")
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", str(n),
+           "--eutils-url", eutils.start(), "--gemini-url", gemini.start(),
+           "--ncbi-rps", str(args.ncbi_rps),
+           "--overload-wait", str(args.overload_wait),
+           "--stages", *args.stages]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            out = subprocess.run(cmd, cwd=tmp, env=env, check=True,
+                                 stdout=subprocess.PIPE, text=True,
+                                 stderr=None if args.verbose
+                                 else subprocess.DEVNULL)
+    finally:
+        eutils.stop()
+        gemini.stop()
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["gemini_requests"] = gemini.requests
+    result["gemini_errors"] = gemini.quota_errors + gemini.overloaded
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default=STORE_FILE,
+                        help="fixtures the synthetic articles are made from")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[100, 1000, 10000, 50000])
+    parser.add_argument("--stages", nargs="+", default=["scores"],
+                        choices=["ingest", "extract", "scores", "labels"])
+    parser.add_argument("--ncbi-latency", type=float, default=0.2)
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="share of efetch requests answered with 429")
+    parser.add_argument("--ncbi-rps", type=float, default=10,
+                        help="client-side efetch rate (10/s with an API key)")
+    parser.add_argument("--gemini-latency", type=float, default=1.0)
+    parser.add_argument("--quota-rate", type=float, default=0.0,
+                        help="share of Gemini requests answered with 429")
+    parser.add_argument("--overload-rate", type=float, default=0.0,
+                        help="share of Gemini requests answered with 503")
+    parser.add_argument("--malformed-rate", type=float, default=0.02,
+                        help="share of batched rows left out or cut short")
+    parser.add_argument("--retry-delay", type=int, default=1,
+                        help="retryDelay sent with each 429, in seconds")
+    parser.add_argument("--overload-wait", type=int, default=2,
+                        help="client wait after a 503 (300s in production)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="show the pipeline's logs and summary")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--eutils-url", help=argparse.SUPPRESS)
+    parser.add_argument("--gemini-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    source = ArticleStore(args.store)
+    print(f"stages {' '.join(args.stages)}; efetch {args.ncbi_latency * 1e3:.0f}"
+          f"ms at {args.ncbi_rps:g}/s, Gemini {args.gemini_latency * 1e3:.0f}ms"
+          f" ({args.quota_rate:.0%} 429, {args.overload_rate:.0%} 503)")
+    results = []
+    for n in args.sizes:
+        results.append(run_size(n, source, args))
+        r = results[-1]
+        print(f"  {n} articles: {r['done']} done in {r['seconds']:.1f}s",
+              flush=True)
+
+    print(f"{'articles':>9}{'seconds':>9}{'art/s':>8}{'peak MB':>9}"
+          f"{'pool MB':>9}{'gemini req':>11}{'errors':>8}{'retry s':>9}"
+          f"{'ncbi 429':>9}")
+    for r in results:
+        rate = r["done"] / r["seconds"] if r["seconds"] else 0.0
+        print(f"{r['articles']:>9}{r['seconds']:>9.1f}{rate:>8.1f}"
+              f"{r['peak_rss_mb']:>9.0f}{r['workers_rss_mb']:>9.0f}"
+              f"{r['gemini_requests']:>11}{r['gemini_errors']:>8}"
+              f"{r['gemini_retry_wait']:>9.0f}{r['ncbi_throttled']:>9}")
+
+    columns = ["ingest", "extract", *[s for s in ("scores", "labels")
+                                      if s in args.stages], "ncbi", "gemini"]
+    print("p50 / p99 latency, ms (stages per call; ingest and scores are "
+          "per batch)")
+    print(f"{'articles':>9}" + "".join(f"{c:>16}" for c in columns))
+    for r in results:
+        cells = []
+        for c in columns:
+            p50, p99 = r["latency"].get(c, (0.0, 0.0))
+            cells.append(f"{p50 * 1e3:>7.0f} /{p99 * 1e3:>7.0f}")
+        print(f"{r['articles']:>9}" + "".join(f"{c:>16}" for c in cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import time
+import numpy as np
+from mapa import (N_NEIGHBORS, RANDOM_STATE, UMAP_N_JOBS, make_reducer,
+                  nearest_neighbor_graph, umap_params)
+
+# Scaling run for the projection engine in mapa.py on synthetic topic-score
+# vectors: clustered 15-dim rows in [0, 1], like the Gemini scores. For each
+# size it times the kNN graph, a seeded single-threaded fit, an unseeded
+# multi-threaded fit, and a second parameter set that reuses the graph
+# ("2nd + graph" is what that set would cost building its own graph).
+#
+#   python bench_projection.py --sizes 1000 10000 100000 --jobs 8
+
+
+def synthetic_scores(n, dims=15, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.random((clusters, dims))
+    labels = rng.integers(clusters, size=n)
+    X = centers[labels] + rng.normal(scale=0.05, size=(n, dims))
+    return np.clip(X, 0, 1).astype(np.float32)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def run(n, jobs, components):
+    X = synthetic_scores(n)
+    params = umap_params(n_components=components)
+    second = umap_params(n_components=2 if components == 3 else 3,
+                         min_dist=0.5)
+
+    knn, t_knn = timed(lambda: nearest_neighbor_graph(X, N_NEIGHBORS, None, jobs))
+    _, t_seeded = timed(lambda: make_reducer(
+        params, RANDOM_STATE, jobs, knn).fit_transform(X))
+    _, t_parallel = timed(lambda: make_reducer(
+        params, None, jobs, knn).fit_transform(X))
+    _, t_reuse = timed(lambda: make_reducer(
+        second, None, jobs, knn).fit_transform(X))
+    return {"n": n, "knn": t_knn, "seeded": t_seeded,
+            "parallel": t_parallel, "reuse": t_reuse}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--jobs", type=int, default=UMAP_N_JOBS)
+    parser.add_argument("--components", type=int, default=3, choices=[2, 3])
+    args = parser.parse_args()
+
+    # compile umap's numba kernels before timing anything
+    run(300, args.jobs, args.components)
+
+    print(f"jobs={args.jobs}, n_components={args.components}; seconds")
+    print(f"{'rows':>8}{'kNN graph':>11}{'seeded fit':>12}"
+          f"{'parallel fit':>14}{'2nd set (reuse)':>17}{'2nd + graph':>16}")
+    for n in args.sizes:
+        r = run(n, args.jobs, args.components)
+        print(f"{r['n']:>8}{r['knn']:>11.2f}{r['seeded']:>12.2f}"
+              f"{r['parallel']:>14.2f}{r['reuse']:>17.2f}"
+              f"{r['reuse'] + r['knn']:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+# Start-up cost of every cli.py subcommand. Each one is run as
+# `python -X importtime cli.py --imports-only <command>`, which does all the
+# imports the command would and stops before any work; the table shows the
+# wall time (best of --repeat), the import time and the slowest top-level
+# imports. It exits non-zero when a command loads a heavy module it has no
+# use for at start-up (HEAVY / ALLOWED) or goes over --budget-ms, so an
+# eager import slipping back in shows up.
+#
+#   python bench_startup.py
+#   python bench_startup.py --umap      also umap's cold vs cached numba start
+#   python bench_startup.py --budget-ms 400
+
+# modules that cost a few hundred ms (or, for umap/numba, seconds)
+HEAVY = ("google.genai", "pandas", "umap", "numba", "sklearn", "httpx")
+# what each command may import before doing any work
+ALLOWED = {
+    "fetch": {"httpx"},
+    "extract": {"httpx"},
+    "classify": {"httpx"},
+    "project": set(),
+    "status": set(),
+}
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(stderr):
+    # [(module, self us, cumulative us, depth)] from -X importtime output
+    rows = []
+    for line in stderr.splitlines():
+        m = IMPORT_LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)),
+                         (len(m.group(3)) - 1) // 2))
+    return rows
+
+
+def measure(command, repeat):
+    cmd = [sys.executable, "-X", "importtime", os.path.join(HERE, "cli.py"),
+           "--imports-only", command]
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run(cmd, cwd=HERE, check=True, text=True,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        wall = time.perf_counter() - start
+        if best is None or wall < best[0]:
+            best = (wall, import_times(out.stderr))
+    return best
+
+
+def heavy_imports(rows):
+    names = {name for name, *_ in rows}
+    return {heavy for heavy in HEAVY
+            if any(n == heavy or n.startswith(heavy + ".") for n in names)}
+
+
+def bench_umap():
+    # import_umap() plus a first fit, twice against one fresh cache dir:
+    # the first run compiles every kernel, the second loads them.
+    code = ("import time; t = time.perf_counter(); import mapa; "
+            "umap = mapa.import_umap(); t1 = time.perf_counter(); "
+            "from bench_projection import synthetic_scores; "
+            "mapa.make_reducer(mapa.umap_params()).fit(synthetic_scores(572)); "
+            "print(t1 - t, time.perf_counter() - t1)")
+    with tempfile.TemporaryDirectory() as cache:
+        env = dict(os.environ, NUMBA_CACHE_DIR=cache, PYTHONWARNINGS="ignore")
+        for run in ("cold", "cached"):
+            out = subprocess.run([sys.executable, "-c", code], cwd=HERE,
+                                 env=env, check=True, text=True,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL)
+            imported, fitted = map(float, out.stdout.split())
+            print(f"  umap {run:<7} import {imported:6.2f}s  "
+                  f"first fit {fitted:6.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commands", nargs="+", default=list(ALLOWED),
+                        choices=list(ALLOWED))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=3,
+                        help="slowest top-level imports listed per command")
+    parser.add_argument("--budget-ms", type=float,
+                        help="fail if a command's wall time exceeds this")
+    parser.add_argument("--umap", action="store_true",
+                        help="also time umap's start with and without the "
+                             "numba cache (~40s)")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'command':<10}{'wall ms':>9}{'import ms':>11}{'modules':>9}"
+          f"  slowest top-level imports")
+    for command in args.commands:
+        wall, rows = measure(command, args.repeat)
+        top = sorted((r for r in rows if r[3] == 0), key=lambda r: -r[2])
+        total = sum(r[2] for r in top)
+        slowest = ", ".join(f"{name} {cum / 1e3:.0f}"
+                            for name, _, cum, _ in top[:args.top])
+        print(f"{command:<10}{wall * 1e3:>9.0f}{total / 1e3:>11.0f}"
+              f"{len(rows):>9}  {slowest}")
+        unexpected = heavy_imports(rows) - ALLOWED[command]
+        if unexpected:
+            failures.append(f"{command} imports {', '.join(sorted(unexpected))}")
+        if args.budget_ms and wall * 1e3 > args.budget_ms:
+            failures.append(f"{command} took {wall * 1e3:.0f}ms "
+                            f"(budget {args.budget_ms:.0f}ms)")
+
+    if args.umap:
+        bench_umap()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
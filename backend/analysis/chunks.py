@@ -0,0 +1,319 @@
+import argparse
+import functools
+import json
+import logging
+import math
+import os
+import re
+import struct
+import time
+from array import array
+import numpy as np
+from article_store import STORE_FILE, ArticleStore, read_blob
+from extract import get_parse_pool, iter_sections, shutdown_parse_pool
+from files import CHUNKS_FILE
+from metrics import setup_logging
+
+# ========== CONFIG ==========
+# words per chunk, and words repeated from the end of the previous chunk
+CHUNK_WORDS = int(os.getenv("CHUNK_WORDS", "200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+# letters and digits, lower-cased; the Java reader uses [\p{L}\p{N}]+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+ABSTRACT_SECTION = "Abstract"
+# body paragraphs before the first heading
+BODY_SECTION = "Body"
+
+log = logging.getLogger(__name__)
+
+# ========== CHUNKING ==========
+# Each article becomes overlapping windows of CHUNK_WORDS words. A window
+# never spans two sections, and every chunk keeps its PMC id, its position
+# in the article and its section heading, so a retrieved passage can be
+# cited.
+
+
+def article_sections(xml):
+    # [(heading, text)] in document order: the abstract, then each run of
+    # body paragraphs under the heading that precedes it.
+    sections = []
+    for kind, text in iter_sections(xml, ("abstract", "headings", "body")):
+        text = " ".join(text.split())
+        if kind == "abstract":
+            sections.append([ABSTRACT_SECTION, [text]])
+        elif kind == "headings":
+            sections.append([text or BODY_SECTION, []])
+        else:
+            if not sections or sections[-1][0] == ABSTRACT_SECTION:
+                sections.append([BODY_SECTION, []])
+            sections[-1][1].append(text)
+    return [(heading, " ".join(parts)) for heading, parts in sections
+            if any(parts)]
+
+
+def split_words(text, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    words = text.split()
+    step = max(1, size - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + size]))
+        if start + size >= len(words):
+            break
+    return chunks
+
+
+def chunk_article(xml, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    return [(heading, chunk) for heading, text in article_sections(xml)
+            for chunk in split_words(text, size, overlap)]
+
+
+def chunk_stored(path, offset, length, codec, size, overlap):
+    # Runs in the parse pool; only the chunk texts cross back.
+    return chunk_article(read_blob(path, offset, length, codec), size, overlap)
+
+# ========== ARTIFACT ==========
+# One little-endian file, written once and memory-mapped by readers (this
+# module and the Spring backend's ChunkIndex). After the header come the
+# sections below, each 8-byte aligned and located by the header's
+# (offset, length) pairs:
+#   chunk_pmc, chunk_ordinal, chunk_section   u32 per chunk
+#   text_offsets (u64, n_chunks + 1) + text   UTF-8 chunk texts
+#   section_offsets + sections                UTF-8 distinct headings
+#   term_offsets + terms                      UTF-8 terms, sorted bytewise
+#   posting_offsets (u64, n_terms + 1)        postings of term t are
+#   posting_docs (u32), posting_weights (f32)   [offsets[t], offsets[t+1])
+# Weights are the chunk's full BM25 contribution for the term, so a query
+# only adds up the weights of its terms' postings.
+
+MAGIC = b"RAG1"
+VERSION = 1
+SECTIONS = (
+    ("chunk_pmc", "<u4"), ("chunk_ordinal", "<u4"), ("chunk_section", "<u4"),
+    ("text_offsets", "<u8"), ("text", "u1"),
+    ("section_offsets", "<u8"), ("sections", "u1"),
+    ("term_offsets", "<u8"), ("terms", "u1"),
+    ("posting_offsets", "<u8"), ("posting_docs", "<u4"),
+    ("posting_weights", "<f4"),
+)
+# magic, version, n_chunks, n_sections, n_terms, n_postings, k1, b, then an
+# (offset, length) pair per section in SECTIONS order
+HEADER = struct.Struct("<4sI4Q2d" + "2Q" * len(SECTIONS))
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def string_table(strings):
+    data = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(data) + 1, dtype="<u8")
+    np.cumsum([len(d) for d in data], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(data), dtype="u1")
+
+
+def bm25_postings(term_ids, doc_ids, tfs, doc_lengths, n_terms):
+    # -> (posting_offsets, docs, weights) grouped by term, docs ascending
+    order = np.lexsort((doc_ids, term_ids))
+    term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+    df = np.bincount(term_ids, minlength=n_terms)
+    offsets = np.zeros(n_terms + 1, dtype="<u8")
+    np.cumsum(df, out=offsets[1:])
+    n = len(doc_lengths)
+    idf = np.log1p((n - df + 0.5) / (df + 0.5))
+    avg_length = doc_lengths.mean() if n else 0.0
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths
+                      / max(avg_length, 1e-9))
+    weights = idf[term_ids] * tfs * (BM25_K1 + 1) / (tfs + norm[doc_ids])
+    return offsets, doc_ids.astype("<u4"), weights.astype("<f4")
+
+
+def write_artifact(path, arrays, counts):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        spans = []
+        for name, dtype in SECTIONS:
+            f.write(b"\0" * (-f.tell() % 8))
+            data = np.ascontiguousarray(arrays[name], dtype=dtype)
+            spans += [f.tell(), data.nbytes]
+            f.write(data.tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, *counts, BM25_K1, BM25_B, *spans))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def build_chunks(store, path=CHUNKS_FILE, size=CHUNK_WORDS,
+                 overlap=CHUNK_OVERLAP):
+    # Chunks every article in the store (parsed in the parse pool) and
+    # writes the artifact; returns the number of chunks.
+    pmc_ids = store.ids()
+    locations = [store.location(pmc_id) for pmc_id in pmc_ids]
+    # an empty store still gets an (empty) artifact; map() needs at least
+    # one location column to stop
+    results = []
+    if locations:
+        results = get_parse_pool().map(
+            functools.partial(chunk_stored, size=size, overlap=overlap),
+            *zip(*locations), chunksize=8)
+
+    vocab = {}
+    headings = {}
+    chunk_pmc, chunk_ordinal, chunk_section = (array("I") for _ in range(3))
+    doc_lengths = array("I")
+    term_ids, doc_ids, tfs = array("I"), array("I"), array("I")
+    texts = []
+    for pmc_id, chunks in zip(pmc_ids, results):
+        for ordinal, (heading, text) in enumerate(chunks):
+            doc = len(chunk_pmc)
+            chunk_pmc.append(int(pmc_id))
+            chunk_ordinal.append(ordinal)
+            chunk_section.append(headings.setdefault(heading, len(headings)))
+            texts.append(text)
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                t = vocab.setdefault(token, len(vocab))
+                counts[t] = counts.get(t, 0) + 1
+            term_ids.extend(counts)
+            tfs.extend(counts.values())
+            doc_ids.extend([doc] * len(counts))
+
+    # terms sorted bytewise so readers can binary-search the table
+    terms = sorted(vocab, key=lambda t: t.encode("utf-8"))
+    rank = np.empty(len(vocab), dtype=np.int64)
+    rank[[vocab[t] for t in terms]] = np.arange(len(terms))
+    posting_offsets, docs, weights = bm25_postings(
+        rank[np.frombuffer(term_ids, dtype=np.uint32)],
+        np.frombuffer(doc_ids, dtype=np.uint32),
+        np.frombuffer(tfs, dtype=np.uint32).astype(np.float64),
+        np.frombuffer(doc_lengths, dtype=np.uint32).astype(np.float64),
+        len(terms))
+    text_offsets, text = string_table(texts)
+    section_offsets, sections = string_table(headings)
+    term_offsets, term_bytes = string_table(terms)
+    write_artifact(path, {
+        "chunk_pmc": chunk_pmc, "chunk_ordinal": chunk_ordinal,
+        "chunk_section": chunk_section,
+        "text_offsets": text_offsets, "text": text,
+        "section_offsets": section_offsets, "sections": sections,
+        "term_offsets": term_offsets, "terms": term_bytes,
+        "posting_offsets": posting_offsets, "posting_docs": docs,
+        "posting_weights": weights,
+    }, (len(texts), len(headings), len(terms), len(docs)))
+    return len(texts)
+
+# ========== RETRIEVAL ==========
+
+
+class ChunkIndex:
+    # Read-only view over the artifact: opening it is one mmap, and terms
+    # are looked up by binary search over the mapped term table.
+
+    def __init__(self, path=CHUNKS_FILE):
+        self.buf = np.memmap(path, dtype="u1", mode="r")
+        header = HEADER.unpack(bytes(self.buf[:HEADER.size]))
+        magic, version = header[:2]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a version {VERSION} chunk index")
+        self.n_chunks, self.n_sections, self.n_terms, self.n_postings = \
+            header[2:6]
+        spans = header[8:]
+        for i, (name, dtype) in enumerate(SECTIONS):
+            offset, length = spans[2 * i], spans[2 * i + 1]
+            setattr(self, name,
+                    self.buf[offset:offset + length].view(dtype))
+
+    @staticmethod
+    def _string(offsets, data, i):
+        return bytes(data[offsets[i]:offsets[i + 1]])
+
+    def term_id(self, term):
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._string(self.term_offsets, self.terms, mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms and \
+                self._string(self.term_offsets, self.terms, lo) == key:
+            return lo
+        return None
+
+    def chunk(self, i):
+        return {
+            "pmc_id": str(self.chunk_pmc[i]),
+            "ordinal": int(self.chunk_ordinal[i]),
+            "section": self._string(self.section_offsets, self.sections,
+                                    self.chunk_section[i]).decode("utf-8"),
+            "text": self._string(self.text_offsets, self.text, i)
+            .decode("utf-8"),
+        }
+
+    def search(self, query, k=10):
+        # [(score, chunk)] best first, BM25 over the query's distinct terms
+        scores = np.zeros(self.n_chunks, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.term_id(term)
+            if t is None:
+                continue
+            start, end = self.posting_offsets[t], self.posting_offsets[t + 1]
+            # a term lists each chunk at most once, so no index repeats
+            scores[self.posting_docs[start:end]] += \
+                self.posting_weights[start:end]
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(float(scores[i]), self.chunk(i)) for i in hits]
+
+# ========== MAIN ==========
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Chunk the article store into a BM25 retrieval index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("build", help="chunk every stored article")
+    p.add_argument("--store", default=STORE_FILE)
+    p.add_argument("--words", type=int, default=CHUNK_WORDS)
+    p.add_argument("--overlap", type=int, default=CHUNK_OVERLAP)
+    p.add_argument("--out", default=CHUNKS_FILE)
+    p = sub.add_parser("search", help="query an existing index")
+    p.add_argument("query")
+    p.add_argument("-k", type=int, default=5)
+    p.add_argument("--index", default=CHUNKS_FILE)
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        try:
+            n = build_chunks(ArticleStore(args.store), args.out, args.words,
+                             args.overlap)
+        finally:
+            shutdown_parse_pool()
+        log.info("%d chunks in %.1fs -> %s (%.1f MB)", n,
+                 time.perf_counter() - start, args.out,
+                 os.path.getsize(args.out) / 1e6)
+        return
+
+    start = time.perf_counter()
+    index = ChunkIndex(args.index)
+    opened = time.perf_counter()
+    hits = index.search(args.query, args.k)
+    done = time.perf_counter()
+    print(json.dumps([{"score": round(score, 3), **chunk}
+                      for score, chunk in hits], indent=2))
+    print(f"{index.n_chunks} chunks, open {(opened - start) * 1e3:.1f} ms, "
+          f"query {(done - opened) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from tenacity import RetryError
+from gemini import MODEL, ask_gemini, ask_gemini_uncached
+from llm_cache import LLM_OFFLINE, get_llm_cache, response_key
+from metrics import inc
+
+# ========== CONFIG ==========
+TOPICS = [
+    "Molecular Biology",
+    "Space Biology",
+    "Microgravity",
+    "Space Medicine",
+    "Radiation Biology",
+    "Immunology",
+    "Genomics",
+    "Bioinformatics & Systems Biology",
+    "Bone-related Biology",
+    "Cardiovascular-related Biology",
+    "Microbiology",
+    "Astrobiology",
+    "Plant Biology & Space Agriculture",
+    "Stem Cell & Regenerative Medicine",
+    "Oxidative Stress & Aging Biology",
+]
+# input + expected output tokens allowed in one batched request
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", "30000"))
+# rough English-text ratio; only used to size batches
+CHARS_PER_TOKEN = 4
+# 15 numbers plus the id and JSON punctuation
+OUTPUT_TOKENS_PER_ARTICLE = 120
+# batched attempts per article before falling back to a single request
+MAX_BATCH_ATTEMPTS = 2
+
+log = logging.getLogger(__name__)
+
+TOPIC_LINES = "\n".join(TOPICS)
+
+SCORE_PROMPT = f"""
+Hello Gemini! I will give you a text. You must analyze how strongly it relates to each of the following 15 established scientific topics:
+{TOPIC_LINES}
+For each topic, output a decimal value between 0 and 1 (with up to 3 decimals), representing how strongly the text relates to that topic.
+Output only the 15 decimal numbers in order, separated by commas and please dont skip to the next line. No explanations, no extra text.
+"""
+
+BATCH_SCORE_PROMPT = f"""
+Hello Gemini! I will give you several texts, each one starting with a line "=== ARTICLE <id> ===". For every text, you must analyze how strongly it relates to each of the following 15 established scientific topics:
+{TOPIC_LINES}
+For each topic, output a decimal value between 0 and 1 (with up to 3 decimals), representing how strongly the text relates to that topic.
+Answer with a JSON object only: its keys are the article ids and each value is the list of the 15 numbers in the topic order above. Include every article id exactly once. No explanations, no extra text.
+"""
+
+JSON_CONFIG = {"response_mime_type": "application/json"}
+
+# gen.py's topic labels: up to three topic names for the full paper text
+LABEL_PROMPT = """
+You are given a list of scientific topics separated by commas:
+Molecular Biology, Space Biology, Microgravity, Space Medicine, Radiation Biology, Immunology, Genomics, Bioinformatics & Systems Biology, Bone-related Biology, Cardiovascular-related Biology, Microbiology, Astrobiology, Plant Biology & Space Agriculture, Stem Cell & Regenerative Medicine, Oxidative Stress & Aging Biology.
+Your task is:
+Given a full scientific paper as input, determine if the paper corresponds to any of the listed topics with at least 90% relevance. Output up to three topics (maximum) that best match the article, ordered by relevance.
+Output only the topics, separated by commas, without any explanations, greetings, or additional text.
+"""
+
+# ========== SCORE VALIDATION ==========
+
+
+def parse_score_row(row):
+    # Accepts the single-request comma string or a JSON list; returns 15
+    # floats in [0, 1] or None.
+    if isinstance(row, str):
+        row = [part for part in row.strip().split(",") if part.strip()]
+    if not isinstance(row, list) or len(row) != len(TOPICS):
+        return None
+    try:
+        values = [float(v) for v in row]
+    except (TypeError, ValueError):
+        return None
+    if any(not 0.0 <= v <= 1.0 for v in values):
+        return None
+    return values
+
+
+def format_scores(values):
+    # Same shape as the single-request answer stored in result.json.
+    return ",".join(f"{v:g}" for v in values)
+
+
+def is_score_row(summary):
+    return parse_score_row(summary) is not None
+
+
+def request_failed(pmc_ids, output, error):
+    # A request that failed for good (quota retries spent, an input Gemini
+    # rejects, ...) costs only its own articles: they get no result, so the
+    # next run picks them up again.
+    if isinstance(error, RetryError):
+        error = error.last_attempt.exception()
+    inc("classify_failed_total", len(pmc_ids), output=output)
+    label = (f"PMC{pmc_ids[0]}" if len(pmc_ids) == 1
+             else f"{len(pmc_ids)} articles")
+    log.error("Gemini %s request for %s failed (%s: %s); left for the next "
+              "run", output, label, type(error).__name__, error,
+              extra={"pmc_ids": list(pmc_ids), "output": output})
+
+
+# ========== SINGLE-ARTICLE CLASSIFICATION ==========
+
+
+async def summarize_scores(text):
+    # only a reply that parses as 15 scores is returned (or cached)
+    return await ask_gemini(text, SCORE_PROMPT, validate=is_score_row)
+
+
+async def summarize_labels(text):
+    return await ask_gemini(text, LABEL_PROMPT)
+
+
+# ========== BATCHED CLASSIFICATION ==========
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_batches(items, token_budget=BATCH_TOKEN_BUDGET):
+    # Greedy packing in arrival order; an article that is larger than the
+    # budget on its own still gets a batch of one.
+    prompt_cost = estimate_tokens(BATCH_SCORE_PROMPT)
+    batches = []
+    batch = []
+    used = prompt_cost
+    for pmc_id, text in items:
+        cost = estimate_tokens(text) + OUTPUT_TOKENS_PER_ARTICLE
+        if batch and used + cost > token_budget:
+            batches.append(batch)
+            batch = []
+            used = prompt_cost
+        batch.append((pmc_id, text))
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def parse_batch_response(response_text, pmc_ids):
+    # Returns ({pmc_id: [15 floats]}, [ids whose rows were missing/invalid]).
+    try:
+        rows = json.loads(response_text)
+    except (TypeError, json.JSONDecodeError):
+        return {}, list(pmc_ids)
+    if isinstance(rows, list):
+        # tolerate [{"id": ..., "scores": [...]}, ...]
+        rows = {str(r.get("id")): r.get("scores")
+                for r in rows if isinstance(r, dict)}
+    if not isinstance(rows, dict):
+        return {}, list(pmc_ids)
+    rows = {str(k).removeprefix("PMC"): v for k, v in rows.items()}
+
+    good = {}
+    bad = []
+    for pmc_id in pmc_ids:
+        values = parse_score_row(rows.get(pmc_id))
+        if values is None:
+            bad.append(pmc_id)
+        else:
+            good[pmc_id] = values
+    return good, bad
+
+
+def row_key(text):
+    # Batched answers are cached per article, not per batch, so a re-run
+    # only pays for articles whose text (or the prompt/model) changed, no
+    # matter how the batches get packed this time.
+    return response_key(MODEL, BATCH_SCORE_PROMPT, text, JSON_CONFIG)
+
+
+def cached_scores(text):
+    # A batched row or an earlier single-article answer for the same text;
+    # a malformed one (cached before answers were validated) is a miss.
+    cache = get_llm_cache()
+    summary = None
+    for key in (row_key(text), response_key(MODEL, SCORE_PROMPT, text)):
+        summary = cache.get(key, count=False)
+        if summary is not None and is_score_row(summary):
+            break
+        summary = None
+    cache.count(summary is not None)
+    return summary
+
+
+async def classify_batch(batch):
+    body = "\n\n".join(f"=== ARTICLE {pmc_id} ===\n{text}"
+                       for pmc_id, text in batch)
+    response = await ask_gemini_uncached(body, BATCH_SCORE_PROMPT, JSON_CONFIG)
+    good, bad = parse_batch_response(response, [pmc_id for pmc_id, _ in batch])
+    inc("classify_batch_rows_total", len(good), result="ok")
+    inc("classify_batch_rows_total", len(bad), result="malformed")
+    cache = get_llm_cache()
+    texts = dict(batch)
+    for pmc_id, values in good.items():
+        cache.put(row_key(texts[pmc_id]), MODEL, format_scores(values))
+    return good, bad
+
+
+def new_classify_stats():
+    return {"articles": 0, "cached": 0, "batch_requests": 0,
+            "requeued": 0, "single_requests": 0, "skipped": 0, "failed": 0}
+
+
+def print_classify_stats(stats):
+    log.info("Classified %d articles: %d from cache, %d batched and %d single "
+             "requests (%d re-queued, %d skipped offline, %d failed)",
+             stats["articles"], stats["cached"], stats["batch_requests"],
+             stats["single_requests"], stats["requeued"], stats["skipped"],
+             stats["failed"], extra=stats)
+
+
+async def classify_articles(items, on_result, token_budget=BATCH_TOKEN_BUDGET,
+                            stats=None):
+    # items: iterable of (pmc_id, text). on_result(pmc_id, summary) is called
+    # with the comma-separated score string as soon as a row validates.
+    # Articles with malformed rows are re-queued into later batches; after
+    # MAX_BATCH_ATTEMPTS they are sent on their own with SCORE_PROMPT. A
+    # request that raises only loses its own articles (request_failed).
+    # Pass a stats dict to accumulate over several calls instead of
+    # printing a summary.
+    texts = dict(items)
+    report = stats is None
+    if report:
+        stats = new_classify_stats()
+    stats["articles"] += len(texts)
+
+    queue = deque()
+    for pmc_id, text in texts.items():
+        summary = cached_scores(text)
+        if summary is not None:
+            stats["cached"] += 1
+            on_result(pmc_id, summary)
+        elif LLM_OFFLINE:
+            stats["skipped"] += 1
+        else:
+            queue.append(pmc_id)
+    attempts = dict.fromkeys(queue, 0)
+
+    async def run_batch(batch):
+        stats["batch_requests"] += 1
+        try:
+            good, bad = await classify_batch(batch)
+        except Exception as e:
+            request_failed([pmc_id for pmc_id, _ in batch], "scores", e)
+            stats["failed"] += len(batch)
+            return []
+        for pmc_id, values in good.items():
+            on_result(pmc_id, format_scores(values))
+        return bad
+
+    async def run_single(pmc_id):
+        stats["single_requests"] += 1
+        try:
+            summary = await summarize_scores(texts[pmc_id])
+        except Exception as e:
+            request_failed([pmc_id], "scores", e)
+            stats["failed"] += 1
+            return
+        if summary is not None:
+            on_result(pmc_id, summary)
+
+    while queue:
+        pending = [(pmc_id, texts[pmc_id]) for pmc_id in queue]
+        queue.clear()
+        for pmc_id, _ in pending:
+            attempts[pmc_id] += 1
+        results = await asyncio.gather(
+            *(run_batch(batch) for batch in pack_batches(pending, token_budget)))
+
+        singles = []
+        for bad in results:
+            for pmc_id in bad:
+                if attempts[pmc_id] < MAX_BATCH_ATTEMPTS:
+                    stats["requeued"] += 1
+                    queue.append(pmc_id)
+                else:
+                    singles.append(pmc_id)
+        if singles:
+            log.warning("%d articles failed batched classification, "
+                        "sending them one at a time", len(singles))
+            await asyncio.gather(*(run_single(pmc_id) for pmc_id in singles))
+
+    if report:
+        print_classify_stats(stats)
+    return stats
@@ -0,0 +1,139 @@
+import argparse
+import os
+from dotenv import load_dotenv
+from metrics import setup_logging
+
+load_dotenv()
+
+# python cli.py fetch                 fill the article store from test.csv
+# python cli.py extract               ... and parse the articles into the text cache
+# python cli.py classify              Gemini scores and topic labels
+# python cli.py classify --only scores
+# python cli.py project               topic index, related articles, 3D map
+# python cli.py status                what the outputs hold so far
+#
+# One entry point for the steps `python -m pipeline` runs, where each
+# subcommand imports only what it uses: nothing loads the Gemini SDK until a
+# request is made, pandas until a CSV is read, or umap/numba until a map
+# has to be fitted (with its compiled kernels cached, see mapa.import_umap).
+# bench_startup.py times every subcommand's imports.
+
+# ========== COMMANDS ==========
+# --imports-only (for bench_startup.py) stops each command right after
+# its imports.
+
+
+def run_stages(args, stages):
+    import asyncio
+    from metadata import iter_pmc_ids
+    from pipeline import run_pipeline
+    if args.imports_only:
+        return
+    asyncio.run(run_pipeline(iter_pmc_ids(args.input), stages))
+
+
+def fetch(args):
+    run_stages(args, ("ingest",))
+
+
+def extract(args):
+    run_stages(args, ("ingest", "extract"))
+
+
+def classify(args):
+    run_stages(args, tuple(args.only or ("scores", "labels")))
+
+
+def project(args):
+    from indexes import build_indexes
+    if args.imports_only:
+        return
+    build_indexes()
+
+
+def file_size(path):
+    return f"{os.path.getsize(path) / 1e6:.1f} MB" if os.path.exists(path) \
+        else "missing"
+
+
+def npz_rows(path, key="ids"):
+    import numpy as np
+    if not os.path.exists(path):
+        return 0
+    with np.load(path) as f:
+        return len(f[key])
+
+
+def chunk_rows(path):
+    from chunks import ChunkIndex
+    return ChunkIndex(path).n_chunks if os.path.exists(path) else 0
+
+
+def status(args):
+    # Read-only: journals are read, never replayed into place, so this is
+    # safe to run next to a live pipeline.
+    from article_store import STORE_FILE, ArticleStore
+    from files import (CHUNKS_FILE, DEDUP_FILE, LAYOUT_FILE, NEIGHBORS_FILE,
+                       NUMBA_CACHE_DIR, PROCESSED_FILE, SUMMARY_FILE,
+                       TOPICS_FILE)
+    from journal import journaled_keys, load_json
+    if args.imports_only:
+        return
+
+    rows = [
+        ("articles", len(ArticleStore(STORE_FILE)) if os.path.exists(STORE_FILE)
+         else 0, STORE_FILE, file_size(STORE_FILE)),
+        ("scored", len(journaled_keys(SUMMARY_FILE)), SUMMARY_FILE,
+         file_size(SUMMARY_FILE)),
+        ("labelled", len(journaled_keys(PROCESSED_FILE)), PROCESSED_FILE,
+         file_size(PROCESSED_FILE)),
+        ("topics", len(load_json(TOPICS_FILE, {})), TOPICS_FILE,
+         file_size(TOPICS_FILE)),
+        ("related", npz_rows(NEIGHBORS_FILE), NEIGHBORS_FILE,
+         file_size(NEIGHBORS_FILE)),
+        # near-duplicates share a projected point (see dedup.py)
+        ("projected", npz_rows(LAYOUT_FILE), LAYOUT_FILE,
+         file_size(LAYOUT_FILE)),
+        ("chunks", chunk_rows(CHUNKS_FILE), CHUNKS_FILE,
+         file_size(CHUNKS_FILE)),
+        ("signed", npz_rows(DEDUP_FILE), DEDUP_FILE, file_size(DEDUP_FILE)),
+    ]
+    for name, count, path, size in rows:
+        print(f"{name:<10}{count:>8}  {path} ({size})")
+    kernels = sum(name.endswith(".nbc") for _, _, names in os.walk(
+        NUMBA_CACHE_DIR) for name in names)
+    print(f"{'kernels':<10}{kernels:>8}  {NUMBA_CACHE_DIR}"
+          + ("" if kernels else " (the next map fit compiles umap)"))
+
+
+COMMANDS = {
+    "fetch": fetch,
+    "extract": extract,
+    "classify": classify,
+    "project": project,
+    "status": status,
+}
+
+# ========== MAIN ==========
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python cli.py")
+    parser.add_argument("--imports-only", action="store_true",
+                        help=argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("fetch", "extract", "classify"):
+        command = commands.add_parser(name)
+        command.add_argument("--input", default="test.csv",
+                             help="CSV with a 'url' column of PMC article links")
+    commands.choices["classify"].add_argument(
+        "--only", action="append", choices=["scores", "labels"])
+    commands.add_parser("project")
+    commands.add_parser("status")
+    args = parser.parse_args()
+    setup_logging()
+    COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import zlib
+import numpy as np
+from article_store import get_article_store
+from extract import extract_many, shutdown_parse_pool
+from files import DEDUP_FILE
+from metrics import setup_logging
+
+# ========== CONFIG ==========
+# estimated Jaccard similarity of word shingles above which two articles
+# count as near-duplicates
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+SHINGLE_WORDS = 5
+# BANDS x ROWS MinHash permutations. A pair lands in a shared bucket with
+# probability 1 - (1 - s^ROWS)^BANDS: ~0.98 at s=0.8, under 0.1 at s=0.5
+BANDS = 16
+ROWS = 8
+NUM_PERM = BANDS * ROWS
+SEED = 1
+MERSENNE_PRIME = (1 << 61) - 1
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+log = logging.getLogger(__name__)
+
+# ========== MINHASH ==========
+# One signature per article over the set of 5-word shingles of its
+# extracted text. Hashes are crc32-based rather than Python's hash() so
+# signatures stay comparable across processes and runs.
+
+_rng = np.random.default_rng(SEED)
+_PERM_A = _rng.integers(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def shingle_hashes(text, k=SHINGLE_WORDS):
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    h = np.array([zlib.crc32(w.encode("utf-8")) for w in words],
+                 dtype=np.uint64)
+    if len(h) < k:
+        k = len(h)
+    # polynomial hash of each window of k word hashes, mod 2^32
+    shingles = np.zeros(len(h) - k + 1, dtype=np.uint64)
+    for j in range(k):
+        shingles = (shingles * np.uint64(1000003) + h[j:len(h) - k + 1 + j]) \
+            & np.uint64(0xFFFFFFFF)
+    return np.unique(shingles)
+
+
+def minhash(text, chunk=4096):
+    # uint32[NUM_PERM] signature, or None for text without words
+    shingles = shingle_hashes(text)
+    if len(shingles) == 0:
+        return None
+    signature = np.full(NUM_PERM, 0xFFFFFFFF, dtype=np.uint64)
+    for start in range(0, len(shingles), chunk):
+        x = shingles[start:start + chunk]
+        # a < 2^32 and x < 2^32, so a*x + b fits in 64 bits
+        hashed = ((_PERM_A[:, None] * x[None, :] + _PERM_B[:, None])
+                  % np.uint64(MERSENNE_PRIME)) & np.uint64(0xFFFFFFFF)
+        np.minimum(signature, hashed.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def similarity(a, b):
+    # estimated Jaccard similarity of the two shingle sets
+    return float(np.mean(a == b))
+
+# ========== LSH INDEX ==========
+# Signatures split into BANDS bands of ROWS values; articles sharing any
+# band's values share a bucket. A query looks up one bucket per band, so it
+# only compares against likely matches instead of the whole corpus.
+
+
+class DedupIndex:
+    def __init__(self, ids=(), signatures=None):
+        self.ids = []
+        self.row = {}
+        self.signatures = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self.buckets = [{} for _ in range(BANDS)]
+        self.dirty = False
+        if signatures is not None and len(ids):
+            self._extend(list(ids), np.asarray(signatures, dtype=np.uint32))
+            self.dirty = False
+
+    @staticmethod
+    def _keys(signature):
+        return [signature[b * ROWS:(b + 1) * ROWS].tobytes()
+                for b in range(BANDS)]
+
+    def _extend(self, ids, signatures):
+        start = len(self.ids)
+        self.ids.extend(ids)
+        self.signatures = np.concatenate([self.signatures, signatures])
+        for i, (pmc_id, signature) in enumerate(zip(ids, signatures),
+                                                start):
+            self.row[pmc_id] = i
+            for band, key in zip(self.buckets, self._keys(signature)):
+                band.setdefault(key, []).append(i)
+        self.dirty = True
+
+    def __contains__(self, pmc_id):
+        return pmc_id in self.row
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, pmc_id, signature):
+        # A changed article gets a new row; its old buckets point at a row
+        # no longer in self.row and are skipped by candidates().
+        if pmc_id in self.row:
+            old = self.row.pop(pmc_id)
+            if np.array_equal(self.signatures[old], signature):
+                self.row[pmc_id] = old
+                return
+        self._extend([pmc_id], signature[None, :])
+
+    def candidates(self, signature):
+        rows = set()
+        for band, key in zip(self.buckets, self._keys(signature)):
+            rows.update(band.get(key, ()))
+        return [i for i in rows if self.row.get(self.ids[i]) == i]
+
+    def query(self, signature, threshold=DEDUP_THRESHOLD, exclude=None):
+        # [(pmc_id, similarity)] at or above threshold, most similar first
+        rows = [i for i in self.candidates(signature)
+                if self.ids[i] != exclude]
+        if not rows:
+            return []
+        sims = (self.signatures[rows] == signature).mean(axis=1)
+        order = np.argsort(-sims, kind="stable")
+        return [(self.ids[rows[i]], float(sims[i])) for i in order
+                if sims[i] >= threshold]
+
+    def groups(self, threshold=DEDUP_THRESHOLD):
+        # Near-duplicate clusters (connected components over pairs at or
+        # above threshold), largest first; singletons are left out.
+        parent = {}
+
+        def find(i):
+            while parent.get(i, i) != i:
+                parent[i] = parent.get(parent[i], parent[i])
+                i = parent[i]
+            return i
+
+        for band in self.buckets:
+            for rows in band.values():
+                rows = [i for i in rows if self.row.get(self.ids[i]) == i]
+                for a, i in enumerate(rows):
+                    for j in rows[a + 1:]:
+                        ri, rj = find(i), find(j)
+                        if ri != rj and similarity(
+                                self.signatures[i],
+                                self.signatures[j]) >= threshold:
+                            parent.setdefault(ri, ri)
+                            parent.setdefault(rj, rj)
+                            parent[max(ri, rj)] = min(ri, rj)
+        clusters = {}
+        for i in parent:
+            clusters.setdefault(find(i), []).append(i)
+        return sorted(([self.ids[i] for i in sorted(rows)]
+                       for rows in clusters.values() if len(rows) > 1),
+                      key=len, reverse=True)
+
+    def save(self, path=DEDUP_FILE):
+        rows = sorted(self.row.values())
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, ids=np.asarray([self.ids[i] for i in rows]),
+                     signatures=self.signatures[rows], num_perm=NUM_PERM,
+                     seed=SEED, shingle_words=SHINGLE_WORDS)
+        os.replace(tmp, path)
+        self.dirty = False
+
+
+def load_dedup_index(path=DEDUP_FILE):
+    # An empty index when the file is missing or was built with other
+    # MinHash parameters (its signatures wouldn't be comparable).
+    if os.path.exists(path):
+        with np.load(path) as f:
+            if (int(f["num_perm"]) == NUM_PERM and int(f["seed"]) == SEED
+                    and int(f["shingle_words"]) == SHINGLE_WORDS):
+                return DedupIndex(f["ids"].tolist(), f["signatures"])
+        log.info("%s was built with other MinHash parameters, ignoring it",
+                 path)
+    return DedupIndex()
+
+
+def representatives(groups, ids=None):
+    # {pmc_id: the id standing in for it} for every duplicate; the first
+    # member of each group (restricted to `ids` when given) represents it.
+    keep = None if ids is None else set(ids)
+    out = {}
+    for group in groups:
+        members = [m for m in group if keep is None or m in keep]
+        for member in members[1:]:
+            out[member] = members[0]
+    return out
+
+# ========== BUILD ==========
+
+
+async def index_store(index, mode="paragraphs"):
+    # Signs every stored article the index doesn't have yet; extracted text
+    # comes from the text cache where possible. Returns how many were added.
+    pmc_ids = [pid for pid in get_article_store().ids() if pid not in index]
+    added = 0
+    async for pmc_id, text in extract_many(pmc_ids, mode):
+        signature = minhash(text)
+        if signature is not None:
+            index.add(pmc_id, signature)
+            added += 1
+    return added
+
+# ========== MAIN ==========
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find near-duplicate articles in the article store")
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD)
+    parser.add_argument("--index", default=DEDUP_FILE)
+    parser.add_argument("--json", help="also write the groups to this file")
+    args = parser.parse_args()
+    setup_logging()
+
+    index = load_dedup_index(args.index)
+    try:
+        added = asyncio.run(index_store(index))
+    finally:
+        shutdown_parse_pool()
+    if index.dirty:
+        index.save(args.index)
+    groups = index.groups(args.threshold)
+    log.info("%d articles signed (%d new), %d near-duplicate groups "
+             "covering %d articles", len(index), added, len(groups),
+             sum(len(g) for g in groups))
+    for group in groups:
+        print(" ".join(f"PMC{pmc_id}" for pmc_id in group))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(groups, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import io
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+from article_store import get_article_store, read_blob
+from metrics import observe, setup_logging, timed
+from text_cache import content_hash, get_text_cache
+
+# ========== CONFIG ==========
+PARSE_WORKERS = os.cpu_count() or 1
+
+# Sections the extractor knows how to emit. "abstract" is what main.py sends
+# to Gemini, "paragraphs" (every <p>) is what gen.py sends. "body" and
+# "headings" are the <p>s and <sec> titles inside <body> only.
+SECTIONS = ("abstract", "paragraphs", "body", "title", "headings")
+
+log = logging.getLogger(__name__)
+
+# ========== STREAMING EXTRACTOR ==========
+
+
+def _sections_of(tag, stack):
+    # stack holds the tags of the open ancestors of the element, innermost last
+    if tag == "abstract":
+        return ("abstract",)
+    if tag == "p":
+        return ("paragraphs", "body") if "body" in stack else ("paragraphs",)
+    if tag == "article-title" and stack and stack[-1] == "title-group":
+        return ("title",)
+    if tag == "title" and stack and stack[-1] == "sec" and "body" in stack:
+        return ("headings",)
+    return ()
+
+
+def _open_source(source):
+    if isinstance(source, str) and source.lstrip().startswith("<"):
+        return io.BytesIO(source.encode("utf-8")), "utf-8"
+    if isinstance(source, bytes):
+        return io.BytesIO(source), None
+    return source, None
+
+
+def iter_sections(source, sections=("abstract",)):
+    """Yield (section, text) pairs in document order.
+
+    source may be an XML string, bytes, a path or a binary file object. Only
+    the requested sections are materialised; every other element is dropped
+    as soon as its end tag has been read, so memory stays bounded by the
+    largest single captured element instead of the whole article.
+    """
+    wanted = set(sections)
+    fh, encoding = _open_source(source)
+    context = etree.iterparse(
+        fh,
+        events=("start", "end"),
+        encoding=encoding,
+        remove_comments=True,
+        remove_pis=True,
+        resolve_entities=False,
+        no_network=True,
+        recover=True,
+        huge_tree=True,
+    )
+
+    stack = []        # tags of open elements
+    capturing = []    # (element, slot index) of open captured elements
+    pending = []      # [section, text] slots, filled in on end events
+    emitted = 0
+
+    for event, elem in context:
+        tag = elem.tag
+        if event == "start":
+            if isinstance(tag, str):
+                for section in _sections_of(tag, stack):
+                    if section in wanted:
+                        capturing.append((elem, len(pending)))
+                        pending.append([section, None])
+            stack.append(tag)
+            continue
+
+        stack.pop()
+        while capturing and capturing[-1][0] is elem:
+            _, slot = capturing.pop()
+            pending[slot][1] = "".join(elem.itertext())
+
+        if not capturing:
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+        while emitted < len(pending) and pending[emitted][1] is not None:
+            yield tuple(pending[emitted])
+            pending[emitted] = None
+            emitted += 1
+
+    del context
+
+
+def extract_sections(source, sections=("abstract",)):
+    out = {section: [] for section in sections}
+    for section, text in iter_sections(source, sections):
+        out[section].append(text)
+    return out
+
+
+def extract_text(xml_content, mode="abstract"):
+    # Same output as the old BeautifulSoup version:
+    #   "abstract"   -> "\n".join(a.get_text() for a in soup.find_all("abstract"))
+    #   "paragraphs" -> "\n".join(p.get_text() for p in soup.find_all("p"))
+    if not xml_content:
+        return ""
+    return "\n".join(text for _, text in iter_sections(xml_content, (mode,)))
+
+
+def extract_texts(xml_content, modes):
+    # Several sections from a single parse: {mode: text}, each joined as
+    # extract_text would.
+    if not xml_content:
+        return {mode: "" for mode in modes}
+    return {mode: "\n".join(parts)
+            for mode, parts in extract_sections(xml_content, modes).items()}
+
+
+def extract_stored(path, offset, length, codec, mode="abstract"):
+    # Workers read the article straight out of the store so only the
+    # extracted text crosses the process boundary.
+    return extract_text(read_blob(path, offset, length, codec), mode)
+
+
+def extract_stored_texts(path, offset, length, codec, modes):
+    return extract_texts(read_blob(path, offset, length, codec), modes)
+
+
+# ========== PARSE POOL ==========
+# XML parsing is CPU bound; running it inline on the event loop stalls every
+# in-flight HTTP and Gemini coroutine. The pool is created on first use and
+# shared by every caller in the process.
+
+_parse_pool = None
+
+
+def get_parse_pool():
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    return _parse_pool
+
+
+def shutdown_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown()
+        _parse_pool = None
+
+
+async def extract_text_async(xml_content, mode="abstract"):
+    if not xml_content:
+        return ""
+    # timed from this side of the pool: extract_parse_seconds includes the
+    # wait for a free worker
+    loop = asyncio.get_running_loop()
+    with timed("extract_parse_seconds"):
+        return await loop.run_in_executor(
+            get_parse_pool(), extract_text, xml_content, mode)
+
+
+async def extract_cached(pmc_id, xml_content, mode="abstract", xml_hash=None):
+    # Serves the text from the extracted-text cache when the source XML is
+    # unchanged; otherwise parses in the pool and stores the result.
+    if not xml_content:
+        return ""
+    cache = get_text_cache()
+    if xml_hash is None:
+        xml_hash = content_hash(xml_content)
+    text = cache.get(pmc_id, mode, xml_hash)
+    if text is None:
+        text = await extract_text_async(xml_content, mode)
+        cache.put(pmc_id, mode, xml_hash, text)
+    return text
+
+
+async def extract_stored_cached(pmc_id, modes):
+    # {mode: text} for an article in the article store, or None if it isn't
+    # there. Cached modes are served by hash; the rest come from one parse
+    # in the pool, reading the XML straight from the store.
+    store = get_article_store()
+    location = store.location(pmc_id)
+    if location is None:
+        return None
+    xml_hash = store.get_hash(pmc_id)
+    cache = get_text_cache()
+    texts = {mode: cache.get(pmc_id, mode, xml_hash) for mode in modes}
+    missing = tuple(mode for mode, text in texts.items() if text is None)
+    if missing:
+        loop = asyncio.get_running_loop()
+        with timed("extract_parse_seconds"):
+            parsed = await loop.run_in_executor(
+                get_parse_pool(), extract_stored_texts, *location, missing)
+        for mode in missing:
+            cache.put(pmc_id, mode, xml_hash, parsed[mode])
+            texts[mode] = parsed[mode]
+    return texts
+
+
+async def extract_many(pmc_ids, mode="abstract", use_cache=True):
+    # Async generator over (pmc_id, text) in completion order for articles
+    # already in the article store. At most two jobs per worker are queued at
+    # once so results stream back instead of piling up. Cache hits are
+    # answered from the store's hash index without reading the XML at all.
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    store = get_article_store()
+    cache = get_text_cache() if use_cache else None
+    pmc_ids = iter(pmc_ids)
+    in_flight = {}
+    ready = []
+
+    def submit_next():
+        for pmc_id in pmc_ids:
+            location = store.location(pmc_id)
+            if location is None:
+                continue
+            xml_hash = store.get_hash(pmc_id)
+            if cache is not None:
+                text = cache.get(pmc_id, mode, xml_hash)
+                if text is not None:
+                    ready.append((pmc_id, text))
+                    continue
+            fut = loop.run_in_executor(pool, extract_stored, *location, mode)
+            in_flight[fut] = (pmc_id, xml_hash, time.monotonic())
+            return True
+        return False
+
+    for _ in range(2 * PARSE_WORKERS):
+        if not submit_next():
+            break
+
+    while ready or in_flight:
+        while ready:
+            yield ready.pop()
+            # keep the generator responsive on long runs of cache hits
+            await asyncio.sleep(0)
+        if not in_flight:
+            if not submit_next():
+                break
+            continue
+        done, _ = await asyncio.wait(
+            in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for fut in done:
+            pmc_id, xml_hash, start = in_flight.pop(fut)
+            observe("extract_parse_seconds", time.monotonic() - start)
+            text = fut.result()
+            if cache is not None:
+                cache.put(pmc_id, mode, xml_hash, text)
+            submit_next()
+            yield pmc_id, text
+
+
+# ========== RE-EXTRACT STORE ==========
+
+
+async def _watch_loop(stalls, interval=0.001):
+    # Records how late the loop wakes up; a busy loop shows up as lateness.
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        stalls.append(loop.time() - start - interval)
+
+
+async def reextract_store(mode, use_cache=True):
+    pmc_ids = get_article_store().ids()
+    stalls = []
+    watcher = asyncio.create_task(_watch_loop(stalls))
+    start = time.perf_counter()
+    chars = 0
+    async for _, text in extract_many(pmc_ids, mode, use_cache):
+        chars += len(text)
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    worst = max(stalls) * 1000 if stalls else 0.0
+    log.info("Extracted %d articles (%d chars) with %d workers in %.2fs; "
+             "worst event-loop stall %.1fms", len(pmc_ids), chars,
+             PARSE_WORKERS, elapsed, worst)
+    if use_cache:
+        cache = get_text_cache()
+        log.info("Text cache: %d hits, %d misses", cache.hits, cache.misses)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-extract every article in the article store")
+    parser.add_argument("--mode", default="abstract", choices=SECTIONS)
+    parser.add_argument("--workers", type=int, default=PARSE_WORKERS)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignore and don't fill the extracted-text cache")
+    args = parser.parse_args()
+    setup_logging()
+    PARSE_WORKERS = args.workers
+    try:
+        asyncio.run(reextract_store(args.mode, not args.no_cache))
+    finally:
+        shutdown_parse_pool()
@@ -0,0 +1,26 @@
+import os
+
+# ========== FILES ==========
+# Where the analysis artifacts live, relative to the folder the scripts run
+# in. They sit here rather than beside the code that writes them so that a
+# light command like `cli.py status` can name them without importing that
+# code (and httpx, the Gemini client or umap with it).
+
+# journaled pipeline outputs (pipeline/stages.py)
+SUMMARY_FILE = "result.json"
+PROCESSED_FILE = "processed.json"
+TOPICS_FILE = "topics.json"
+# related articles (neighbors.py)
+NEIGHBORS_FILE = "neighbors.npz"
+# MinHash signatures of the stored articles (dedup.py)
+DEDUP_FILE = "dedup.npz"
+# full-text chunks and their BM25 index (chunks.py)
+CHUNKS_FILE = "chunks.bin"
+# the 3D map (mapa.py)
+OUTPUT_FILE = "output_3d.json"
+# fitted UMAP reducer (only needed to refit or for --exact transforms)
+MODEL_FILE = "umap_model.pkl"
+# ids, scores and coordinates of every article placed so far
+LAYOUT_FILE = "umap_layout.npz"
+# compiled numba kernels of umap/pynndescent, kept across runs
+NUMBA_CACHE_DIR = os.path.abspath(os.getenv("NUMBA_CACHE_DIR", ".numba_cache"))
@@ -0,0 +1,206 @@
+from tenacity.wait import wait_base
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_fixed
+import os
+import asyncio
+import ast
+import logging
+import time
+from llm_cache import LLM_OFFLINE, get_llm_cache, response_key
+from metrics import inc, observe
+
+# ========== CONFIG ==========
+# model="gemini-2.5-pro"
+# model="gemini-2.5-flash-lite"
+# model="gemini-2.0-flash"
+# model="gemini-2.0-flash-001"
+MODEL = "gemini-2.5-flash"
+# Gemini requests genuinely in flight at once
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "3"))
+# wait after a 503 before trying again, and tries before giving up
+OVERLOAD_WAIT = int(os.getenv("GEMINI_OVERLOAD_WAIT", "300"))
+OVERLOAD_ATTEMPTS = int(os.getenv("GEMINI_OVERLOAD_ATTEMPTS", "5"))
+# a local stand-in for the API (see stub_gemini.py); unset uses Google's
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+# requests per input when the answer fails the caller's validation
+MALFORMED_ATTEMPTS = 3
+
+log = logging.getLogger(__name__)
+
+# ========== HELPER FUNCTIONS ==========
+
+
+def getError(error):
+    s = error[0]
+
+    dict_str = s[s.find('{'):]
+
+    obj = ast.literal_eval(dict_str)
+
+    status = obj['error']['status']
+    code = obj['error']['code']
+
+    # Extract retryDelay
+    if (code != 503):
+        retry_delay = None
+        if (len(obj['error']) >= 3):
+            log.debug("Gemini error: %s", obj['error'])
+            for detail in obj['error']['details']:
+                if detail.get('@type') == 'type.googleapis.com/google.rpc.RetryInfo':
+                    retry_delay = detail.get('retryDelay')
+                    retry_delay = int(retry_delay[:-1])
+                    break
+            return [status, int(code), retry_delay]
+    return [status, int(code)]
+
+
+# ========== CLIENT ==========
+# Built on first use rather than at import, after load_dotenv() has run.
+# google.genai itself takes ~0.5s to import, so commands that never call
+# Gemini (fetch, extract, project, status) don't load it at all.
+_client = None
+_slots = None
+
+
+def gen_errors():
+    from google.genai import errors
+    return errors
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from google import genai
+
+        http_options = {"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None
+        _client = genai.Client(api_key=os.getenv("GENAI_API_KEY"),
+                               http_options=http_options)
+    return _client
+
+
+def gemini_slots():
+    # One semaphore per event loop; asyncio primitives can't be shared
+    # across asyncio.run() calls.
+    global _slots
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots[0] is not loop:
+        _slots = (loop, asyncio.Semaphore(GEMINI_CONCURRENCY))
+    return _slots[1]
+
+
+# ========== GEMINI AI SUMMARIZATION ==========
+
+
+class retry_if_gemini_429_error(retry_if_exception):
+    def __init__(self):
+        def is_gemini_429_error(exception):
+            # anything but a Gemini ClientError (a network error, say) has
+            # no error body to parse and passes straight through
+            if not isinstance(exception, gen_errors().ClientError):
+                return False
+            err = getError(exception.args)
+            return err[0] == "RESOURCE_EXHAUSTED" or err[1] == 429
+        super().__init__(predicate=is_gemini_429_error)
+
+
+def record_retry_wait(reason, seconds):
+    # tenacity (or ask_gemini_uncached) sleeps for exactly this long
+    inc("gemini_retries_total", reason=reason)
+    inc("gemini_retry_wait_seconds_total", seconds, reason=reason)
+
+
+class wait_for_gemini_retry_delay(wait_base):
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def __call__(self, retry_state):
+        exc = retry_state.outcome.exception()
+
+        if isinstance(exc, gen_errors().ClientError):
+            err = getError(exc.args)
+            if (len(err) == 3 and err[1] == 429):
+                log.warning("Gemini quota hit. Waiting %ss before retry...",
+                            err[2], extra={"attempt": retry_state.attempt_number})
+                record_retry_wait("quota", err[2])
+                return err[2]
+            elif (err[1] == 503):
+                log.warning("Gemini overloaded. Waiting %ds before retry...",
+                            OVERLOAD_WAIT)
+                record_retry_wait("overloaded", OVERLOAD_WAIT)
+                return OVERLOAD_WAIT
+
+        fallback_wait = self.fallback(retry_state)
+        log.warning("Gemini quota hit. Waiting %ss (fallback) before retry...",
+                    fallback_wait,
+                    extra={"attempt": retry_state.attempt_number})
+        record_retry_wait("fallback", fallback_wait)
+        return fallback_wait
+
+
+@retry(
+    retry=retry_if_gemini_429_error(),
+    wait=wait_for_gemini_retry_delay(fallback=wait_fixed(60)),
+    stop=stop_after_attempt(5)
+)
+async def summarize_with_gemini(text, content, config=None):
+    # The SDK's async client keeps the event loop free while the request is
+    # in flight; the slot is released before tenacity sleeps on a retry.
+    queued = time.monotonic()
+    async with gemini_slots():
+        start = time.monotonic()
+        inc("gemini_slot_wait_seconds_total", start - queued)
+        outcome = "error"
+        try:
+            response = await get_client().aio.models.generate_content(
+                model=MODEL,
+                contents=f"{content}:\n{text}",
+                config=config
+            )
+            outcome = "ok"
+        finally:
+            observe("gemini_request_seconds", time.monotonic() - start,
+                    outcome=outcome)
+    return response.text
+
+
+async def ask_gemini(text, prompt, config=None, validate=None):
+    # Served from the LLM response cache when this exact model/prompt/text
+    # was answered before. In offline replay mode a miss returns None.
+    # validate(response) -> bool: a failing answer is neither returned nor
+    # cached; it is asked again up to MALFORMED_ATTEMPTS times, then None.
+    valid = validate or (lambda response: True)
+    cache = get_llm_cache()
+    key = response_key(MODEL, prompt, text, config)
+    response = cache.get(key, count=False)
+    hit = response is not None and valid(response)
+    cache.count(hit)
+    if hit:
+        return response
+    if LLM_OFFLINE:
+        log.info("No cached Gemini answer for this input (offline replay)")
+        return None
+    for attempt in range(1, MALFORMED_ATTEMPTS + 1):
+        response = await ask_gemini_uncached(text, prompt, config)
+        if response is None:
+            return None
+        if valid(response):
+            cache.put(key, MODEL, response)
+            return response
+        inc("gemini_malformed_total")
+        log.warning("Malformed Gemini answer (attempt %d of %d): %r",
+                    attempt, MALFORMED_ATTEMPTS, response[:200],
+                    extra={"attempt": attempt})
+    return None
+
+
+async def ask_gemini_uncached(text, prompt, config=None):
+    # A 503 is waited out up to OVERLOAD_ATTEMPTS times, then raised.
+    for attempt in range(1, OVERLOAD_ATTEMPTS + 1):
+        try:
+            return await summarize_with_gemini(text, prompt, config)
+        except gen_errors().ServerError as e:
+            if getattr(e, "code", None) != 503 or attempt == OVERLOAD_ATTEMPTS:
+                raise
+        log.warning("Gemini overloaded. Waiting %ds before retry...",
+                    OVERLOAD_WAIT, extra={"attempt": attempt})
+        record_retry_wait("overloaded", OVERLOAD_WAIT)
+        await asyncio.sleep(OVERLOAD_WAIT)
@@ -0,0 +1,46 @@
+import logging
+from article_store import get_article_store
+from dedup import load_dedup_index, representatives
+from extract import shutdown_parse_pool
+from metrics import timed
+from topic_index import load_topic_index
+
+log = logging.getLogger(__name__)
+
+# ========== INDEX / PROJECT ==========
+# What `python -m pipeline index` / `cli.py project` rebuild once the scores
+# are in. Apart from the pipeline so they load without its fetch and Gemini
+# clients.
+
+
+def build_indexes():
+    # Derived files over the whole score matrix: the topic index, related
+    # articles and the map layout (new articles are placed incrementally).
+    import mapa
+    from metadata import load_articles
+    from neighbors import build_neighbors
+
+    with timed("index_seconds", step="topics"):
+        index = load_topic_index()
+    log.info("Topic index: %d articles", len(index.ids))
+    with timed("index_seconds", step="neighbors"):
+        build_neighbors(index.ids, index.X)
+    log.info("Related articles written")
+    with timed("index_seconds", step="map"):
+        # near-duplicates share their representative's position
+        duplicates = representatives(load_dedup_index().groups(), index.ids)
+        embedding = mapa.project_unique(index.ids, index.X, duplicates)
+        mapa.write_output(mapa.OUTPUT_FILE, index.ids, embedding,
+                          load_articles())
+
+
+def build_chunk_index():
+    # Full-text chunks and their BM25 index (chunks.py) for the Spring RAG
+    # endpoints; every stored article is re-parsed, so this is on demand
+    # rather than part of `run`.
+    from chunks import CHUNKS_FILE, build_chunks
+
+    with timed("index_seconds", step="chunks"):
+        n = build_chunks(get_article_store())
+    shutdown_parse_pool()
+    log.info("%d chunks written to %s", n, CHUNKS_FILE)
@@ -0,0 +1,138 @@
+import json
+import os
+
+# ========== CONFIG ==========
+# compact once the journal holds this many records...
+COMPACT_MIN_RECORDS = 100
+# ...and at least this fraction of the published entries, so compaction
+# cost stays O(1) amortised per record however large the output grows
+COMPACT_RATIO = 0.5
+
+# ========== JSON FILES ==========
+
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return default
+
+
+def write_json_atomic(path, obj, indent=2):
+    # Readers see either the old file or the new one, never half of it.
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def journaled_keys(path, journal_path=None):
+    # Keys of a JournaledDict's published file (dict or list) plus its
+    # journal, read-only, so it is safe while a run is appending to it.
+    keys = set(load_json(path, {}))
+    journal_path = journal_path or f"{path}.journal.jsonl"
+    if os.path.exists(journal_path):
+        with open(journal_path, "rb") as f:
+            for line in f:
+                try:
+                    keys.add(json.loads(line)["key"])
+                except (json.JSONDecodeError, KeyError):
+                    break
+    return keys
+
+
+# ========== RESULTS JOURNAL ==========
+
+
+class JournaledDict:
+    # A dict published as a JSON file (result.json, processed.json, ...)
+    # whose updates go to an append-only JSONL journal next to it. Each set()
+    # is one fsync'd line; the published file is rewritten atomically only on
+    # compaction, after which the journal is truncated. On open the journal is
+    # replayed over the published file, so a crash at any point loses at most
+    # a torn final line and a run resumes where it stopped.
+    #
+    # load turns the published JSON into a dict and dump turns the dict back
+    # into the published shape; on_compact runs right after publishing, for
+    # derived files that must stay in step (e.g. topics.json, scores.npy),
+    # so they are never older than the file they derive from.
+
+    def __init__(self, path, journal_path=None, load=None, dump=None,
+                 on_compact=None, default=None):
+        self.path = path
+        self.journal_path = journal_path or f"{path}.journal.jsonl"
+        self.dump = dump or (lambda data: data)
+        self.on_compact = on_compact
+        published = load_json(path, {} if default is None else default)
+        self.data = load(published) if load else published
+        if not isinstance(self.data, dict):
+            self.data = {}
+        self.replayed = list(self._replay())
+        for key, value in self.replayed:
+            self.data[key] = value
+        self.pending = len(self.replayed)
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        good = 0
+        with open(self.journal_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn write from a crash; nothing after it
+                if not line.endswith(b"\n"):
+                    break
+                good += len(line)
+                yield record["key"], record["value"]
+        # Drop the torn tail so new records don't get glued onto it.
+        if good != os.path.getsize(self.journal_path):
+            os.truncate(self.journal_path, good)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.journal.write(
+            json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.pending += 1
+        if self.pending >= max(COMPACT_MIN_RECORDS,
+                               COMPACT_RATIO * len(self.data)):
+            self.compact()
+
+    def compact(self):
+        write_json_atomic(self.path, self.dump(self.data))
+        if self.on_compact is not None:
+            self.on_compact()
+        # Everything in the journal is now in the published file. If we
+        # crash before truncating, replaying it again is harmless.
+        self.journal.seek(0)
+        self.journal.truncate()
+        self.pending = 0
+
+    def close(self):
+        if self.pending:
+            self.compact()
+        self.journal.close()
+        if os.path.exists(self.journal_path) and \
+                os.path.getsize(self.journal_path) == 0:
+            os.remove(self.journal_path)
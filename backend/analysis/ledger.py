@@ -0,0 +1,622 @@
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from metrics import inc, setup_logging
+
+load_dotenv()
+
+# python ledger.py add --input test.csv     queue ids (new ones only)
+# python ledger.py run --workers 4          4 local workers, then publish
+# python ledger.py work --worker hostB-0 --cache-dir /local/cache
+#                                           one worker (e.g. on another host)
+# python ledger.py publish                  results -> result.json etc.
+# python ledger.py status
+# python ledger.py requeue                  failed ids back to pending
+#
+# Sharded ingestion: any number of worker processes, on this host or others
+# sharing the filesystem, claim PMC ids from one SQLite ledger under
+# time-limited leases and run fetch -> extract -> classify on them. Results
+# are committed to the ledger, keyed by (pmc id, output), so a repeated or
+# duplicated commit is a no-op; `publish` is the single writer of
+# result.json / processed.json / topics.json. A worker that dies or stalls
+# stops renewing its leases and its ids go back to the others.
+#
+# Workers share the article store, text cache and LLM cache of the folder
+# they run in (--cache-dir, by default the ledger's), so an article fetched
+# or a prompt answered once is reused by all of them; only their metrics are
+# kept apart, under workers/<name>.
+
+# ========== CONFIG ==========
+LEDGER_FILE = "ledger.sqlite"
+# each worker writes its metrics under here
+WORKERS_DIR = "workers"
+LEASE_SECONDS = float(os.getenv("LEDGER_LEASE_SECONDS", "300"))
+HEARTBEAT_SECONDS = LEASE_SECONDS / 3
+# ids claimed per transaction (an efetch batch's worth)
+CLAIM_BATCH = int(os.getenv("LEDGER_CLAIM_BATCH", "50"))
+# ids a worker holds at once; it claims more only as these finish, so the
+# rest stay available to the other workers
+IN_FLIGHT = max(int(os.getenv("LEDGER_IN_FLIGHT", "100")), CLAIM_BATCH)
+# wait between claims while other workers still hold leases
+POLL_SECONDS = 5.0
+# claims after which an id that never completes is marked failed
+MAX_ATTEMPTS = 3
+OUTPUTS = ("scores", "labels")
+
+log = logging.getLogger(__name__)
+
+# ========== LEDGER ==========
+# work:    one row per PMC id; state pending -> leased -> done | failed.
+#          owner/lease_expires are set while leased; attempts counts claims.
+# results: (pmc_id, output) -> value, first commit wins.
+# The journal stays in the default rollback mode: WAL needs shared memory,
+# which workers on different hosts don't have.
+
+
+class Ledger:
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        # autocommit; writes take explicit BEGIN IMMEDIATE transactions. A
+        # worker makes its calls from a thread of its own (see work()).
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS work ("
+            " pmc_id TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL DEFAULT 'pending',"
+            " owner TEXT,"
+            " lease_expires REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " updated REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS work_state ON work (state, lease_expires)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " pmc_id TEXT NOT NULL,"
+            " output TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " worker TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " PRIMARY KEY (pmc_id, output))"
+        )
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # the write lock is taken up front, so two workers can't both read
+        # the same pending rows and then claim them
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def add(self, pmc_ids):
+        # new ids only; returns how many were added
+        now = time.time()
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO work (pmc_id, updated) VALUES (?, ?)",
+                ((pmc_id, now) for pmc_id in pmc_ids))
+            return conn.total_changes - before
+
+    def claim(self, worker, n=CLAIM_BATCH):
+        # Leases up to n ids, oldest first: pending ones and ones whose lease
+        # ran out. An expired id already claimed MAX_ATTEMPTS times is
+        # marked failed instead. Returns the ids and how many of them were
+        # reclaimed from expired leases and how many others were failed.
+        now = time.time()
+        with self.transaction() as conn:
+            failed = conn.execute(
+                "UPDATE work SET state = 'failed', owner = NULL,"
+                " lease_expires = NULL, updated = ?"
+                " WHERE state = 'leased' AND lease_expires < ?"
+                " AND attempts >= ?", (now, now, MAX_ATTEMPTS)).rowcount
+            rows = conn.execute(
+                "SELECT pmc_id, state FROM work WHERE state = 'pending'"
+                " OR (state = 'leased' AND lease_expires < ?)"
+                " ORDER BY rowid LIMIT ?", (now, n)).fetchall()
+            conn.executemany(
+                "UPDATE work SET state = 'leased', owner = ?,"
+                " lease_expires = ?, attempts = attempts + 1, updated = ?"
+                " WHERE pmc_id = ?",
+                ((worker, now + LEASE_SECONDS, now, pmc_id)
+                 for pmc_id, _ in rows))
+        reclaimed = sum(state == "leased" for _, state in rows)
+        return [pmc_id for pmc_id, _ in rows], reclaimed, failed
+
+    def renew(self, worker):
+        # extends every lease the worker still holds
+        now = time.time()
+        with self.transaction() as conn:
+            return conn.execute(
+                "UPDATE work SET lease_expires = ?, updated = ?"
+                " WHERE owner = ? AND state = 'leased'",
+                (now + LEASE_SECONDS, now, worker)).rowcount
+
+    def waiting(self, worker):
+        # ids another worker holds or that are pending: more may turn up
+        return self.conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM work WHERE state = 'pending'"
+            " OR (state = 'leased' AND owner != ?))", (worker,)).fetchone()[0]
+
+    def commit(self, pmc_id, output, value, worker):
+        # True if this was the first result for (pmc_id, output)
+        with self.transaction() as conn:
+            added = conn.execute(
+                "INSERT INTO results (pmc_id, output, value, worker, created)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (pmc_id, output) DO NOTHING",
+                (pmc_id, output, value, worker, time.time())).rowcount
+        return bool(added)
+
+    def existing(self, pmc_ids):
+        # pmc_id -> outputs that already have a result, for the given ids
+        have = {}
+        for pmc_id, output in self.conn.execute(
+                "SELECT pmc_id, output FROM results"
+                f" WHERE pmc_id IN ({','.join('?' * len(pmc_ids))})",
+                pmc_ids):
+            have.setdefault(pmc_id, set()).add(output)
+        return have
+
+    def finish(self, pmc_id, worker, outputs):
+        # An id leaving the worker's pipeline: done once every output has a
+        # result (whoever committed it), else back to pending (or failed
+        # after MAX_ATTEMPTS) if the worker still holds its lease.
+        have = {row[0] for row in self.conn.execute(
+            "SELECT output FROM results WHERE pmc_id = ?", (pmc_id,))}
+        now = time.time()
+        with self.transaction() as conn:
+            if set(outputs) <= have:
+                conn.execute(
+                    "UPDATE work SET state = 'done', owner = NULL,"
+                    " lease_expires = NULL, updated = ? WHERE pmc_id = ?",
+                    (now, pmc_id))
+                return True
+            conn.execute(
+                "UPDATE work SET state = CASE WHEN attempts >= ?"
+                " THEN 'failed' ELSE 'pending' END, owner = NULL,"
+                " lease_expires = NULL, updated = ?"
+                " WHERE pmc_id = ? AND owner = ? AND state = 'leased'",
+                (MAX_ATTEMPTS, now, pmc_id, worker))
+        return False
+
+    def release(self, worker):
+        # everything the worker still holds goes back to pending, attempt
+        # not counted (an interrupted worker didn't fail at them)
+        with self.transaction() as conn:
+            return conn.execute(
+                "UPDATE work SET state = 'pending', owner = NULL,"
+                " lease_expires = NULL, attempts = MAX(attempts - 1, 0),"
+                " updated = ? WHERE owner = ? AND state = 'leased'",
+                (time.time(), worker)).rowcount
+
+    def requeue(self, states=("failed",)):
+        with self.transaction() as conn:
+            return conn.execute(
+                "UPDATE work SET state = 'pending', owner = NULL,"
+                " lease_expires = NULL, attempts = 0, updated = ?"
+                f" WHERE state IN ({','.join('?' * len(states))})",
+                (time.time(), *states)).rowcount
+
+    def results(self):
+        return self.conn.execute(
+            "SELECT pmc_id, output, value FROM results ORDER BY rowid")
+
+    def counts(self):
+        states = dict(self.conn.execute(
+            "SELECT state, COUNT(*) FROM work GROUP BY state"))
+        outputs = dict(self.conn.execute(
+            "SELECT output, COUNT(*) FROM results GROUP BY output"))
+        now = time.time()
+        workers = self.conn.execute(
+            "SELECT owner, COUNT(*), MIN(lease_expires) FROM work"
+            " WHERE state = 'leased' GROUP BY owner ORDER BY owner").fetchall()
+        return states, outputs, [(owner, n, expires - now)
+                                 for owner, n, expires in workers]
+
+    def close(self):
+        self.conn.close()
+
+# ========== WORKER ==========
+
+
+class LedgerResults:
+    # `pmc_id in outputs.scores` for the ids the worker holds: what the
+    # ledger had when they were claimed plus what the worker committed since
+    def __init__(self, have, output):
+        self.have = have
+        self.output = output
+
+    def __contains__(self, pmc_id):
+        return self.output in self.have.get(pmc_id, ())
+
+
+class LedgerOutputs:
+    # What pipeline.stages.build_stages needs from Outputs, committing to
+    # the ledger instead of the journaled result files. Commits are handed
+    # to submit(), which runs them on the worker's ledger thread. Near-
+    # duplicate reuse is off: it would need every worker's signatures.
+    dedup = None
+
+    def __init__(self, ledger, worker, submit):
+        self.ledger = ledger
+        self.worker = worker
+        self.submit = submit
+        # pmc_id -> outputs with a result, for the ids in flight
+        self.have = {}
+        self.scores = LedgerResults(self.have, "scores")
+        self.labels = LedgerResults(self.have, "labels")
+
+    def claimed(self, have):
+        self.have.update(have)
+
+    def forget(self, pmc_id):
+        self.have.pop(pmc_id, None)
+
+    def commit(self, pmc_id, output, value):
+        def counted(added):
+            inc("ledger_results_total", output=output,
+                result="new" if added else "duplicate")
+
+        self.have.setdefault(pmc_id, set()).add(output)
+        self.submit(counted, self.ledger.commit, pmc_id, output, value,
+                    self.worker)
+
+    def save_scores(self, pmc_id, summary):
+        from classify import parse_score_row
+        if parse_score_row(summary) is None:
+            log.warning("Rejecting malformed scores for PMC%s: %r", pmc_id,
+                        summary, extra={"pmc_id": pmc_id})
+            return
+        log.info("PMC%s summary: %s", pmc_id, summary,
+                 extra={"pmc_id": pmc_id})
+        self.commit(pmc_id, "scores", summary)
+
+    def save_labels(self, pmc_id, summary):
+        log.info("PMC%s labels: %s", pmc_id, summary, extra={"pmc_id": pmc_id})
+        self.commit(pmc_id, "labels", summary)
+
+
+def item_id(item):
+    # ingest takes bare ids, later stages {"pmc_id", ...} dicts
+    return item if isinstance(item, str) else item["pmc_id"]
+
+
+def handler_failed(stage, pmc_ids, error):
+    # Only these ids drop out: finish() counts the attempt like any other,
+    # so an id that keeps failing ends up failed instead of taking down
+    # every worker that claims it.
+    inc("ledger_item_errors_total", len(pmc_ids), stage=stage)
+    log.error("%s failed for %s: %s: %s", stage,
+              ", ".join(f"PMC{pmc_id}" for pmc_id in sorted(pmc_ids)),
+              type(error).__name__, error, exc_info=error,
+              extra={"stage": stage, "pmc_ids": sorted(pmc_ids)})
+
+
+def track_exits(stages, on_exit):
+    # Wraps each stage's handler so on_exit(pmc_id) runs for every id that
+    # leaves the pipeline: dropped by a stage, passed out of the last one or
+    # lost to an exception in the handler.
+    from pipeline import BatchStage
+
+    for stage in stages:
+        handler, final = stage.handler, stage is stages[-1]
+        if isinstance(stage, BatchStage):
+            async def wrapped(batch, handler=handler, final=final,
+                              name=stage.name):
+                ids = {item_id(item) for item in batch}
+                try:
+                    results = await handler(batch)
+                except Exception as e:
+                    handler_failed(name, ids, e)
+                    results = []
+                kept = set() if final else {item_id(r) for r in results}
+                for pmc_id in ids - kept:
+                    on_exit(pmc_id)
+                return results
+        else:
+            async def wrapped(item, handler=handler, final=final,
+                              name=stage.name):
+                try:
+                    result = await handler(item)
+                except Exception as e:
+                    handler_failed(name, {item_id(item)}, e)
+                    result = None
+                if result is None or final:
+                    on_exit(item_id(item))
+                return result
+        stage.handler = wrapped
+
+
+async def work(ledger, worker, stages=OUTPUTS, metrics_file=None):
+    # Claims, processes and commits until nothing is pending and no other
+    # worker holds a lease. Returns how many ids were completed.
+    #
+    # Every ledger call can wait up to a minute for another worker's write
+    # lock, so they all run on one thread of their own, in the order they
+    # were made: the event loop keeps fetching and classifying meanwhile,
+    # and an id's commits are always in before its finish().
+    import httpx
+    from article_store import close_article_store
+    from classify import new_classify_stats, print_classify_stats
+    from extract import shutdown_parse_pool
+    from llm_cache import print_llm_cache_stats
+    from metrics import (METRICS_FILE, flush_metrics, print_summary,
+                         write_metrics)
+    from ncbi import MAX_CONNECTIONS, print_fetch_stats
+    from pipeline import run_stages
+    from pipeline.stages import build_stages, handle_interrupts
+
+    metrics_file = metrics_file or METRICS_FILE
+    selected = set(stages)
+    outputs = set(stages) & set(OUTPUTS)
+    classify_stats = new_classify_stats()
+    stop = asyncio.Event()
+    in_flight = set()
+    # ids ingest has taken in; an id leaves it with in_flight, so a retry
+    # of it isn't filtered out as a repeat
+    seen = set()
+    room = asyncio.Event()
+    completed = 0
+    loop = asyncio.get_running_loop()
+    db = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ledger")
+
+    def call(fn, *args):
+        return loop.run_in_executor(db, fn, *args)
+
+    def submit(then, fn, *args):
+        # Fire and forget; then(result) runs back on the loop. A call that
+        # fails only loses its write: an id whose commit didn't land is
+        # retried by finish().
+        def done(future):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                log.error("Ledger %s failed: %s", fn.__name__,
+                          future.exception(), exc_info=future.exception(),
+                          extra={"worker": worker})
+            else:
+                then(future.result())
+
+        call(fn, *args).add_done_callback(done)
+
+    ledger_outputs = LedgerOutputs(ledger, worker, submit)
+
+    async def claims():
+        while not stop.is_set():
+            if IN_FLIGHT - len(in_flight) < CLAIM_BATCH:
+                room.clear()
+                await room.wait()
+                continue
+            pmc_ids, reclaimed, failed = await call(ledger.claim, worker)
+            if failed:
+                inc("ledger_failed_total", failed)
+            if reclaimed:
+                log.warning("Reclaimed %d expired leases", reclaimed,
+                            extra={"worker": worker})
+                inc("ledger_reclaimed_total", reclaimed)
+            inc("ledger_claimed_total", len(pmc_ids))
+            if pmc_ids:
+                log.info("Claimed %d ids", len(pmc_ids),
+                         extra={"worker": worker})
+                ledger_outputs.claimed(await call(ledger.existing, pmc_ids))
+                in_flight.update(pmc_ids)
+                for pmc_id in pmc_ids:
+                    yield pmc_id
+            elif await call(ledger.waiting, worker):
+                # others still hold leases; theirs may expire
+                await asyncio.sleep(POLL_SECONDS)
+            elif in_flight:
+                # ours may still go back to pending for a retry
+                room.clear()
+                await room.wait()
+            else:
+                return
+
+    def finished(done):
+        nonlocal completed
+        if done:
+            completed += 1
+            inc("ledger_completed_total")
+
+    def on_exit(pmc_id):
+        in_flight.discard(pmc_id)
+        seen.discard(pmc_id)
+        ledger_outputs.forget(pmc_id)
+        room.set()
+        # queued behind the id's commits and ahead of the next claim
+        submit(finished, ledger.finish, pmc_id, worker, outputs)
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await call(ledger.renew, worker)
+            except sqlite3.Error as e:
+                # the next beat tries again, well within the lease
+                log.error("Lease renewal failed: %s", e,
+                          extra={"worker": worker})
+
+    restore_sigint = handle_interrupts(stop)
+    renewer = asyncio.create_task(heartbeat())
+    flusher = asyncio.create_task(flush_metrics(path=metrics_file))
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS)
+    try:
+        async with httpx.AsyncClient(timeout=60.0, limits=limits) as client_http:
+            pipeline = build_stages(selected, ledger_outputs, client_http,
+                                    classify_stats, seen)
+            track_exits(pipeline, on_exit)
+            await run_stages(claims(), pipeline, stop)
+    except asyncio.CancelledError:
+        log.warning("Aborted; committed results are kept")
+    finally:
+        renewer.cancel()
+        flusher.cancel()
+        restore_sigint()
+        # after every queued commit and finish
+        released = await call(ledger.release, worker)
+        db.shutdown()
+        if released:
+            log.warning("Released %d unfinished leases", released,
+                        extra={"worker": worker})
+        shutdown_parse_pool()
+        close_article_store()
+
+    log.info("Worker %s completed %d ids", worker, completed,
+             extra={"worker": worker})
+    print_fetch_stats()
+    if "scores" in selected:
+        print_classify_stats(classify_stats)
+    print_llm_cache_stats()
+    write_metrics(metrics_file)
+    print_summary()
+    return completed
+
+# ========== PUBLISH ==========
+
+
+def publish(ledger):
+    # Ledger results into result.json / processed.json / topics.json in the
+    # current directory, through the same journaled Outputs a single-process
+    # run uses. Only what changed is written, so it can run any time.
+    from pipeline.stages import Outputs
+
+    outputs = Outputs()
+    published = 0
+    try:
+        for pmc_id, output, value in ledger.results():
+            if output == "scores" and outputs.scores.get(pmc_id) != value:
+                outputs.save_scores(pmc_id, value)
+                published += 1
+            elif output == "labels" and pmc_id not in outputs.labels:
+                outputs.save_labels(pmc_id, value)
+                published += 1
+    finally:
+        outputs.close()
+    log.info("Published %d new results", published)
+    return published
+
+# ========== MAIN ==========
+
+
+def ledger_dir(ledger_path):
+    return os.path.dirname(os.path.abspath(ledger_path))
+
+
+def worker_dir(ledger_path, worker):
+    return os.path.join(ledger_dir(ledger_path), WORKERS_DIR, worker)
+
+
+def run_workers(args):
+    # n local `work` processes sharing the external rate limits: each gets
+    # 1/n of the NCBI request rate. Gemini's quota is enforced by the API
+    # and handled by the retries in gemini.py.
+    from ncbi import REQUESTS_PER_SECOND
+
+    host = socket.gethostname()
+    env = dict(os.environ,
+               NCBI_RPS=str(float(os.getenv("NCBI_RPS", REQUESTS_PER_SECOND))
+                            / args.workers))
+    procs = [subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--ledger",
+         os.path.abspath(args.ledger), "work", "--worker", f"{host}-{i}",
+         "--stages", *args.stages], env=env)
+        for i in range(args.workers)]
+    failed = 0
+    for proc in procs:
+        while True:
+            try:
+                failed += proc.wait() != 0
+                break
+            except KeyboardInterrupt:
+                # the workers got the Ctrl-C too and are draining
+                continue
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python ledger.py")
+    parser.add_argument("--ledger", default=LEDGER_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("add", help="queue the ids of an input CSV")
+    p.add_argument("--input", default="test.csv",
+                   help="CSV with a 'url' column of PMC article links")
+    p = commands.add_parser("work", help="run one worker until the ledger "
+                            "is drained")
+    p.add_argument("--worker", default=f"{socket.gethostname()}-{os.getpid()}",
+                   help="unique among the live workers (leases are held by "
+                   "name)")
+    p.add_argument("--cache-dir",
+                   help="folder with the article store and caches to share "
+                   "(default: the ledger's). The caches are SQLite in WAL "
+                   "mode, which needs a local disk: workers on other hosts "
+                   "should each pass a local one")
+    p.add_argument("--stages", nargs="+", default=list(OUTPUTS),
+                   choices=["ingest", "extract", *OUTPUTS])
+    p = commands.add_parser("run", help="run local workers, then publish")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--stages", nargs="+", default=list(OUTPUTS),
+                   choices=["ingest", "extract", *OUTPUTS])
+    p.add_argument("--index", action="store_true",
+                   help="rebuild the derived indexes after publishing")
+    commands.add_parser("publish", help="write results to result.json etc.")
+    commands.add_parser("status")
+    p = commands.add_parser("requeue", help="failed ids back to pending")
+    p.add_argument("--done", action="store_true",
+                   help="completed ids too (e.g. to add labels later)")
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.command == "work":
+        ledger = Ledger(os.path.abspath(args.ledger))
+        metrics_dir = worker_dir(args.ledger, args.worker)
+        os.makedirs(metrics_dir, exist_ok=True)
+        os.chdir(args.cache_dir or ledger_dir(args.ledger))
+        asyncio.run(work(ledger, args.worker, tuple(args.stages),
+                         os.path.join(metrics_dir, "metrics.prom")))
+        return
+    if args.command == "run":
+        failed = run_workers(args)
+        if failed:
+            log.warning("%d workers exited with an error", failed)
+
+    ledger = Ledger(args.ledger)
+    if args.command == "add":
+        from metadata import iter_pmc_ids
+        added = ledger.add(iter_pmc_ids(args.input))
+        log.info("Queued %d new ids from %s", added, args.input)
+    elif args.command == "requeue":
+        n = ledger.requeue(("failed", "done") if args.done else ("failed",))
+        log.info("Requeued %d ids", n)
+    elif args.command in ("publish", "run"):
+        publish(ledger)
+        if args.command == "run" and args.index:
+            from pipeline import build_indexes
+            build_indexes()
+    states, outputs, workers = ledger.counts()
+    print("ids:     " + ", ".join(f"{n} {state}"
+                                  for state, n in sorted(states.items())))
+    print("results: " + ", ".join(f"{n} {output}"
+                                  for output, n in sorted(outputs.items())))
+    for owner, n, expires in workers:
+        print(f"  {owner}: {n} leased, "
+              + (f"lease ends in {expires:.0f}s" if expires > 0
+                 else f"expired {-expires:.0f}s ago"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from metrics import count_cache
+
+# ========== CONFIG ==========
+LLM_CACHE_FILE = "llm_cache.sqlite"
+# LLM_OFFLINE=1 replays cached answers only and never calls Gemini
+LLM_OFFLINE = os.getenv("LLM_OFFLINE", "0") == "1"
+
+log = logging.getLogger(__name__)
+
+# ========== LLM RESPONSE CACHE ==========
+# Gemini answers keyed by a hash of everything that determines them: model,
+# prompt, input text and generation config. Changing any of those simply
+# misses, so after editing a prompt or re-extracting text only the affected
+# articles are paid for again. Shared by main.py (score vectors) and gen.py
+# (topic labels).
+
+
+def response_key(model, prompt, text, config=None):
+    h = hashlib.sha256()
+    for part in (model, prompt, text,
+                 json.dumps(config, sort_keys=True) if config else ""):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path=LLM_CACHE_FILE):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, key, count=True):
+        row = self.conn.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if count:
+            self.count(row is not None)
+        return row[0] if row is not None else None
+
+    def count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        count_cache("llm", hit)
+
+    def put(self, key, model, response):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, model, response, created)"
+            " VALUES (?, ?, ?, ?)",
+            (key, model, response, time.time()),
+        )
+        self.conn.commit()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        self.conn.close()
+
+
+_llm_cache = None
+
+
+def get_llm_cache():
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+
+def print_llm_cache_stats():
+    cache = get_llm_cache()
+    mode = " (offline replay)" if LLM_OFFLINE else ""
+    log.info("LLM cache%s: %d hits, %d misses, %.0f%% hit ratio", mode,
+             cache.hits, cache.misses, 100 * cache.hit_ratio())
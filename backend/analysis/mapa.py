@@ -1,38 +1,367 @@
-import json
-import re
+import argparse
+import functools
+import itertools
+import logging
+import os
+import pickle
+import sys
+import time
 import numpy as np
-import pandas as pd
-import umap
-
-with open("result.json", "r") as f:
-    data = json.load(f)
-
-ids = list(data.keys())
-vectors = [list(map(float, data[k].split(","))) for k in ids]
-
-df = pd.read_csv("articles.csv")
-
-title_map = {}
-for _, row in df.iterrows():
-    match = re.search(r"PMC(\d+)", row["Link"])
-    if match:
-        pmc_id = match.group(1)
-        title_map[pmc_id] = row["Title"]
-
-X = np.array(vectors)
-reducer = umap.UMAP(n_components=3, random_state=None, n_jobs=1)
-embedding = reducer.fit_transform(X)
-
-output = [
-    {
-        "id": id_,
-        "title": title_map.get(id_, "Unknown Title"),
-        "x": float(x),
-        "y": float(y),
-        "z": float(z)
-    }
-    for id_, (x, y, z) in zip(ids, embedding)
-]
-
-with open("output_3d.json", "w", encoding="utf-8") as f:
-    json.dump(output, f, indent=2, ensure_ascii=False)
+from files import LAYOUT_FILE, MODEL_FILE, NUMBA_CACHE_DIR, OUTPUT_FILE
+from metadata import load_articles, titles_for, write_json_records
+from metrics import setup_logging
+from scores import ensure_scores
+from tiles import write_tiles
+
+# ========== CONFIG ==========
+# refit from scratch once the articles placed incrementally (new ones or
+# ones whose scores changed) reach this fraction of the fitted set
+REFIT_DRIFT = float(os.getenv("UMAP_REFIT_DRIFT", "0.25"))
+# fixed so a refit lands near the previous layout run to run; it keeps the
+# layout optimisation on one thread, and --parallel drops it so that can
+# use every core too
+RANDOM_STATE = 42
+# threads for the kNN graph (seeded or not) and, in parallel mode, the
+# layout optimisation
+UMAP_N_JOBS = int(os.getenv("UMAP_N_JOBS", str(os.cpu_count() or 1)))
+# below this many rows umap computes exact distances itself rather than
+# an approximate kNN graph
+EXACT_KNN_ROWS = 4096
+N_COMPONENTS = 3
+N_NEIGHBORS = 15
+MIN_DIST = 0.1
+# neighbours used to place a new article, as in UMAP's default n_neighbors
+PLACE_NEIGHBORS = 15
+
+log = logging.getLogger(__name__)
+
+# ========== INCREMENTAL PLACEMENT ==========
+
+
+def knn_place(X_fit, E_fit, X_new, k=PLACE_NEIGHBORS):
+    # UMAP's transform initialisation without the numba machinery: each new
+    # row goes to the membership-weighted mean of its k nearest fitted rows.
+    # Weights are exp(-(d - rho) / sigma) with rho the nearest distance and
+    # sigma chosen so they sum to log2(k), as in umap's smooth_knn_dist.
+    k = min(k, len(X_fit))
+    d = np.sqrt(np.maximum(
+        (X_new ** 2).sum(1)[:, None] - 2 * X_new @ X_fit.T
+        + (X_fit ** 2).sum(1)[None, :], 0))
+    nn = np.argpartition(d, k - 1, axis=1)[:, :k]
+    dist = np.take_along_axis(d, nn, axis=1)
+    excess = dist - dist.min(axis=1, keepdims=True)
+
+    target = np.log2(k)
+    lo = np.zeros(len(X_new))
+    hi = np.full(len(X_new), np.inf)
+    sigma = np.ones(len(X_new))
+    for _ in range(64):
+        total = np.exp(-excess / sigma[:, None]).sum(axis=1)
+        too_big = total > target
+        hi = np.where(too_big, sigma, hi)
+        lo = np.where(too_big, lo, sigma)
+        sigma = np.where(np.isinf(hi), sigma * 2, (lo + hi) / 2)
+
+    weights = np.exp(-excess / sigma[:, None])
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.einsum("nk,nkc->nc", weights, E_fit[nn]).astype(np.float32)
+
+# ========== PROJECTION ENGINE ==========
+
+
+def umap_params(n_components=N_COMPONENTS, n_neighbors=N_NEIGHBORS,
+                min_dist=MIN_DIST):
+    return {"n_components": n_components, "n_neighbors": n_neighbors,
+            "min_dist": min_dist}
+
+
+def params_tag(params):
+    # "3d" for the defaults, e.g. "2d_n30_md0.5" otherwise; names the
+    # output, model and layout files of each parameter set.
+    tag = f"{params['n_components']}d"
+    if (params["n_neighbors"], params["min_dist"]) != (N_NEIGHBORS, MIN_DIST):
+        tag += f"_n{params['n_neighbors']}_md{params['min_dist']:g}"
+    return tag
+
+
+def params_files(params):
+    # (output, model, layout); the default 3D set keeps the original names.
+    tag = params_tag(params)
+    if tag == "3d":
+        return OUTPUT_FILE, MODEL_FILE, LAYOUT_FILE
+    return f"output_{tag}.json", f"umap_model_{tag}.pkl", f"umap_layout_{tag}.npz"
+
+
+def import_umap():
+    # umap and pynndescent JIT-compile their kernels on every cold start
+    # (~12s at import, ~15s more on the first fit), and most aren't declared
+    # cache=True. Defaulting numba's decorators to cache=True while they are
+    # imported stores the machine code in NUMBA_CACHE_DIR; later runs load
+    # it in about a tenth of the time.
+    if "umap" in sys.modules:
+        return sys.modules["umap"]
+    os.environ.setdefault("NUMBA_CACHE_DIR", NUMBA_CACHE_DIR)
+    import numba
+
+    def cached(decorator):
+        @functools.wraps(decorator)
+        def wrapper(*args, **kwargs):
+            kwargs.setdefault("cache", True)
+            return decorator(*args, **kwargs)
+        return wrapper
+
+    njit, jit = numba.njit, numba.jit
+    numba.njit, numba.jit = cached(njit), cached(jit)
+    try:
+        import umap
+    finally:
+        numba.njit, numba.jit = njit, jit
+    return umap
+
+
+def nearest_neighbor_graph(X, n_neighbors, seed=RANDOM_STATE,
+                           n_jobs=UMAP_N_JOBS):
+    # Approximate kNN graph (pynndescent), handed to the reducer via
+    # precomputed_knn. It is built on every core even when seeded: the seed
+    # fixes the trees the search starts from, so the graph comes out nearly
+    # the same, and only the layout optimisation has to stay on one thread.
+    nearest_neighbors = import_umap().umap_.nearest_neighbors
+
+    random_state = np.random.RandomState(seed) if seed is not None else None
+    return nearest_neighbors(
+        np.array(X, dtype=np.float32), n_neighbors, "euclidean", {}, False,
+        random_state, n_jobs=n_jobs)
+
+
+def make_reducer(params, seed=RANDOM_STATE, n_jobs=UMAP_N_JOBS, knn=None):
+    # umap pulls in numba and takes seconds to import; only fits need it
+    umap = import_umap()
+
+    kwargs = dict(params, random_state=seed,
+                  n_jobs=1 if seed is not None else n_jobs)
+    if knn is not None:
+        # umap only trims a larger graph for N >= 4096, so trim it here
+        k = params["n_neighbors"]
+        kwargs["precomputed_knn"] = (knn[0][:, :k], knn[1][:, :k], knn[2])
+    return umap.UMAP(**kwargs)
+
+# ========== PROJECTION MODEL ==========
+
+
+class Projection:
+    # The articles placed so far and their coordinates. New articles are
+    # added without moving any existing point; only fit() changes the
+    # layout. The fitted reducer is kept beside it in MODEL_FILE and only
+    # loaded when a refit or an exact UMAP transform needs it.
+
+    def __init__(self, ids, X, embedding, n_fit, transformed=0,
+                 model_file=MODEL_FILE):
+        self.ids = list(ids)
+        self.X = X
+        self.embedding = embedding
+        self.n_fit = n_fit
+        self.transformed = transformed
+        self.model_file = model_file
+        self._reducer = None
+
+    @classmethod
+    def fit(cls, ids, X, model_file=MODEL_FILE, params=None,
+            seed=RANDOM_STATE, n_jobs=UMAP_N_JOBS, knn=None):
+        X = np.array(X, dtype=np.float32)
+        reducer = make_reducer(params or umap_params(), seed, n_jobs, knn)
+        embedding = reducer.fit_transform(X).astype(np.float32)
+        tmp = f"{model_file}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(reducer, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, model_file)
+        projection = cls(ids, X, embedding, len(ids), model_file=model_file)
+        projection._reducer = reducer
+        return projection
+
+    @property
+    def reducer(self):
+        if self._reducer is None:
+            import_umap()  # before unpickling imports it uncached
+            with open(self.model_file, "rb") as f:
+                self._reducer = pickle.load(f)
+        return self._reducer
+
+    @property
+    def drift(self):
+        return self.transformed / max(self.n_fit, 1)
+
+    def place(self, ids, X, exact=False):
+        # Places rows that are new or whose scores changed since they were
+        # placed, against the fitted rows only. Returns how many there were.
+        index = {pmc_id: i for i, pmc_id in enumerate(self.ids)}
+        positions = np.array([index.get(pmc_id, -1) for pmc_id in ids],
+                             dtype=np.int64)
+        known = positions >= 0
+        changed = np.zeros(len(ids), dtype=bool)
+        changed[known] = np.any(self.X[positions[known]] != X[known], axis=1)
+        todo = np.flatnonzero(~known | changed)
+        if len(todo) == 0:
+            return 0
+
+        rows = np.asarray(X[todo], dtype=np.float32)
+        if exact:
+            coords = self.reducer.transform(rows).astype(np.float32)
+        else:
+            coords = knn_place(self.X[:self.n_fit], self.embedding[:self.n_fit],
+                               rows)
+        update = changed[todo]
+        self.X[positions[todo[update]]] = rows[update]
+        self.embedding[positions[todo[update]]] = coords[update]
+        self.ids.extend(ids[i] for i in todo[~update])
+        self.X = np.concatenate([self.X, rows[~update]])
+        self.embedding = np.concatenate([self.embedding, coords[~update]])
+        self.transformed += len(todo)
+        return len(todo)
+
+    def coords(self, ids):
+        index = {pmc_id: i for i, pmc_id in enumerate(self.ids)}
+        return self.embedding[[index[pmc_id] for pmc_id in ids]]
+
+    def save(self, path=LAYOUT_FILE):
+        # Fitted rows come first in X/embedding; n_fit marks where the
+        # incrementally placed ones start.
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, ids=np.array(self.ids), X=self.X,
+                     embedding=self.embedding, n_fit=self.n_fit,
+                     transformed=self.transformed)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=LAYOUT_FILE, model_file=MODEL_FILE):
+        if not os.path.exists(path) or not os.path.exists(model_file):
+            return None
+        with np.load(path) as layout:
+            return cls(layout["ids"].tolist(), layout["X"],
+                       layout["embedding"], int(layout["n_fit"]),
+                       int(layout["transformed"]), model_file)
+
+
+def project(ids, X, refit=False, exact=False, layout_file=LAYOUT_FILE,
+            model_file=MODEL_FILE, params=None, seed=RANDOM_STATE,
+            n_jobs=UMAP_N_JOBS, knn=None):
+    # knn: a graph from nearest_neighbor_graph over these same rows, or a
+    # callable returning one, so it is only built if a fit happens. Without
+    # one, the graph is built here (in parallel) for all but small inputs.
+    params = params or umap_params()
+
+    def fit():
+        graph = knn() if callable(knn) else knn
+        if graph is None and len(ids) >= EXACT_KNN_ROWS:
+            graph = nearest_neighbor_graph(X, params["n_neighbors"], seed,
+                                           n_jobs)
+        log.info("Fitting UMAP (%s) on %d articles...", params_tag(params),
+                 len(ids))
+        return Projection.fit(ids, X, model_file, params, seed, n_jobs, graph)
+
+    projection = None if refit else Projection.load(layout_file, model_file)
+    if projection is None:
+        projection = fit()
+    else:
+        placed = projection.place(ids, X, exact)
+        log.info("Placed %d new or changed articles into the existing "
+                 "layout (drift %.0f%%)", placed, 100 * projection.drift)
+        if projection.drift > REFIT_DRIFT:
+            log.info("Drift above %.0f%%, refitting", 100 * REFIT_DRIFT)
+            projection = fit()
+    projection.save(layout_file)
+    return projection.coords(ids)
+
+
+def project_unique(ids, X, duplicates, **kwargs):
+    # project() over the articles that aren't near-duplicates of another
+    # (duplicates: {pmc_id: representative}, see dedup.representatives);
+    # each duplicate is drawn on top of its representative.
+    if not duplicates:
+        return project(ids, X, **kwargs)
+    keep = [i for i, pmc_id in enumerate(ids) if pmc_id not in duplicates]
+    unique_ids = [ids[i] for i in keep]
+    coords = project(unique_ids, X[keep], **kwargs)
+    row = {pmc_id: i for i, pmc_id in enumerate(unique_ids)}
+    log.info("%d near-duplicates placed on their representatives",
+             len(duplicates))
+    return coords[[row[duplicates.get(pmc_id, pmc_id)] for pmc_id in ids]]
+
+# ========== MAIN ==========
+
+
+def write_output(path, ids, embedding, articles):
+    # Columnar: ids, joined titles and one array per axis, streamed out.
+    columns = {"id": np.asarray(ids), "title": titles_for(ids, articles)}
+    for axis, values in zip("xyz", embedding.T):
+        columns[axis] = values
+    write_json_records(path, columns)
+    if path == OUTPUT_FILE:
+        # the GraphView's level-of-detail tiles follow the default 3D map
+        write_tiles(ids, embedding, columns["title"])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Project the topic scores into 2D/3D for the map")
+    parser.add_argument("--refit", action="store_true",
+                        help="refit UMAP from scratch instead of placing "
+                        "new articles into the saved layout")
+    parser.add_argument("--exact", action="store_true",
+                        help="place new articles with the saved reducer's "
+                        "transform (slower, optimises their positions)")
+    parser.add_argument("--components", type=int, nargs="+",
+                        default=[N_COMPONENTS], choices=[2, 3])
+    parser.add_argument("--neighbors", type=int, nargs="+",
+                        default=[N_NEIGHBORS])
+    parser.add_argument("--min-dist", type=float, nargs="+",
+                        default=[MIN_DIST])
+    parser.add_argument("--seed", type=int, default=RANDOM_STATE)
+    parser.add_argument("--parallel", action="store_true",
+                        help="unseeded, multi-threaded fit (not reproducible)")
+    parser.add_argument("--jobs", type=int, default=UMAP_N_JOBS)
+    args = parser.parse_args()
+    setup_logging()
+    seed = None if args.parallel else args.seed
+    from dedup import load_dedup_index, representatives
+
+    # float32 matrix memory-mapped from scores.npy, rebuilt if result.json
+    # is newer
+    ids, X = ensure_scores()
+    articles = load_articles()
+    # near-duplicates share their representative's position, as in
+    # `python -m pipeline index`
+    duplicates = representatives(load_dedup_index().groups(), ids)
+
+    # One output per combination. They share a single kNN graph, built at
+    # the largest n_neighbors the first time any of them has to be fitted.
+    grid = [umap_params(c, k, d) for c, k, d in itertools.product(
+        args.components, args.neighbors, args.min_dist)]
+    graph = []
+
+    def shared_knn():
+        if not graph:
+            start = time.perf_counter()
+            # over the rows project_unique fits
+            unique = [i for i, pmc_id in enumerate(ids)
+                      if pmc_id not in duplicates]
+            graph.append(nearest_neighbor_graph(
+                X[unique], max(args.neighbors), seed, args.jobs))
+            print(f"kNN graph took {time.perf_counter() - start:.2f}s")
+        return graph[0]
+
+    for params in grid:
+        output_file, model_file, layout_file = params_files(params)
+        start = time.perf_counter()
+        embedding = project_unique(
+            ids, X, duplicates, refit=args.refit, exact=args.exact,
+            layout_file=layout_file, model_file=model_file, params=params,
+            seed=seed, n_jobs=args.jobs,
+            knn=shared_knn if len(grid) > 1 else None)
+        print(f"Projection {params_tag(params)} took "
+              f"{time.perf_counter() - start:.2f}s -> {output_file}")
+        write_output(output_file, ids, embedding, articles)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+
+# ========== CONFIG ==========
+ARTICLES_FILE = "articles.csv"
+# "/PMC123..." anywhere in the URL, or a bare "PMC123" at its start
+PMC_URL_PATTERN = r"(?:^|/)PMC(\d+)"
+UNKNOWN_TITLE = "Unknown Title"
+# rows serialised per write when streaming JSON
+JSON_CHUNK_ROWS = 10000
+# rows read at a time when streaming an input CSV
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "10000"))
+
+log = logging.getLogger(__name__)
+
+# ========== ARTICLE METADATA ==========
+# One vectorised pass over the whole CSV column instead of a regex per row;
+# everything downstream joins on the resulting PMC id index.
+
+
+def extract_pmc_ids(urls):
+    # Series of URLs -> Series of PMC ids (NaN where none was found).
+    return urls.astype("string").str.extract(PMC_URL_PATTERN, expand=False)
+
+
+def iter_pmc_ids(path, url_column="url", chunksize=CSV_CHUNK_ROWS):
+    # PMC ids in CSV order, read chunksize rows at a time so memory doesn't
+    # grow with the file; warns about URLs without one.
+    import pandas as pd  # ~0.3s; only loaded by commands that read CSVs
+
+    for df in pd.read_csv(path, usecols=[url_column], chunksize=chunksize):
+        ids = extract_pmc_ids(df[url_column])
+        for url in df.loc[ids.isna(), url_column]:
+            log.warning("Failed to parse PMC ID from: %s", url)
+        yield from ids.dropna().tolist()
+
+
+def load_pmc_ids(path, url_column="url"):
+    return list(iter_pmc_ids(path, url_column))
+
+
+def load_articles(path=ARTICLES_FILE, url_column="Link"):
+    # articles.csv as a frame indexed by PMC id. A repeated id keeps its
+    # last row, as the old per-row dict did.
+    import pandas as pd
+
+    df = pd.read_csv(path)
+    df.index = extract_pmc_ids(df[url_column]).rename("id")
+    df = df[df.index.notna()]
+    return df[~df.index.duplicated(keep="last")]
+
+
+def titles_for(ids, articles):
+    return (articles["Title"].reindex(ids).fillna(UNKNOWN_TITLE)
+            .astype(str).to_numpy())
+
+# ========== STREAMED JSON ==========
+
+
+def write_json_records(path, columns, chunk_rows=JSON_CHUNK_ROWS):
+    # Writes {name: array} columns as a JSON array of objects, the same
+    # layout json.dump(..., indent=2) gives a list of dicts, without ever
+    # building that list. Replaced atomically like write_json_atomic.
+    names = list(columns)
+    n = len(columns[names[0]]) if names else 0
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("[")
+        for start in range(0, n, chunk_rows):
+            chunk = {name: columns[name][start:start + chunk_rows].tolist()
+                     for name in names}
+            parts = []
+            for row in zip(*chunk.values()):
+                fields = ",\n".join(
+                    f"    {json.dumps(name)}: "
+                    f"{json.dumps(value, ensure_ascii=False)}"
+                    for name, value in zip(names, row))
+                parts.append("\n  {\n" + fields + "\n  }")
+            f.write(("," if start else "") + ",".join(parts))
+        f.write("\n]" if n else "]")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
@@ -0,0 +1,321 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# ========== CONFIG ==========
+# where write_metrics() puts a snapshot: *.prom is Prometheus text format
+# (overwritten, e.g. for node_exporter's textfile collector), anything else
+# gets one JSON line appended per snapshot
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.prom")
+# snapshot interval during long runs; 0 writes only at the end
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "60"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# "text" (human-readable, key=value fields) or "json" (one object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# ========== METRICS ==========
+# One process-wide registry of counters, histograms and sampled gauges,
+# keyed by name plus labels. Everything is plain in-memory arithmetic, cheap
+# enough to call per request. Names follow Prometheus conventions:
+#   *_seconds          latency histograms (count, sum, p50/p99)
+#   *_seconds_total    time spent blocked (rate limits, retry delays)
+#   *_total            event counts
+# Parse workers run in other processes, so time extraction from the caller's
+# side of the pool.
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket holding the q-th value, as
+        # Prometheus' histogram_quantile does; the overflow bucket reports
+        # the largest value seen.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.buckets):
+                    return self.max
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = min(self.buckets[i], self.max)
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+
+class Gauge:
+    # A sampled level such as a queue depth: last, mean and max of samples.
+    def __init__(self):
+        self.value = 0.0
+        self.max = 0.0
+        self.total = 0.0
+        self.samples = 0
+
+    def set(self, value):
+        self.value = value
+        self.max = max(self.max, value)
+        self.total += value
+        self.samples += 1
+
+    def mean(self):
+        return self.total / self.samples if self.samples else 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, value=1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(value)
+
+    def sample(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        gauge = self.gauges.get(key)
+        if gauge is None:
+            gauge = self.gauges[key] = Gauge()
+        gauge.set(value)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def counter(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0.0)
+
+
+metrics = Metrics()
+inc = metrics.inc
+observe = metrics.observe
+sample = metrics.sample
+
+
+@contextmanager
+def timed(name, **labels):
+    # Observes the wall time of the block, awaits included, into a histogram.
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        metrics.observe(name, time.monotonic() - start, **labels)
+
+
+def count_cache(cache, hit):
+    inc("cache_lookups_total", cache=cache, result="hit" if hit else "miss")
+
+# ========== SINKS ==========
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def prometheus_text(registry=metrics):
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(registry.counters.items()):
+        declare(name, "counter")
+        lines.append(f"{name}{_label_text(labels)} {value:g}")
+    for (name, labels), hist in sorted(registry.histograms.items()):
+        declare(name, "histogram")
+        cumulative = 0
+        for bound, n in zip(hist.buckets + ("+Inf",), hist.counts):
+            cumulative += n
+            le = bound if isinstance(bound, str) else f"{bound:g}"
+            lines.append(f"{name}_bucket{_label_text(labels, [('le', le)])} "
+                         f"{cumulative}")
+        lines.append(f"{name}_sum{_label_text(labels)} {hist.sum:g}")
+        lines.append(f"{name}_count{_label_text(labels)} {hist.count}")
+    for (name, labels), gauge in sorted(registry.gauges.items()):
+        declare(name, "gauge")
+        lines.append(f"{name}{_label_text(labels)} {gauge.value:g}")
+        declare(f"{name}_max", "gauge")
+        lines.append(f"{name}_max{_label_text(labels)} {gauge.max:g}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot(registry=metrics):
+    return {
+        "time": time.time(),
+        "elapsed": registry.elapsed(),
+        "counters": [{"name": name, "labels": dict(labels), "value": value}
+                     for (name, labels), value in
+                     sorted(registry.counters.items())],
+        "histograms": [{"name": name, "labels": dict(labels),
+                        "count": h.count, "sum": h.sum, "max": h.max,
+                        "p50": h.quantile(0.5), "p99": h.quantile(0.99),
+                        "buckets": dict(zip(map(str, h.buckets + ("+Inf",)),
+                                            h.counts))}
+                       for (name, labels), h in
+                       sorted(registry.histograms.items())],
+        "gauges": [{"name": name, "labels": dict(labels), "value": g.value,
+                    "mean": g.mean(), "max": g.max}
+                   for (name, labels), g in sorted(registry.gauges.items())],
+    }
+
+
+def write_metrics(path=METRICS_FILE, registry=metrics):
+    if not path:
+        return
+    if path.endswith(".prom"):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(prometheus_text(registry))
+        os.replace(tmp, path)
+    else:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot(registry)) + "\n")
+
+
+async def flush_metrics(interval=METRICS_FLUSH_SECONDS, path=METRICS_FILE):
+    # Background task: a snapshot every `interval` seconds until cancelled.
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        write_metrics(path)
+
+# ========== SUMMARY ==========
+
+
+def _row_name(name, labels, suffix):
+    if suffix and name.endswith(suffix):
+        name = name[:-len(suffix)]
+    return name + "".join(f" {v}" for _, v in labels)
+
+
+def summary_table(registry=metrics):
+    elapsed = registry.elapsed()
+    out = [f"Run summary ({elapsed:.1f}s)"]
+    if registry.histograms:
+        out.append(f"  {'latency':<34}{'count':>8}{'total s':>10}"
+                   f"{'p50 ms':>10}{'p99 ms':>10}{'per s':>9}")
+        for (name, labels), h in sorted(registry.histograms.items()):
+            out.append(f"  {_row_name(name, labels, '_seconds'):<34}"
+                       f"{h.count:>8}{h.sum:>10.1f}"
+                       f"{h.quantile(0.5) * 1e3:>10.1f}"
+                       f"{h.quantile(0.99) * 1e3:>10.1f}"
+                       f"{h.count / elapsed if elapsed else 0:>9.1f}")
+    waits = [(key, v) for key, v in sorted(registry.counters.items())
+             if key[0].endswith("_seconds_total")]
+    if waits:
+        out.append(f"  {'time blocked':<34}{'total s':>10}{'of run':>8}")
+        for (name, labels), value in waits:
+            out.append(f"  {_row_name(name, labels, '_seconds_total'):<34}"
+                       f"{value:>10.1f}"
+                       f"{value / elapsed if elapsed else 0:>8.0%}")
+    caches = {}
+    for (name, labels), value in registry.counters.items():
+        if name == "cache_lookups_total":
+            labels = dict(labels)
+            caches.setdefault(labels["cache"], {})[labels["result"]] = value
+    if caches:
+        out.append(f"  {'cache':<34}{'hits':>8}{'misses':>8}{'ratio':>8}")
+        for cache, counts in sorted(caches.items()):
+            hits, misses = counts.get("hit", 0), counts.get("miss", 0)
+            ratio = hits / (hits + misses) if hits + misses else 0.0
+            out.append(f"  {cache:<34}{hits:>8.0f}{misses:>8.0f}{ratio:>8.0%}")
+    counts = [(key, v) for key, v in sorted(registry.counters.items())
+              if not key[0].endswith("_seconds_total")
+              and key[0] != "cache_lookups_total"]
+    if counts:
+        out.append(f"  {'events':<34}{'count':>8}{'per s':>9}")
+        for (name, labels), value in counts:
+            out.append(f"  {_row_name(name, labels, '_total'):<34}"
+                       f"{value:>8.0f}"
+                       f"{value / elapsed if elapsed else 0:>9.1f}")
+    if registry.gauges:
+        out.append(f"  {'sampled':<34}{'mean':>8}{'max':>8}")
+        for (name, labels), g in sorted(registry.gauges.items()):
+            out.append(f"  {_row_name(name, labels, ''):<34}"
+                       f"{g.mean():>8.1f}{g.max:>8.0f}")
+    return "\n".join(out)
+
+
+def print_summary(registry=metrics):
+    print(summary_table(registry))
+
+# ========== LOGGING ==========
+# Modules log through logging.getLogger(__name__); scripts call
+# setup_logging() once. Fields passed as extra={...} become key=value pairs
+# (or JSON keys) so a run's log can be grepped or parsed per article.
+
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "taskName"}
+
+
+def _extra_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS}
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, fmt=LOG_FORMAT):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.json = fmt == "json"
+
+    def format(self, record):
+        if not self.json:
+            fields = "".join(f" {k}={v}" for k, v in
+                             _extra_fields(record).items())
+            return super().format(record) + fields
+        entry = {"time": self.formatTime(record), "level": record.levelname,
+                 "logger": record.name, "message": record.getMessage()}
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(StructuredFormatter(fmt))
+    root.addHandler(handler)
+    root.setLevel(level)
+    # per-request lines from the HTTP client drown out everything else
+    logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import os
+import re
+import time
+import httpx
+from article_store import LEGACY_CACHE_DIR, get_article_store
+from metrics import count_cache, inc, observe, timed
+from ratelimit import AdaptiveConcurrency, TokenBucket, backoff_delay
+
+# ========== CONFIG ==========
+EUTILS_BASE_URL = os.getenv(
+    "EUTILS_BASE_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+EFETCH_URL = f"{EUTILS_BASE_URL}/efetch.fcgi"
+NCBI_API_KEY = os.getenv("NCBI_API_KEY")
+# E-utilities allow 3 requests/s per IP without a key and 10 with one;
+# NCBI_RPS overrides it (ledger.py gives each worker a share)
+REQUESTS_PER_SECOND = float(os.getenv("NCBI_RPS", 10 if NCBI_API_KEY else 3))
+MAX_CONCURRENT = 3
+# ceiling for the adaptive in-flight limit (and the HTTP connection pool)
+MAX_CONNECTIONS = 10
+# responses slower than this count as a congestion signal
+LATENCY_TARGET = 20.0
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 120.0
+# PMC ids per efetch call in batched mode; 0 or 1 disables batching
+EFETCH_BATCH_SIZE = int(os.getenv("EFETCH_BATCH_SIZE", "50"))
+
+log = logging.getLogger(__name__)
+
+# ========== ARTICLE SETS ==========
+
+ARTICLE_START = re.compile(r"<article[\s>]")
+ARTICLE_END = "</article>"
+PMC_ID_PATTERNS = [
+    re.compile(r'<article-id pub-id-type="pmcid">PMC(\d+)</article-id>'),
+    re.compile(r'<article-id pub-id-type="pmc">(?:PMC)?(\d+)</article-id>'),
+    re.compile(r'<article-id pub-id-type="pmcaid">(\d+)</article-id>'),
+]
+
+
+def split_articleset(xml_text):
+    # Splits a multi-article <pmc-articleset> into {pmc_id: xml}. Each piece
+    # keeps the original prolog and wrapper, so it is byte-for-byte what a
+    # single-id efetch for that article would have returned.
+    first = ARTICLE_START.search(xml_text)
+    if first is None:
+        return {}
+    prolog = xml_text[:first.start()]
+    articles = {}
+    pos = first.start()
+    while True:
+        start = ARTICLE_START.search(xml_text, pos)
+        if start is None:
+            break
+        end = xml_text.find(ARTICLE_END, start.start())
+        if end == -1:
+            break
+        end += len(ARTICLE_END)
+        body = xml_text[start.start():end]
+        for pattern in PMC_ID_PATTERNS:
+            m = pattern.search(body)
+            if m:
+                articles[m.group(1)] = prolog + body + "</pmc-articleset>"
+                break
+        pos = end
+    return articles
+
+
+# ========== RATE LIMITS ==========
+
+rate_limiter = TokenBucket(REQUESTS_PER_SECOND, name="ncbi")
+concurrency = AdaptiveConcurrency(
+    MAX_CONCURRENT, maximum=MAX_CONNECTIONS, latency_target=LATENCY_TARGET,
+    name="ncbi")
+stats = {"requests": 0, "throttled": 0, "retries": 0, "failed": 0}
+
+
+def print_fetch_stats():
+    log.info("NCBI: %d requests, %d throttled, %d retries, %d failed, "
+             "%.1fs waiting on the rate limit, concurrency limit %d",
+             stats["requests"], stats["throttled"], stats["retries"],
+             stats["failed"], rate_limiter.waited, int(concurrency.limit))
+
+
+# ========== FETCH ARTICLES ==========
+
+
+def retry_after(resp):
+    try:
+        return float(resp.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+async def efetch(client_http, ids, label):
+    # Returns the response body, or None once MAX_RETRIES retries have been
+    # spent on throttles, 5xx responses or network errors; any other 4xx
+    # raises httpx.HTTPStatusError straight away. Each attempt is
+    # timed into ncbi_request_seconds{status}, backoff sleeps into
+    # ncbi_backoff_seconds_total.
+    data = {"db": "pmc", "id": ",".join(ids), "retmode": "xml"}
+    if NCBI_API_KEY:
+        data["api_key"] = NCBI_API_KEY
+
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            stats["retries"] += 1
+        delay = backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+        async with concurrency:
+            await rate_limiter.acquire()
+            stats["requests"] += 1
+            start = time.monotonic()
+            try:
+                # POST so long id lists don't hit URL length limits
+                resp = await client_http.post(EFETCH_URL, data=data)
+            except httpx.RequestError as e:
+                observe("ncbi_request_seconds", time.monotonic() - start,
+                        status="error")
+                concurrency.on_throttle()
+                log.warning("Request error for %s: %s. Retrying in %.1fs...",
+                            label, e, delay,
+                            extra={"label": label, "attempt": attempt})
+                resp = None
+            if resp is not None:
+                latency = time.monotonic() - start
+                observe("ncbi_request_seconds", latency,
+                        status=str(resp.status_code))
+                if resp.status_code == 200:
+                    concurrency.on_success(latency)
+                    return resp.text
+                if resp.status_code == 429:
+                    stats["throttled"] += 1
+                    concurrency.on_throttle()
+                    delay = max(delay, retry_after(resp) or 0)
+                    log.warning("HTTP 429 Too Many Requests for %s. "
+                                "Waiting %.1fs...", label, delay,
+                                extra={"label": label, "attempt": attempt})
+                elif resp.status_code >= 500:
+                    concurrency.on_throttle()
+                    log.warning("HTTP %d for %s. Retrying in %.1fs...",
+                                resp.status_code, label, delay,
+                                extra={"label": label, "attempt": attempt})
+                else:
+                    resp.raise_for_status()
+        if attempt < MAX_RETRIES:
+            inc("ncbi_backoff_seconds_total", delay)
+            await asyncio.sleep(delay)
+
+    stats["failed"] += 1
+    inc("ncbi_failed_total")
+    log.error("Giving up on %s after %d retries", label, MAX_RETRIES,
+              extra={"label": label})
+    return None
+
+
+def load_legacy_article(pmc_id):
+    # not migrated yet (see `python article_store.py migrate`); imported into
+    # the store on first use, which is where the extract stage reads from
+    legacy_path = os.path.join(LEGACY_CACHE_DIR, f"{pmc_id}.xml")
+    if not os.path.exists(legacy_path):
+        return None
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        xml = f.read()
+    get_article_store().put(pmc_id, xml)
+    return xml
+
+
+def load_cached_article(pmc_id):
+    xml = get_article_store().get(pmc_id)
+    if xml is not None:
+        return xml
+    return load_legacy_article(pmc_id)
+
+
+def has_cached_article(pmc_id):
+    # Presence only: the store's index answers without decompressing
+    return (pmc_id in get_article_store()
+            or load_legacy_article(pmc_id) is not None)
+
+
+async def fetch_article(pmc_id, client_http):
+    xml = load_cached_article(pmc_id)
+    if xml is not None:
+        return xml
+
+    try:
+        with timed("fetch_article_seconds"):
+            text = await efetch(client_http, [pmc_id], f"PMC{pmc_id}")
+    except httpx.HTTPStatusError as e:
+        # a rejected id (4xx other than 429) is not retried; only this
+        # article is lost
+        stats["failed"] += 1
+        inc("ncbi_failed_total")
+        log.error("HTTP %d for PMC%s, skipping it", e.response.status_code,
+                  pmc_id, extra={"pmc_id": pmc_id})
+        return None
+    if text is not None:
+        get_article_store().put(pmc_id, text)
+    return text
+
+
+async def fetch_batch(pmc_ids, client_http):
+    # One efetch for the whole chunk; ids missing from the returned article
+    # set, or all of them if the request is rejected, fall back to single-id
+    # requests.
+    label = f"batch PMC{pmc_ids[0]}..PMC{pmc_ids[-1]} ({len(pmc_ids)} ids)"
+    try:
+        with timed("fetch_batch_seconds"):
+            text = await efetch(client_http, pmc_ids, label)
+    except httpx.HTTPStatusError as e:
+        # one bad id can get the whole batch rejected
+        log.warning("HTTP %d for %s, fetching its ids alone",
+                    e.response.status_code, label, extra={"label": label})
+        for pmc_id in pmc_ids:
+            await fetch_article(pmc_id, client_http)
+        return
+    if text is None:
+        return
+    articles = split_articleset(text)
+    store = get_article_store()
+    for pmc_id in pmc_ids:
+        xml = articles.get(pmc_id)
+        if xml is not None:
+            store.put(pmc_id, xml)
+        else:
+            log.info("PMC%s missing from batch response, fetching alone",
+                     pmc_id, extra={"pmc_id": pmc_id})
+            await fetch_article(pmc_id, client_http)
+
+
+async def prefetch_articles(pmc_ids, client_http, batch_size=EFETCH_BATCH_SIZE):
+    # Pulls every uncached id into the article store in batches so the
+    # per-article pipeline only ever hits the store. In-flight requests are
+    # bounded by the shared rate limits inside efetch. Every id is counted
+    # once against the article-store hit ratio here.
+    # Other processes sharing the pack may have stored some since we looked.
+    get_article_store().refresh()
+    missing = []
+    for pid in dict.fromkeys(pmc_ids):
+        cached = has_cached_article(pid)
+        count_cache("article", cached)
+        if not cached:
+            missing.append(pid)
+    if not missing or batch_size <= 1:
+        return
+    chunks = [missing[i:i + batch_size]
+              for i in range(0, len(missing), batch_size)]
+    log.info("Fetching %d uncached articles in %d batches of up to %d",
+             len(missing), len(chunks), batch_size)
+
+    await asyncio.gather(*(fetch_batch(chunk, client_http) for chunk in chunks))
+
+
+async def fetch_all_articles(pmc_ids):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS)
+    async with httpx.AsyncClient(timeout=60.0, limits=limits) as client_http:
+        await prefetch_articles(pmc_ids, client_http)
+
+        async def sem_fetch(pid):
+            async with semaphore:
+                return await fetch_article(pid, client_http)
+
+        tasks = [sem_fetch(pid) for pid in pmc_ids]
+        return await asyncio.gather(*tasks)
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from journal import write_json_atomic
+from files import NEIGHBORS_FILE
+from metrics import setup_logging
+from scores import ensure_scores
+
+# ========== CONFIG ==========
+# {pmc_id: [related pmc ids, nearest first]}, served by the Spring API's
+# /umap/related/{id} (RelatedIndex.java)
+NEIGHBORS_JSON = "neighbors.json"
+# related articles precomputed per article
+NEIGHBORS_K = int(os.getenv("NEIGHBORS_K", "10"))
+# exact NumPy search up to this many articles, pynndescent above it
+EXACT_MAX_ROWS = int(os.getenv("NEIGHBORS_EXACT_MAX_ROWS", "20000"))
+# query rows per matrix product in exact search; bounds the N x chunk
+# distance block held in memory
+EXACT_CHUNK_ROWS = 1024
+METRICS = ("cosine", "euclidean")
+RANDOM_STATE = 42
+
+# ========== NEIGHBOUR INDEX ==========
+# Related articles in the 15-dim topic-score space. Distances are 1 - cosine
+# similarity or L2, smallest first.
+
+
+def _normalize(X):
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    # an all-zero score row has no direction; leave it at zero so it is
+    # equally far (distance 1) from everything
+    return X / np.where(norms == 0, 1, norms)
+
+
+class NeighborIndex:
+    def __init__(self, X, metric="cosine", exact=None, n_jobs=None):
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}")
+        self.metric = metric
+        self.X = np.array(X, dtype=np.float32)
+        if metric == "cosine":
+            self.X = _normalize(self.X)
+        self.exact = len(self.X) <= EXACT_MAX_ROWS if exact is None else exact
+        self.ann = None
+        if not self.exact:
+            # pulls in numba; only needed for large corpora
+            from pynndescent import NNDescent
+
+            # rows are already unit length for cosine, so euclidean gives
+            # the same order and pynndescent's fastest path
+            self.ann = NNDescent(self.X, metric="euclidean",
+                                 n_neighbors=max(NEIGHBORS_K + 1, 15),
+                                 random_state=RANDOM_STATE,
+                                 n_jobs=n_jobs or os.cpu_count())
+            self.ann.prepare()
+        self._sq_norms = (self.X ** 2).sum(axis=1)
+
+    def __len__(self):
+        return len(self.X)
+
+    def _distances(self, Q):
+        if self.metric == "cosine":
+            return 1 - Q @ self.X.T
+        d2 = ((Q ** 2).sum(axis=1)[:, None] - 2 * Q @ self.X.T
+              + self._sq_norms[None, :])
+        return np.sqrt(np.maximum(d2, 0))
+
+    def _to_metric(self, d):
+        # pynndescent returns L2 between unit vectors: 1 - cos = d^2 / 2
+        return d ** 2 / 2 if self.metric == "cosine" else d
+
+    def query(self, Q, k=NEIGHBORS_K):
+        # Q: (m, dims) score rows. Returns (indices, distances), (m, k) each,
+        # nearest first.
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+        if self.metric == "cosine":
+            Q = _normalize(Q)
+        k = min(k, len(self))
+        if self.ann is not None:
+            idx, d = self.ann.query(Q, k=k)
+            return idx, self._to_metric(d)
+
+        indices = np.empty((len(Q), k), dtype=np.int64)
+        distances = np.empty((len(Q), k), dtype=np.float32)
+        for start in range(0, len(Q), EXACT_CHUNK_ROWS):
+            d = self._distances(Q[start:start + EXACT_CHUNK_ROWS])
+            part = np.argpartition(d, k - 1, axis=1)[:, :k]
+            part_d = np.take_along_axis(d, part, axis=1)
+            order = np.argsort(part_d, axis=1, kind="stable")
+            indices[start:start + len(d)] = np.take_along_axis(part, order, 1)
+            distances[start:start + len(d)] = np.take_along_axis(part_d, order, 1)
+        return indices, distances
+
+    def all_neighbors(self, k=NEIGHBORS_K):
+        # k nearest other articles for every article. Asks for one extra and
+        # drops each row's own id (wherever ties put it).
+        k = min(k, len(self) - 1)
+        if self.ann is not None and self.ann.neighbor_graph[0].shape[1] > k:
+            idx, d = self.ann.neighbor_graph
+            idx, d = idx[:, :k + 1], self._to_metric(d[:, :k + 1])
+        else:
+            idx, d = self.query(self.X, k + 1)
+        own = idx == np.arange(len(idx))[:, None]
+        # rows whose own id didn't come back (duplicates, ANN misses) lose
+        # their farthest neighbour instead
+        own[~own.any(axis=1), -1] = True
+        keep = ~own
+        # exactly k survivors per row: drop extra own ids beyond the first
+        keep &= np.cumsum(keep, axis=1) <= k
+        return (idx[keep].reshape(len(idx), k).astype(np.int32),
+                d[keep].reshape(len(idx), k).astype(np.float32))
+
+# ========== PRECOMPUTED NEIGHBOURS ==========
+
+
+def build_neighbors(ids, X, metric="cosine", k=NEIGHBORS_K, exact=None,
+                    path=NEIGHBORS_FILE, json_path=NEIGHBORS_JSON):
+    # path keeps rows and distances for --query; json_path (None to skip)
+    # is the API's copy
+    index = NeighborIndex(X, metric, exact)
+    indices, distances = index.all_neighbors(k)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, ids=np.asarray(ids), indices=indices, distances=distances,
+                 metric=metric)
+    os.replace(tmp, path)
+    if json_path:
+        write_neighbors_json(json_path, ids, indices)
+    return indices, distances
+
+
+def write_neighbors_json(path, ids, indices):
+    # {pmc_id: [related pmc ids, nearest first]} for the API to serve as is.
+    ids = np.asarray(ids)
+    write_json_atomic(path, dict(zip(ids.tolist(), ids[indices].tolist())),
+                      indent=None)
+
+# ========== MAIN ==========
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute related articles in topic-score space")
+    parser.add_argument("--metric", default="cosine", choices=METRICS)
+    parser.add_argument("-k", type=int, default=NEIGHBORS_K)
+    parser.add_argument("--exact", action="store_true", default=None,
+                        help="force exact search regardless of corpus size")
+    parser.add_argument("--out", default=NEIGHBORS_FILE)
+    parser.add_argument("--json", default=NEIGHBORS_JSON,
+                        help="where the API's {id: [related ids]} goes")
+    parser.add_argument("--query", help="print the neighbours of this PMC id")
+    args = parser.parse_args()
+    setup_logging()
+
+    ids, X = ensure_scores()
+    start = time.perf_counter()
+    indices, distances = build_neighbors(ids, X, args.metric, args.k,
+                                         args.exact, args.out, args.json)
+    print(f"{len(ids)} articles x {indices.shape[1]} neighbours "
+          f"({args.metric}) in {time.perf_counter() - start:.2f}s "
+          f"-> {args.out}, {args.json}")
+    if args.query:
+        row = ids.index(args.query)
+        print(json.dumps([[ids[j], round(float(d), 4)] for j, d in
+                          zip(indices[row], distances[row])]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+# Single-pass ingest -> extract -> scores -> labels pipeline. runner.py has
+# the bounded-queue machinery, stages.py the stages themselves, and
+# `python -m pipeline` the command line.
+from .runner import BatchStage, Stage, run_stages
+from .stages import STAGES, build_indexes, run_pipeline
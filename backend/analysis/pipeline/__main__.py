@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+from dotenv import load_dotenv
+from indexes import build_chunk_index, build_indexes
+from metadata import iter_pmc_ids
+from metrics import setup_logging
+from .stages import STAGES, run_pipeline
+
+load_dotenv()
+
+# python -m pipeline run             everything, then index/project
+# python -m pipeline scores          what main.py did
+# python -m pipeline labels          what gen.py did, for unscored ids too
+# python -m pipeline ingest          only fill the article store
+# python -m pipeline index           only rebuild the derived indexes
+# python -m pipeline chunks          chunk stored articles for retrieval
+#
+# Every command skips work whose output already exists, so re-running one
+# after an interruption resumes it.
+# cli.py wraps the same steps as lighter-to-start subcommands (fetch,
+# extract, classify, project, status).
+
+COMMANDS = {
+    "run": STAGES,
+    "ingest": ("ingest",),
+    "extract": ("ingest", "extract"),
+    "scores": ("scores",),
+    "labels": ("labels",),
+    "index": (),
+    "chunks": (),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m pipeline")
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("--input", default="test.csv",
+                        help="CSV with a 'url' column of PMC article links")
+    parser.add_argument("--no-index", action="store_true",
+                        help="skip the index/project step after `run`")
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.command == "index":
+        build_indexes()
+        return
+    if args.command == "chunks":
+        build_chunk_index()
+        return
+    pmc_ids = iter_pmc_ids(args.input)
+    asyncio.run(run_pipeline(
+        pmc_ids, COMMANDS[args.command],
+        index=args.command == "run" and not args.no_index))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import asyncio
+from metrics import inc, sample, timed
+
+# ========== CONFIG ==========
+# items waiting in front of each stage; a full queue blocks the stage
+# before it, so memory stays bounded however long the input is
+QUEUE_SIZE = 64
+# how often queue depths are sampled into the queue_depth gauges
+QUEUE_SAMPLE_SECONDS = 1.0
+
+# ========== STAGES ==========
+# A pipeline is a list of stages joined by bounded asyncio queues. Each stage
+# runs its own fixed pool of workers; a worker takes an item, runs the
+# handler and passes the result on (None drops it). When the input is
+# exhausted every queue is drained in order, then the workers exit.
+# Handler calls are timed into stage_seconds{stage} and counted into
+# stage_items_total{stage}; a full queue in front of a slow stage shows up in
+# its queue_depth gauge.
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name, handler, workers=1, queue_size=QUEUE_SIZE):
+        # handler: async fn(item) -> item for the next stage, or None
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+
+    async def work(self, inbox, outbox):
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            inc("stage_items_total", stage=self.name)
+            with timed("stage_seconds", stage=self.name):
+                result = await self.handler(item)
+            if result is not None and outbox is not None:
+                await outbox.put(result)
+
+
+class BatchStage(Stage):
+    # Collects items into a batch until cost(item) adds up to budget or no
+    # new item arrives for `linger` seconds, then runs handler(batch), which
+    # returns the items to pass on.
+
+    def __init__(self, name, handler, workers=1, queue_size=QUEUE_SIZE,
+                 budget=50, cost=None, linger=0.5):
+        super().__init__(name, handler, workers, queue_size)
+        self.budget = budget
+        self.cost = cost or (lambda item: 1)
+        self.linger = linger
+
+    async def work(self, inbox, outbox):
+        done = False
+        while not done:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            batch = [item]
+            used = self.cost(item)
+            while used < self.budget:
+                try:
+                    item = await asyncio.wait_for(inbox.get(), self.linger)
+                except asyncio.TimeoutError:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+                used += self.cost(item)
+            inc("stage_items_total", len(batch), stage=self.name)
+            with timed("stage_seconds", stage=self.name):
+                results = await self.handler(batch)
+            for result in results:
+                if outbox is not None:
+                    await outbox.put(result)
+
+
+async def run_stages(items, stages, stop=None):
+    # Feeds items (any iterable or async iterable) through the stages and
+    # returns once everything has drained. Setting the stop event ends the
+    # input early; items already inside the pipeline still finish.
+    queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in stages]
+    stop = stop or asyncio.Event()
+
+    async def feed():
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                if stop.is_set():
+                    break
+                await queues[0].put(item)
+        else:
+            for item in items:
+                if stop.is_set():
+                    break
+                await queues[0].put(item)
+                # a generator never yields to the loop on its own
+                await asyncio.sleep(0)
+        for _ in range(stages[0].workers):
+            await queues[0].put(_DONE)
+
+    async def run_stage(i, stage):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        await asyncio.gather(*(stage.work(queues[i], outbox)
+                               for _ in range(stage.workers)))
+        # everything this stage will ever emit is queued; tell the next
+        # stage's workers to stop once they reach it
+        if outbox is not None:
+            for _ in range(stages[i + 1].workers):
+                await outbox.put(_DONE)
+
+    async def watch_queues():
+        while True:
+            for stage, queue in zip(stages, queues):
+                sample("queue_depth", queue.qsize(), stage=stage.name)
+            await asyncio.sleep(QUEUE_SAMPLE_SECONDS)
+
+    tasks = [asyncio.create_task(feed())]
+    tasks += [asyncio.create_task(run_stage(i, stage))
+              for i, stage in enumerate(stages)]
+    watcher = asyncio.create_task(watch_queues())
+    try:
+        # a failing handler surfaces here instead of leaving the feeder
+        # blocked on a queue nobody reads
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        watcher.cancel()
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,332 @@
+import asyncio
+import logging
+import os
+import signal
+import httpx
+from article_store import close_article_store
+from classify import (BATCH_TOKEN_BUDGET, OUTPUT_TOKENS_PER_ARTICLE, TOPICS,
+                      classify_articles, estimate_tokens, new_classify_stats,
+                      parse_score_row, print_classify_stats, request_failed,
+                      summarize_labels, summarize_scores)
+from dedup import DEDUP_THRESHOLD, load_dedup_index, minhash
+from extract import (PARSE_WORKERS, extract_stored_cached, get_parse_pool,
+                     shutdown_parse_pool)
+from files import PROCESSED_FILE, SUMMARY_FILE, TOPICS_FILE
+from gemini import GEMINI_CONCURRENCY
+from indexes import build_indexes
+from journal import JournaledDict, load_json, write_json_atomic
+from llm_cache import print_llm_cache_stats
+from metrics import (flush_metrics, inc, metrics, print_summary,
+                     write_metrics)
+from ncbi import (EFETCH_BATCH_SIZE, MAX_CONCURRENT, MAX_CONNECTIONS,
+                  fetch_article, has_cached_article, prefetch_articles,
+                  print_fetch_stats)
+from scores import publish_scores
+from topic_index import load_topic_index
+from .runner import BatchStage, Stage, run_stages
+
+# ========== CONFIG ==========
+# ingest -> extract -> scores (main.py) and labels (gen.py), in that order
+STAGES = ("ingest", "extract", "scores", "labels")
+# pack several abstracts into each Gemini request (see classify.py)
+BATCH_CLASSIFY = os.getenv("BATCH_CLASSIFY", "1") != "0"
+# parse jobs queued per pool worker
+EXTRACT_WORKERS = 2 * PARSE_WORKERS
+# copy scores/labels from an already classified near-duplicate (dedup.py)
+# instead of asking Gemini again. Off by default: it parses and MinHashes
+# every article's full text, scores-only runs included. The map's
+# near-duplicate groups come from `python dedup.py` either way.
+DEDUP_REUSE = os.getenv("DEDUP_REUSE", "0") != "0"
+
+log = logging.getLogger(__name__)
+
+# ========== TOPIC LABELS ==========
+
+
+def update_topics(topics_data, pmc_id, summary_text):
+    # In-memory only; topics_data maps each topic to its labelled ids (a
+    # dict used as an ordered set) and is written out on compaction.
+    for topic in TOPICS:
+        topics_data.setdefault(topic, {})
+
+    predicted_topics = [t.strip()
+                        for t in summary_text.split(",") if t.strip()]
+
+    for topic in predicted_topics:
+        if topic in topics_data:
+            topics_data[topic][pmc_id] = None
+        else:
+            log.warning("Unknown topic returned by Gemini: '%s'", topic,
+                        extra={"pmc_id": pmc_id})
+
+
+def ranked_topics(topics_data, topic_index):
+    # topics.json: every labelled article, best first by its Gemini score
+    # for the topic (see topic_index.py)
+    return {
+        topic: topic_index.rank(topic, list(ids)) if topic in TOPICS
+        else list(ids)
+        for topic, ids in topics_data.items()
+    }
+
+# ========== OUTPUTS ==========
+
+
+class Outputs:
+    # Everything the stages persist, journaled so an interrupted run picks
+    # up where it stopped:
+    #   result.json     pmc id -> score string (+ scores.npy on compaction)
+    #   processed.json  labelled pmc ids; topics.json is rewritten with it
+    #   dedup.npz       MinHash signatures of the articles seen so far
+
+    def __init__(self):
+        self.scores = JournaledDict(
+            SUMMARY_FILE, on_compact=lambda: publish_scores(self.scores.data))
+        self.topics = {topic: dict.fromkeys(ids)
+                       for topic, ids in load_json(TOPICS_FILE, {}).items()}
+        self.labels = JournaledDict(
+            PROCESSED_FILE, load=dict.fromkeys, dump=list, default=[],
+            on_compact=self.write_topics)
+        for pmc_id, summary in self.labels.replayed:
+            update_topics(self.topics, pmc_id, summary)
+        self.dedup = load_dedup_index() if DEDUP_REUSE else None
+
+    def write_topics(self):
+        write_json_atomic(TOPICS_FILE,
+                          ranked_topics(self.topics, load_topic_index()))
+
+    def save_scores(self, pmc_id, summary):
+        if parse_score_row(summary) is None:
+            log.warning("Rejecting malformed scores for PMC%s: %r", pmc_id,
+                        summary, extra={"pmc_id": pmc_id})
+            return
+        log.info("PMC%s summary: %s", pmc_id, summary,
+                 extra={"pmc_id": pmc_id})
+        self.scores.set(pmc_id, summary)
+
+    def save_labels(self, pmc_id, summary):
+        log.info("Updating topics for PMC%s: %s", pmc_id, summary,
+                 extra={"pmc_id": pmc_id})
+        update_topics(self.topics, pmc_id, summary)
+        self.labels.set(pmc_id, summary)
+
+    def labels_of(self, pmc_id):
+        # the label string as saved, rebuilt from topics (processed.json
+        # only keeps ids)
+        return ", ".join(topic for topic, ids in self.topics.items()
+                         if pmc_id in ids)
+
+    def reuse_duplicate(self, pmc_id, signature, needs):
+        # Fills what `needs` asks for from the most similar article that
+        # already has it; returns what is still needed.
+        matches = self.dedup.query(signature, DEDUP_THRESHOLD, exclude=pmc_id)
+        self.dedup.add(pmc_id, signature)
+        for other, similarity in matches:
+            if "scores" in needs and other in self.scores:
+                log.info("PMC%s reuses the scores of PMC%s (%.0f%% similar)",
+                         pmc_id, other, 100 * similarity,
+                         extra={"pmc_id": pmc_id, "duplicate_of": other})
+                self.save_scores(pmc_id, self.scores[other])
+                needs.discard("scores")
+                inc("dedup_reused_total", output="scores")
+            labels = self.labels_of(other) if other in self.labels else ""
+            if "labels" in needs and labels:
+                log.info("PMC%s reuses the labels of PMC%s (%.0f%% similar)",
+                         pmc_id, other, 100 * similarity,
+                         extra={"pmc_id": pmc_id, "duplicate_of": other})
+                self.save_labels(pmc_id, labels)
+                needs.discard("labels")
+                inc("dedup_reused_total", output="labels")
+        return needs
+
+    def close(self):
+        # scores first: the topics.json ranking reads scores.npy
+        self.scores.close()
+        self.labels.close()
+        if self.dedup is not None and self.dedup.dirty:
+            self.dedup.save()
+
+# ========== STAGES ==========
+# Items flowing between stages are dicts: {"pmc_id", "needs"} from ingest,
+# plus one text per needed mode ("abstract" for scores, "paragraphs" for
+# labels) from extract. "needs" is decided once, up front, from what the
+# outputs already hold, which is what makes a re-run resume.
+
+
+def build_stages(selected, outputs, client_http, classify_stats, seen=None):
+    # seen: the ids taken in so far, so one repeated in the input is only
+    # classified once. ledger.py passes its own and drops an id from it
+    # when the id leaves the pipeline, so a retry of that id gets through.
+
+    def needs(pmc_id):
+        wanted = set()
+        if "scores" in selected and pmc_id not in outputs.scores:
+            wanted.add("scores")
+        if "labels" in selected and pmc_id not in outputs.labels:
+            wanted.add("labels")
+        return wanted
+
+    seen = set() if seen is None else seen
+
+    async def ingest(pmc_ids):
+        # One efetch per batch for whatever isn't in the article store yet.
+        # An id repeated in the input would otherwise be classified twice.
+        fresh = [pid for pid in dict.fromkeys(pmc_ids) if pid not in seen]
+        seen.update(fresh)
+        items = [{"pmc_id": pid, "needs": needs(pid)} for pid in fresh]
+        # fetch and extract alone have no outputs to resume from: the
+        # article store and the text cache skip what they already hold
+        if selected & {"scores", "labels"}:
+            items = [item for item in items if item["needs"]]
+        await prefetch_articles([item["pmc_id"] for item in items], client_http)
+        ready = []
+        for item in items:
+            pmc_id = item["pmc_id"]
+            if (not has_cached_article(pmc_id)
+                    and not await fetch_article(pmc_id, client_http)):
+                log.warning("No XML returned for PMC%s", pmc_id,
+                            extra={"pmc_id": pmc_id})
+                continue
+            ready.append(item)
+        return ready
+
+    async def extract(item):
+        # With DEDUP_REUSE the full text is always extracted (in the same
+        # parse) so a near-duplicate is recognised before any Gemini call;
+        # its MinHash is computed in the parse pool too. Run without a
+        # classifier it fills the text cache with every mode.
+        modes = {"scores": "abstract", "labels": "paragraphs"}
+        wanted = {modes[need] for need in item["needs"]}
+        if not selected & set(modes):
+            wanted = set(modes.values())
+        if outputs.dedup is not None:
+            wanted.add("paragraphs")
+        texts = await extract_stored_cached(item["pmc_id"], tuple(sorted(wanted)))
+        if texts is None:
+            return None
+        if outputs.dedup is not None and texts["paragraphs"]:
+            signature = await asyncio.get_running_loop().run_in_executor(
+                get_parse_pool(), minhash, texts["paragraphs"])
+            if signature is not None:
+                outputs.reuse_duplicate(item["pmc_id"], signature,
+                                        item["needs"])
+        for need, mode in modes.items():
+            if need in item["needs"] and not texts[mode]:
+                log.warning("No %s found for PMC%s", mode, item["pmc_id"],
+                            extra={"pmc_id": item["pmc_id"]})
+                item["needs"].discard(need)
+        item.update((modes[need], texts[modes[need]]) for need in item["needs"])
+        return item if item["needs"] else None
+
+    def score_cost(item):
+        if "scores" not in item["needs"]:
+            return 0
+        return estimate_tokens(item["abstract"]) + OUTPUT_TOKENS_PER_ARTICLE
+
+    async def scores(batch):
+        todo = [(item["pmc_id"], item["abstract"])
+                for item in batch if "scores" in item["needs"]]
+        if BATCH_CLASSIFY:
+            await classify_articles(todo, outputs.save_scores,
+                                    stats=classify_stats)
+        else:
+            for pmc_id, text in todo:
+                try:
+                    summary = await summarize_scores(text)
+                except Exception as e:
+                    request_failed([pmc_id], "scores", e)
+                    continue
+                if summary is not None:
+                    outputs.save_scores(pmc_id, summary)
+        return [item for item in batch if "labels" in item["needs"]]
+
+    async def labels(item):
+        try:
+            summary = await summarize_labels(item["paragraphs"])
+        except Exception as e:
+            request_failed([item["pmc_id"]], "labels", e)
+            return None
+        if summary is not None:
+            outputs.save_labels(item["pmc_id"], summary)
+        return None
+
+    stages = {
+        "ingest": BatchStage("ingest", ingest, workers=MAX_CONCURRENT,
+                             budget=EFETCH_BATCH_SIZE),
+        "extract": Stage("extract", extract, workers=EXTRACT_WORKERS),
+        # each worker classifies a token budget's worth at a time, so
+        # requests stay full-sized while articles keep streaming in
+        "scores": BatchStage("scores", scores, workers=GEMINI_CONCURRENCY,
+                             budget=BATCH_TOKEN_BUDGET if BATCH_CLASSIFY else 1,
+                             cost=score_cost if BATCH_CLASSIFY else None),
+        "labels": Stage("labels", labels, workers=GEMINI_CONCURRENCY),
+    }
+    names = set(selected)
+    if names & {"scores", "labels"}:
+        # both classifiers need the article fetched and parsed first
+        names |= {"ingest", "extract"}
+    return [stages[name] for name in STAGES if name in names]
+
+# ========== RUN ==========
+
+
+def handle_interrupts(stop):
+    # First Ctrl-C stops reading input and lets the articles already in the
+    # queues finish; a second one cancels them. Either way the journals are
+    # compacted on the way out. Returns a function that restores SIGINT.
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+
+    def on_interrupt():
+        if stop.is_set():
+            log.warning("Aborting in-flight work")
+            task.cancel()
+            return
+        log.warning("Stopping: finishing in-flight articles "
+                    "(Ctrl-C again to abort)")
+        stop.set()
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, on_interrupt)
+    except NotImplementedError:  # Windows event loops
+        return lambda: None
+    return lambda: loop.remove_signal_handler(signal.SIGINT)
+
+
+async def run_pipeline(pmc_ids, stages=STAGES, index=False):
+    # pmc_ids: any iterable or async iterable of PMC ids, consumed lazily
+    # (see metadata.iter_pmc_ids). Metrics are snapshotted to METRICS_FILE
+    # while it runs and summarised in a table at the end.
+    metrics.reset()
+    selected = set(stages)
+    outputs = Outputs()
+    classify_stats = new_classify_stats()
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS)
+    stop = asyncio.Event()
+    restore_sigint = handle_interrupts(stop)
+    flusher = asyncio.create_task(flush_metrics())
+    try:
+        async with httpx.AsyncClient(timeout=60.0, limits=limits) as client_http:
+            await run_stages(pmc_ids, build_stages(
+                selected, outputs, client_http, classify_stats), stop)
+    except asyncio.CancelledError:
+        log.warning("Aborted; finished articles are saved, re-run to resume")
+    finally:
+        flusher.cancel()
+        restore_sigint()
+        outputs.close()
+        shutdown_parse_pool()
+
+    if stop.is_set():
+        log.warning("Interrupted; re-run to resume")
+    elif index:
+        build_indexes()
+    elif "scores" in selected:
+        load_topic_index()
+    close_article_store()
+    print_fetch_stats()
+    if "scores" in selected:
+        print_classify_stats(classify_stats)
+    print_llm_cache_stats()
+    write_metrics()
+    print_summary()
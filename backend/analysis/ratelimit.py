@@ -0,0 +1,103 @@
+import asyncio
+import random
+import time
+from collections import deque
+from metrics import inc
+
+# ========== RATE LIMITING ==========
+# Shared by every coroutine that talks to the same upstream. Nothing here
+# holds on to an event loop between calls, so one limiter can outlive
+# several asyncio.run() invocations.
+
+
+class TokenBucket:
+    # Requests-per-second limiter with a small burst allowance, implemented
+    # as a virtual schedule (GCRA): each caller reserves the next free slot
+    # and sleeps until it, so waiters are served in arrival order. Time spent
+    # waiting is reported as rate_limit_wait_seconds_total{limiter=name}.
+
+    def __init__(self, rate, burst=1, name="default"):
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self.next_slot = 0.0
+        self.waited = 0.0
+
+    async def acquire(self):
+        now = time.monotonic()
+        interval = 1.0 / self.rate
+        slot = max(self.next_slot, now - (self.burst - 1) * interval)
+        self.next_slot = slot + interval
+        wait = slot - now
+        if wait > 0:
+            self.waited += wait
+            inc("rate_limit_wait_seconds_total", wait, limiter=self.name)
+            await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    # AIMD limit on in-flight requests: +1 after a full window of healthy
+    # responses, halved on a throttle or when latency exceeds the target.
+    # A burst of throttles from requests that were already in flight only
+    # halves the limit once per cooldown. Time spent queued for a free slot
+    # is reported as concurrency_wait_seconds_total{limiter=name}.
+
+    def __init__(self, initial, minimum=1, maximum=10, latency_target=None,
+                 cooldown=1.0, name="default"):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.name = name
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.waiters = deque()
+
+    async def __aenter__(self):
+        start = None
+        while self.in_flight >= int(self.limit):
+            start = start or time.monotonic()
+            fut = asyncio.get_running_loop().create_future()
+            self.waiters.append(fut)
+            try:
+                await fut
+            finally:
+                if fut in self.waiters:
+                    self.waiters.remove(fut)
+        if start is not None:
+            inc("concurrency_wait_seconds_total", time.monotonic() - start,
+                limiter=self.name)
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self.waiters:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+    def on_success(self, latency):
+        if self.latency_target is not None and latency > self.latency_target:
+            self.on_throttle()
+            return
+        self.limit = min(self.maximum, self.limit + 1.0 / max(self.limit, 1.0))
+        self._wake()
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    # Exponential backoff with full jitter (attempt counts from 0).
+    return random.uniform(0, min(cap, base * 2 ** attempt))
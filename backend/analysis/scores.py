@@ -0,0 +1,117 @@
+import argparse
+import json
+import logging
+import os
+import numpy as np
+from classify import TOPICS, parse_score_row
+from files import SUMMARY_FILE
+from journal import load_json, write_json_atomic
+from metrics import setup_logging
+
+# ========== CONFIG ==========
+# N x len(TOPICS) float32 matrix, row i belongs to ids[i] in the meta file
+SCORES_FILE = "scores.npy"
+SCORES_META_FILE = "scores.meta.json"
+SCORES_DTYPE = np.float32
+SCORES_VERSION = 1
+
+log = logging.getLogger(__name__)
+
+# ========== SCORE MATRIX ==========
+# result.json keeps the raw Gemini strings for the Java side and for
+# re-validation; everything numeric downstream (mapa.py, similarity search)
+# reads this matrix instead, memory-mapped, with no per-row parsing.
+
+
+def scores_from_summaries(summaries):
+    # Returns (ids, matrix, rejected ids). Rows that don't validate as 15
+    # numbers in [0, 1] are left out.
+    ids = []
+    rows = []
+    rejected = []
+    for pmc_id, summary in summaries.items():
+        values = parse_score_row(summary)
+        if values is None:
+            rejected.append(pmc_id)
+            continue
+        ids.append(pmc_id)
+        rows.append(values)
+    matrix = np.array(rows, dtype=SCORES_DTYPE).reshape(len(rows), len(TOPICS))
+    return ids, matrix, rejected
+
+
+def write_scores(ids, matrix, path=SCORES_FILE, meta_path=SCORES_META_FILE):
+    # The matrix is replaced before the meta file; load_scores rejects a
+    # pair whose row counts disagree, so a crash in between is detected.
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=SCORES_DTYPE))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    write_json_atomic(meta_path, {
+        "version": SCORES_VERSION,
+        "dtype": np.dtype(SCORES_DTYPE).name,
+        "shape": list(matrix.shape),
+        "topics": TOPICS,
+        "ids": list(ids),
+    })
+
+
+def publish_scores(summaries, path=SCORES_FILE, meta_path=SCORES_META_FILE):
+    ids, matrix, rejected = scores_from_summaries(summaries)
+    if rejected:
+        log.warning("Skipping %d malformed score rows: %s", len(rejected),
+                    ", ".join(rejected[:10]))
+    write_scores(ids, matrix, path, meta_path)
+    return ids, matrix
+
+
+def load_scores(path=SCORES_FILE, meta_path=SCORES_META_FILE, mmap=True):
+    # Returns (ids, matrix); the matrix is a read-only memory map by default.
+    meta = load_json(meta_path, None)
+    if meta is None or not os.path.exists(path):
+        raise FileNotFoundError(f"{path} / {meta_path} not found")
+    if meta.get("version") != SCORES_VERSION:
+        raise ValueError(f"{meta_path}: unsupported version {meta.get('version')}")
+    if meta["topics"] != TOPICS:
+        raise ValueError(f"{meta_path}: topic order differs from classify.TOPICS")
+    matrix = np.load(path, mmap_mode="r" if mmap else None)
+    if matrix.dtype != SCORES_DTYPE or matrix.shape != (len(meta["ids"]), len(TOPICS)):
+        raise ValueError(f"{path} does not match {meta_path}")
+    return meta["ids"], matrix
+
+
+def ensure_scores(summary_file=SUMMARY_FILE, path=SCORES_FILE,
+                  meta_path=SCORES_META_FILE):
+    # Rebuild from result.json when the matrix is missing or older than it
+    # (e.g. result.json was edited by hand or produced before this file).
+    stale = (not os.path.exists(path) or not os.path.exists(meta_path)
+             or os.path.getmtime(path) < os.path.getmtime(summary_file))
+    if stale:
+        log.info("Rebuilding %s from %s", path, summary_file)
+        publish_scores(load_json(summary_file, {}), path, meta_path)
+    return load_scores(path, meta_path)
+
+
+# ========== MAIN ==========
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Publish result.json scores as a float32 matrix")
+    parser.add_argument("--summaries", default=SUMMARY_FILE)
+    parser.add_argument("--out", default=SCORES_FILE)
+    parser.add_argument("--meta", default=SCORES_META_FILE)
+    args = parser.parse_args()
+    setup_logging()
+
+    with open(args.summaries, "r", encoding="utf-8") as f:
+        summaries = json.load(f)
+    ids, matrix = publish_scores(summaries, args.out, args.meta)
+    print(f"Wrote {matrix.shape[0]}x{matrix.shape[1]} {matrix.dtype} "
+          f"matrix to {args.out} ({os.path.getsize(args.out)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
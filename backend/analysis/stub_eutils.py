@@ -0,0 +1,154 @@
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from article_store import STORE_FILE, ArticleStore
+from ncbi import ARTICLE_END, ARTICLE_START
+
+# ========== LOCAL E-UTILITIES STUB ==========
+# Serves efetch.fcgi for db=pmc out of an article store so the fetch path
+# can be exercised and measured without touching NCBI:
+#
+#   python stub_eutils.py --port 8765 --latency 0.2 --max-rps 3
+#   EUTILS_BASE_URL=http://127.0.0.1:8765/entrez/eutils python main.py
+#
+# Ids not in the store are left out of the response, like efetch does.
+
+PROLOG = (
+    '<?xml version="1.0"  ?><!DOCTYPE pmc-articleset PUBLIC '
+    '"-//NLM//DTD ARTICLE SET 2.0//EN" '
+    '"https://dtd.nlm.nih.gov/ncbi/pmc/articleset/nlm-articleset-2.0.dtd">'
+    "<pmc-articleset>"
+)
+
+
+def article_body(xml):
+    start = ARTICLE_START.search(xml)
+    end = xml.rfind(ARTICLE_END)
+    if start is None or end == -1:
+        return ""
+    return xml[start.start():end + len(ARTICLE_END)]
+
+
+class StubEutils:
+    def __init__(self, store, latency=0.0, drop_rate=0.0, throttle_rate=0.0,
+                 max_rps=None, seed=0):
+        self.store = store
+        self.latency = latency
+        # chance that an id is left out of a multi-id response
+        self.drop_rate = drop_rate
+        # chance that a request is answered with 429 regardless of load
+        self.throttle_rate = throttle_rate
+        # requests beyond this many per rolling second get a 429
+        self.max_rps = max_rps
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = []
+        self.requests = 0
+        self.throttled = 0
+        self.ids_served = 0
+        self.server = None
+
+    def _throttle(self):
+        now = time.monotonic()
+        self.recent = [t for t in self.recent if now - t < 1.0]
+        self.recent.append(now)
+        if self.max_rps is not None and len(self.recent) > self.max_rps:
+            return True
+        return self.random.random() < self.throttle_rate
+
+    def respond(self, ids):
+        with self.lock:
+            self.requests += 1
+            if self._throttle():
+                self.throttled += 1
+                return 429, '{"error":"API rate limit exceeded"}'
+            dropped = {pid for pid in ids
+                       if len(ids) > 1 and self.random.random() < self.drop_rate}
+        if self.latency:
+            time.sleep(self.latency)
+        if len(ids) == 1:
+            # single-id efetch returns the article exactly as stored
+            xml = self.store.get(ids[0])
+            if xml is not None:
+                with self.lock:
+                    self.ids_served += 1
+                return 200, xml
+        parts = [PROLOG]
+        for pmc_id in ids:
+            if pmc_id in dropped:
+                continue
+            xml = self.store.get(pmc_id)
+            if xml is not None:
+                parts.append(article_body(xml))
+                with self.lock:
+                    self.ids_served += 1
+        parts.append("</pmc-articleset>")
+        return 200, "".join(parts)
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _serve(self, query):
+                if not self.path.split("?")[0].endswith("/efetch.fcgi"):
+                    self.send_error(404)
+                    return
+                ids = [pid.strip().removeprefix("PMC")
+                       for pid in query.get("id", [""])[0].split(",")
+                       if pid.strip()]
+                status, body = stub.respond(ids)
+                payload = body.encode("utf-8")
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.send_header("Content-Type", "text/xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._serve(parse_qs(urlparse(self.path).query))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self._serve(parse_qs(self.rfile.read(length).decode("utf-8")))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}/entrez/eutils"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local efetch stub")
+    parser.add_argument("--store", default=STORE_FILE)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-rps", type=int)
+    args = parser.parse_args()
+
+    stub = StubEutils(ArticleStore(args.store), args.latency, args.drop_rate,
+                      args.throttle_rate, args.max_rps)
+    print(f"Serving {len(stub.store)} articles at {stub.start(args.port)}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,176 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from classify import LABEL_PROMPT, TOPICS
+
+# ========== LOCAL GEMINI STUB ==========
+# Answers generateContent like the Gemini API does, so the classification
+# path (and its quota/overload handling) can be exercised without a key:
+#
+#   python stub_gemini.py --port 8766 --latency 1.0 --quota-rate 0.02
+#   GEMINI_BASE_URL=http://127.0.0.1:8766 python main.py
+#
+# Answers are derived from a hash of the input, so they are stable across
+# runs: batched prompts get a JSON object of 15 scores per "=== ARTICLE id
+# ===" block, the label prompt gets topic names, anything else a single
+# comma-separated score row. Errors carry the same JSON bodies as the real
+# API: 429 RESOURCE_EXHAUSTED with a RetryInfo retryDelay, and 503
+# UNAVAILABLE.
+
+ARTICLE_HEADER = re.compile(r"=== ARTICLE (\d+) ===")
+
+
+def stable_scores(key):
+    digest = hashlib.blake2b(key.encode("utf-8"),
+                             digest_size=2 * len(TOPICS)).digest()
+    return [round(int.from_bytes(digest[i:i + 2], "big") / 65535, 3)
+            for i in range(0, len(digest), 2)]
+
+
+class StubGemini:
+    def __init__(self, latency=0.0, quota_rate=0.0, overload_rate=0.0,
+                 malformed_rate=0.0, retry_delay=1, max_rps=None, seed=0):
+        self.latency = latency
+        # chance that a request gets 429 RESOURCE_EXHAUSTED regardless of load
+        self.quota_rate = quota_rate
+        # chance that a request gets 503 UNAVAILABLE
+        self.overload_rate = overload_rate
+        # chance that a row of a batched answer is left out or cut short
+        self.malformed_rate = malformed_rate
+        # whole seconds, as the SDK error parser in gemini.py expects
+        self.retry_delay = retry_delay
+        # requests beyond this many per rolling second get a 429
+        self.max_rps = max_rps
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = []
+        self.requests = 0
+        self.quota_errors = 0
+        self.overloaded = 0
+        self.server = None
+
+    def _error(self):
+        now = time.monotonic()
+        self.recent = [t for t in self.recent if now - t < 1.0]
+        self.recent.append(now)
+        if ((self.max_rps is not None and len(self.recent) > self.max_rps)
+                or self.random.random() < self.quota_rate):
+            self.quota_errors += 1
+            return 429, {"error": {
+                "code": 429,
+                "message": "Resource has been exhausted (e.g. check quota).",
+                "status": "RESOURCE_EXHAUSTED",
+                "details": [{
+                    "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                    "retryDelay": f"{self.retry_delay}s",
+                }],
+            }}
+        if self.random.random() < self.overload_rate:
+            self.overloaded += 1
+            return 503, {"error": {
+                "code": 503,
+                "message": "The model is overloaded. Please try again later.",
+                "status": "UNAVAILABLE",
+            }}
+        return None
+
+    def answer(self, text):
+        ids = ARTICLE_HEADER.findall(text)
+        if ids:
+            rows = {}
+            with self.lock:
+                rolls = [self.random.random() for _ in ids]
+            for pmc_id, roll in zip(ids, rolls):
+                if roll < self.malformed_rate / 2:
+                    continue
+                row = stable_scores(pmc_id)
+                rows[pmc_id] = row[:-1] if roll < self.malformed_rate else row
+            return json.dumps(rows)
+        if text.startswith(LABEL_PROMPT):
+            scores = stable_scores(text)
+            best = sorted(range(len(TOPICS)), key=lambda t: -scores[t])[:2]
+            return ", ".join(TOPICS[t] for t in best)
+        return ",".join(f"{v:g}" for v in stable_scores(text))
+
+    def respond(self, request):
+        with self.lock:
+            self.requests += 1
+            error = self._error()
+        if self.latency:
+            time.sleep(self.latency)
+        if error is not None:
+            return error
+        text = "".join(part.get("text", "")
+                       for content in request.get("contents", [])
+                       for part in content.get("parts", []))
+        return 200, {
+            "candidates": [{
+                "content": {"parts": [{"text": self.answer(text)}],
+                            "role": "model"},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {"promptTokenCount": len(text) // 4},
+        }
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.split("?")[0].endswith(":generateContent"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                status, body = stub.respond(request)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type",
+                                 "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Gemini stub")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--quota-rate", type=float, default=0.0)
+    parser.add_argument("--overload-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--retry-delay", type=int, default=1)
+    parser.add_argument("--max-rps", type=int)
+    args = parser.parse_args()
+
+    stub = StubGemini(args.latency, args.quota_rate, args.overload_rate,
+                      args.malformed_rate, args.retry_delay, args.max_rps)
+    print(f"Serving Gemini at {stub.start(args.port)}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
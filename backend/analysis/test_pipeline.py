@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+from article_store import ArticleStore
+from extract import extract_text
+from stub_eutils import StubEutils
+from text_cache import TextCache
+
+# python -m pytest test_pipeline.py
+#
+# Runs the pipeline commands in a scratch folder, fetching from the local
+# efetch stub over the articles in this folder's articles.pack.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLE = 5
+
+
+def run_command(command, folder, stub, pmc_ids):
+    with open(os.path.join(folder, "in.csv"), "w") as f:
+        f.write("url\n")
+        f.writelines(f"PMC{pmc_id}\n" for pmc_id in pmc_ids)
+    env = dict(os.environ, EUTILS_BASE_URL=stub.start(), METRICS_FILE="",
+               PYTHONPATH=HERE)
+    subprocess.run([sys.executable, "-m", "pipeline", command, "--input",
+                    "in.csv"], cwd=folder, env=env, check=True)
+
+
+def test_extract_fills_text_cache(tmp_path):
+    source = ArticleStore(os.path.join(HERE, "articles.pack"))
+    pmc_ids = source.ids()[:SAMPLE]
+    stub = StubEutils(source)
+    try:
+        run_command("extract", tmp_path, stub, pmc_ids)
+    finally:
+        stub.stop()
+    assert stub.requests > 0
+
+    store = ArticleStore(os.path.join(tmp_path, "articles.pack"))
+    cache = TextCache(os.path.join(tmp_path, "text_cache.sqlite"))
+    try:
+        for pmc_id in pmc_ids:
+            xml_hash = store.get_hash(pmc_id)
+            assert xml_hash is not None, f"PMC{pmc_id} was not fetched"
+            for mode in ("abstract", "paragraphs"):
+                assert cache.get(pmc_id, mode, xml_hash) \
+                    == extract_text(store.get(pmc_id), mode)
+    finally:
+        cache.close()
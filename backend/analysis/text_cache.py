@@ -0,0 +1,72 @@
+import hashlib
+import sqlite3
+import zlib
+from metrics import count_cache
+
+# ========== CONFIG ==========
+TEXT_CACHE_FILE = "text_cache.sqlite"
+
+# ========== EXTRACTED TEXT CACHE ==========
+# Second cache tier after the raw XML: extracted text per (pmc_id, mode),
+# zlib-compressed in a single SQLite file. Each row remembers the hash of the
+# XML it was extracted from, so a changed source simply misses and is
+# re-extracted.
+
+
+def content_hash(xml_content):
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode("utf-8")
+    return hashlib.blake2b(xml_content, digest_size=16).hexdigest()
+
+
+class TextCache:
+    def __init__(self, path=TEXT_CACHE_FILE):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS texts ("
+            " pmc_id TEXT NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " xml_hash TEXT NOT NULL,"
+            " text BLOB NOT NULL,"
+            " PRIMARY KEY (pmc_id, mode))"
+        )
+        self.conn.commit()
+
+    def get(self, pmc_id, mode, xml_hash):
+        row = self.conn.execute(
+            "SELECT xml_hash, text FROM texts WHERE pmc_id = ? AND mode = ?",
+            (pmc_id, mode),
+        ).fetchone()
+        if row is None or row[0] != xml_hash:
+            self.misses += 1
+            count_cache("text", False)
+            return None
+        self.hits += 1
+        count_cache("text", True)
+        return zlib.decompress(row[1]).decode("utf-8")
+
+    def put(self, pmc_id, mode, xml_hash, text):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO texts (pmc_id, mode, xml_hash, text)"
+            " VALUES (?, ?, ?, ?)",
+            (pmc_id, mode, xml_hash, zlib.compress(text.encode("utf-8"))),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+_text_cache = None
+
+
+def get_text_cache():
+    global _text_cache
+    if _text_cache is None:
+        _text_cache = TextCache()
+    return _text_cache
@@ -0,0 +1,222 @@
+import argparse
+import heapq
+import json
+import logging
+import os
+import numpy as np
+from journal import load_json, write_json_atomic
+from metrics import setup_logging
+
+# ========== CONFIG ==========
+# tiles.json describes the octree, tiles.bin holds every tile's records and
+# titles.json maps a point's row to its PMC id and title
+TILES_MANIFEST = "tiles.json"
+TILES_FILE = "tiles.bin"
+TITLES_FILE = "titles.json"
+VERSION = 1
+ROOT = "r"
+# most points a leaf tile holds before it is split into octants
+LEAF_POINTS = int(os.getenv("TILE_LEAF_POINTS", "4096"))
+# coarse tiles summarise their points as centroids of a LOD_GRID^3 voxel grid
+LOD_GRID = 8
+# stops the split of points sharing one position (near-duplicates do)
+MAX_DEPTH = 12
+# records a view may load at once (see select_tiles)
+VIEW_BUDGET = 50000
+# x, y, z and n: the point's row in titles.json in leaf ("points") tiles,
+# how many points the centroid stands for in coarse ("centroids") ones
+RECORD = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("n", "<u4")])
+
+log = logging.getLogger(__name__)
+
+# ========== OCTREE ==========
+# The map's bounding cube is split recursively into octants until a node
+# holds at most LEAF_POINTS points. Leaves keep every point; inner nodes
+# keep only voxel-grid centroids, so a client draws the root (at most
+# LOD_GRID^3 records) first and refines just the octants in view. A tile's
+# key is its parent's key plus the octant digit (bit 0 x, 1 y, 2 z set for
+# the upper half): "r", "r5", "r52", ...
+
+
+def voxel_centroids(points, lo, size, grid=LOD_GRID):
+    # One record per non-empty voxel, heaviest first
+    cell = np.clip(((points - lo) / size * grid).astype(np.int64), 0, grid - 1)
+    code = (cell[:, 0] * grid + cell[:, 1]) * grid + cell[:, 2]
+    _, inverse, counts = np.unique(code, return_inverse=True,
+                                   return_counts=True)
+    records = np.empty(len(counts), dtype=RECORD)
+    for axis, name in enumerate("xyz"):
+        records[name] = np.bincount(inverse, weights=points[:, axis]) / counts
+    records["n"] = counts
+    return records[np.argsort(-counts, kind="stable")]
+
+
+def build_octree(coords, leaf_points=LEAF_POINTS, grid=LOD_GRID,
+                 max_depth=MAX_DEPTH):
+    # ([tile dict], [record array]) in the same order, parents before
+    # children. coords: float32 (n, 3).
+    coords = np.asarray(coords, dtype=np.float32)
+    lo = coords.min(axis=0).astype(np.float64)
+    # pad the cube a little so points on its upper faces fall inside
+    size = float((coords.max(axis=0) - lo).max() or 1.0) * (1 + 1e-6)
+    tiles, buffers = [], []
+
+    def visit(key, rows, lo, size, level):
+        points = coords[rows]
+        leaf = len(rows) <= leaf_points or level == max_depth
+        if leaf:
+            records = np.empty(len(rows), dtype=RECORD)
+            for axis, name in enumerate("xyz"):
+                records[name] = points[:, axis]
+            records["n"] = rows
+        else:
+            records = voxel_centroids(points, lo, size, grid)
+        tiles.append({"key": key, "level": level, "min": lo.tolist(),
+                      "size": size, "count": len(rows),
+                      "kind": "points" if leaf else "centroids",
+                      "records": len(records)})
+        buffers.append(records)
+        if leaf:
+            return
+        half = size / 2
+        upper = points >= lo + half
+        octant = upper[:, 0] | upper[:, 1] << 1 | upper[:, 2] << 2
+        order = np.argsort(octant, kind="stable")
+        bounds = np.searchsorted(octant[order], np.arange(9))
+        for o in range(8):
+            child = rows[order[bounds[o]:bounds[o + 1]]]
+            if len(child):
+                offset = np.array([o & 1, o >> 1 & 1, o >> 2 & 1]) * half
+                visit(key + str(o), child, lo + offset, half, level + 1)
+
+    if len(coords):
+        visit(ROOT, np.arange(len(coords), dtype=np.uint32), lo, size, 0)
+    return tiles, buffers
+
+
+def write_tiles(ids, coords, titles, manifest_path=TILES_MANIFEST,
+                data_path=TILES_FILE, titles_path=TITLES_FILE,
+                leaf_points=LEAF_POINTS):
+    # Rows are positions in ids/coords/titles (output_3d.json's order).
+    # The data file is replaced before the manifest that points into it.
+    tiles, buffers = build_octree(coords, leaf_points)
+    offset = 0
+    tmp = f"{data_path}.tmp"
+    with open(tmp, "wb") as f:
+        for tile, records in zip(tiles, buffers):
+            tile["offset"] = offset
+            f.write(records.tobytes())
+            offset += records.nbytes
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, data_path)
+    write_json_atomic(titles_path, {"ids": [str(i) for i in ids],
+                                    "titles": [str(t) for t in titles]},
+                      indent=None)
+    write_json_atomic(manifest_path, {
+        "version": VERSION,
+        "data": os.path.basename(data_path),
+        "titles": os.path.basename(titles_path),
+        "record": [[name, RECORD[name].str] for name in RECORD.names],
+        "record_size": RECORD.itemsize,
+        "points": len(ids),
+        "leaf_points": leaf_points,
+        "lod_grid": LOD_GRID,
+        "tiles": tiles,
+    }, indent=None)
+    log.info("%d tiles (%d levels, %d records) for %d points in %s",
+             len(tiles), 1 + max((t["level"] for t in tiles), default=-1),
+             offset // RECORD.itemsize, len(ids), data_path)
+    return tiles
+
+# ========== VIEW ==========
+
+
+def in_view(tile, lo, hi):
+    tile_lo = np.asarray(tile["min"])
+    return bool(np.all(tile_lo <= hi) and np.all(tile_lo + tile["size"] >= lo))
+
+
+def select_tiles(tiles, lo, hi, budget=VIEW_BUDGET):
+    # Keys of the tiles to draw for the box lo..hi: starting from the root,
+    # coarse tiles are swapped for their children in view, shallowest and
+    # most populated first, for as long as the records stay within budget.
+    # UmapController's /umap/tiles/view does the same on the server.
+    by_key = {tile["key"]: tile for tile in tiles}
+    root = by_key.get(ROOT)
+    if root is None or not in_view(root, lo, hi):
+        return []
+    selected = {ROOT}
+    total = root["records"]
+    queue = [(0, -root["count"], ROOT)]
+    while queue:
+        _, _, key = heapq.heappop(queue)
+        if by_key[key]["kind"] == "points":
+            continue
+        children = [by_key[key + str(o)] for o in range(8)
+                    if key + str(o) in by_key
+                    and in_view(by_key[key + str(o)], lo, hi)]
+        cost = sum(c["records"] for c in children) - by_key[key]["records"]
+        if total + cost > budget:
+            continue
+        total += cost
+        selected.discard(key)
+        for child in children:
+            selected.add(child["key"])
+            heapq.heappush(queue, (child["level"], -child["count"],
+                                   child["key"]))
+    return sorted(selected)
+
+
+def read_tile(tile, data_path=TILES_FILE):
+    with open(data_path, "rb") as f:
+        f.seek(tile["offset"])
+        return np.frombuffer(f.read(tile["records"] * RECORD.itemsize),
+                             dtype=RECORD)
+
+# ========== MAIN ==========
+
+
+def main():
+    from mapa import OUTPUT_FILE
+
+    parser = argparse.ArgumentParser(
+        description="Build the map's octree tiles from output_3d.json")
+    parser.add_argument("--input", default=OUTPUT_FILE)
+    parser.add_argument("--leaf-points", type=int, default=LEAF_POINTS)
+    parser.add_argument("--view", type=float, nargs=6,
+                        metavar=("X0", "Y0", "Z0", "X1", "Y1", "Z1"),
+                        help="only list the tiles a view of this box loads")
+    parser.add_argument("--budget", type=int, default=VIEW_BUDGET)
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.view:
+        manifest = load_json(TILES_MANIFEST, None)
+        if manifest is None:
+            parser.error(f"no {TILES_MANIFEST}; build it first")
+        keys = select_tiles(manifest["tiles"], np.array(args.view[:3]),
+                            np.array(args.view[3:]), args.budget)
+        by_key = {tile["key"]: tile for tile in manifest["tiles"]}
+        records = sum(by_key[key]["records"] for key in keys)
+        print(f"{len(keys)} tiles, {records} records "
+              f"({records * RECORD.itemsize / 1e3:.0f} kB)")
+        for key in keys:
+            tile = by_key[key]
+            print(f"  {key:<14}{tile['kind']:<10}{tile['records']:>7} "
+                  f"records for {tile['count']} points")
+        return
+
+    with open(args.input, encoding="utf-8") as f:
+        points = json.load(f)
+    coords = np.array([[p["x"], p["y"], p["z"]] for p in points],
+                      dtype=np.float32)
+    write_tiles([p["id"] for p in points], coords,
+                [p["title"] for p in points], leaf_points=args.leaf_points)
+    print(f"{args.input}: {os.path.getsize(args.input) / 1e3:.0f} kB; "
+          f"{TILES_FILE}: {os.path.getsize(TILES_FILE) / 1e3:.0f} kB, "
+          f"{TITLES_FILE}: {os.path.getsize(TITLES_FILE) / 1e3:.0f} kB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from classify import TOPICS
+from metrics import setup_logging
+from scores import ensure_scores
+
+# ========== CONFIG ==========
+TOPIC_INDEX_FILE = "topic_index.npz"
+
+# ========== TOPIC INDEX ==========
+# Inverted index from each topic to every article, ranked by that topic's
+# Gemini score: one argsort per column of the score matrix. order[:, t] holds
+# row numbers best first and ranked[:, t] the matching scores, so top-k is a
+# slice and a threshold is a binary search.
+
+
+class TopicIndex:
+    def __init__(self, ids, X, order=None):
+        self.ids = list(ids)
+        self.X = X
+        self.row = {pmc_id: i for i, pmc_id in enumerate(self.ids)}
+        if order is None:
+            order = np.argsort(-np.asarray(X), axis=0, kind="stable")
+        self.order = order.astype(np.int32)
+        self.ranked = np.take_along_axis(np.asarray(X), self.order, axis=0)
+        # one contiguous row per topic for queries: posting lists and
+        # negated scores, which ascend so searchsorted applies directly
+        self.postings = np.ascontiguousarray(self.order.T)
+        self.keys = np.ascontiguousarray(-self.ranked.T)
+
+    @staticmethod
+    def topic_column(topic):
+        try:
+            return TOPICS.index(topic)
+        except ValueError:
+            raise KeyError(f"unknown topic {topic!r}") from None
+
+    def top(self, topic, k=10):
+        # [(pmc_id, score)] for the k best articles in the topic
+        t = self.topic_column(topic)
+        return [(self.ids[i], float(s))
+                for i, s in zip(self.postings[t, :k], self.ranked[:k, t])]
+
+    def above(self, topic, threshold):
+        # pmc ids scoring >= threshold in the topic, best first
+        t = self.topic_column(topic)
+        n = np.searchsorted(self.keys[t], -threshold, side="right")
+        return [self.ids[i] for i in self.postings[t, :n]]
+
+    def all_of(self, topics, threshold=0.5, k=None):
+        # Articles scoring >= threshold in every topic, ranked by their
+        # weakest of those scores. Scans only the shortest posting list.
+        cols = [self.topic_column(t) for t in topics]
+        counts = [np.searchsorted(self.keys[c], -threshold, side="right")
+                  for c in cols]
+        shortest = int(np.argmin(counts))
+        rows = self.postings[cols[shortest], :counts[shortest]]
+        scores = np.asarray(self.X[rows][:, cols])
+        keep = (scores >= threshold).all(axis=1)
+        rows = rows[keep]
+        weakest = scores[keep].min(axis=1)
+        ranking = np.argsort(-weakest, kind="stable")[:k]
+        return [(self.ids[rows[i]], float(weakest[i])) for i in ranking]
+
+    def scores(self, topic, pmc_ids):
+        # the topic's score for each id; NaN for ids not in the index
+        t = self.topic_column(topic)
+        rows = np.array([self.row.get(pmc_id, -1) for pmc_id in pmc_ids],
+                        dtype=np.int64)
+        values = np.full(len(rows), np.nan, dtype=np.float32)
+        found = rows >= 0
+        values[found] = self.X[rows[found], t]
+        return values
+
+    def rank(self, topic, pmc_ids):
+        # pmc_ids re-ordered best first by the topic's score; ids without
+        # scores go last in their given order
+        values = self.scores(topic, pmc_ids)
+        values = np.where(np.isnan(values), -np.inf, values)
+        return [pmc_ids[i] for i in np.argsort(-values, kind="stable")]
+
+    def update(self, ids, X):
+        # Returns a TopicIndex for the new ids/X. When the old ids are an
+        # unchanged prefix (result.json only appends) the new rows are
+        # sorted on their own and merged into each posting list, and only
+        # the topics in which an existing article was rescored are sorted
+        # again; otherwise the index is rebuilt in one pass.
+        n = len(self.ids)
+        if len(ids) < n or list(ids[:n]) != self.ids:
+            return TopicIndex(ids, X)
+        scores = np.asarray(X)
+        rescored = np.any(scores[:n] != np.asarray(self.X), axis=0)
+        if len(ids) == n and not rescored.any():
+            return TopicIndex(ids, X, self.order)
+
+        new = scores[n:]
+        new_order = np.argsort(-new, axis=0, kind="stable")
+        new_ranked = np.take_along_axis(new, new_order, axis=0)
+        order = np.empty((len(ids), len(TOPICS)), dtype=np.int32)
+        for t in range(len(TOPICS)):
+            if rescored[t]:
+                order[:, t] = np.argsort(-scores[:, t], kind="stable")
+                continue
+            # ties keep existing articles ahead of new ones
+            at = np.searchsorted(self.keys[t], -new_ranked[:, t], side="right")
+            order[:, t] = np.insert(self.postings[t], at, new_order[:, t] + n)
+        return TopicIndex(ids, X, order)
+
+    def save(self, path=TOPIC_INDEX_FILE):
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, ids=np.asarray(self.ids), order=self.order,
+                     scores=np.asarray(self.X), topics=np.asarray(TOPICS))
+        os.replace(tmp, path)
+
+
+def load_topic_index(path=TOPIC_INDEX_FILE):
+    # The saved index brought up to date with scores.npy. It keeps the
+    # scores it was ranked by, so appended articles are merged in, topics
+    # with a rescored article are sorted again and anything else triggers a
+    # rebuild.
+    ids, X = ensure_scores()
+    index = None
+    if os.path.exists(path):
+        with np.load(path) as f:
+            if f["topics"].tolist() == TOPICS and "scores" in f.files:
+                index = TopicIndex(f["ids"].tolist(), f["scores"], f["order"])
+    if index is None:
+        index = TopicIndex(ids, X)
+    elif index.ids != list(ids) or not np.array_equal(index.X, X):
+        index = index.update(ids, X)
+    else:
+        return index
+    index.save(path)
+    return index
+
+# ========== MAIN ==========
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Query the topic -> articles index")
+    parser.add_argument("topics", nargs="*", help="one topic, or several to "
+                        "intersect; none prints every topic's size")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--threshold", type=float,
+                        help="articles scoring at least this much")
+    args = parser.parse_args()
+    setup_logging()
+
+    index = load_topic_index()
+    start = time.perf_counter()
+    if not args.topics:
+        threshold = 0.5 if args.threshold is None else args.threshold
+        result = {t: len(index.above(t, threshold)) for t in TOPICS}
+    elif len(args.topics) > 1:
+        threshold = 0.5 if args.threshold is None else args.threshold
+        result = index.all_of(args.topics, threshold, args.k)
+    elif args.threshold is not None:
+        result = index.above(args.topics[0], args.threshold)
+    else:
+        result = index.top(args.topics[0], args.k)
+    elapsed = time.perf_counter() - start
+    print(json.dumps(result, indent=2))
+    print(f"{len(index.ids)} articles, query took {elapsed * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+package dev.danimania.symbiosis;
+
+public class ChunkHit {
+    public final String pmcId;
+    public final int ordinal;
+    public final String section;
+    public final String text;
+    public final float score;
+
+    public ChunkHit(String pmcId, int ordinal, String section, String text, float score) {
+        this.pmcId = pmcId;
+        this.ordinal = ordinal;
+        this.section = section;
+        this.text = text;
+        this.score = score;
+    }
+}
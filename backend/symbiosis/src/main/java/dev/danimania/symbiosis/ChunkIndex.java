@@ -0,0 +1,251 @@
+package dev.danimania.symbiosis;
+
+import org.springframework.beans.factory.annotation.Autowired;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.stereotype.Service;
+
+import java.io.IOException;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.channels.FileChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.StandardOpenOption;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.HashSet;
+import java.util.List;
+import java.util.Locale;
+import java.util.PriorityQueue;
+import java.util.Set;
+import java.util.regex.Matcher;
+import java.util.regex.Pattern;
+
+// BM25 index over article chunks, built offline by backend/analysis/chunks.py
+// (see the ARTIFACT section there for the layout). The file is memory-mapped
+// at startup, so loading the whole corpus is a few mmaps instead of a
+// /rag/add call per chunk, and a query never leaves the process.
+@Service
+public class ChunkIndex {
+
+    private static final byte[] MAGIC = "RAG1".getBytes(StandardCharsets.US_ASCII);
+    private static final int VERSION = 1;
+    // same tokens as chunks.py: runs of letters and digits, lower-cased
+    private static final Pattern TOKEN = Pattern.compile("[\\p{L}\\p{N}]+");
+
+    // section order in the file (SECTIONS in chunks.py)
+    private static final int CHUNK_PMC = 0;
+    private static final int CHUNK_ORDINAL = 1;
+    private static final int CHUNK_SECTION = 2;
+    private static final int TEXT_OFFSETS = 3;
+    private static final int TEXT = 4;
+    private static final int SECTION_OFFSETS = 5;
+    private static final int SECTIONS = 6;
+    private static final int TERM_OFFSETS = 7;
+    private static final int TERMS = 8;
+    private static final int POSTING_OFFSETS = 9;
+    private static final int POSTING_DOCS = 10;
+    private static final int POSTING_WEIGHTS = 11;
+    private static final int SECTION_COUNT = 12;
+    // magic, version, four counts, k1, b, then (offset, length) per section
+    private static final int HEADER_SIZE = 4 + 4 + 4 * 8 + 2 * 8 + SECTION_COUNT * 16;
+    // largest mapping per section window; one MappedByteBuffer stops at 2 GB
+    static final long WINDOW = 1L << 30;
+    // chunks are scored in a float[] and terms numbered with ints
+    private static final long MAX_COUNT = Integer.MAX_VALUE - 8;
+
+    private Section[] sections;
+    private int chunkCount;
+    private int termCount;
+
+    @Autowired
+    public ChunkIndex(DataFiles dataFiles, @Value("${rag.chunks.path:chunks.bin}") String path) {
+        this(dataFiles.resolve(path), WINDOW);
+    }
+
+    ChunkIndex(Path file, long window) {
+        if (!Files.exists(file)) {
+            System.out.println("No chunk index at " + file + ", /rag/search will find nothing.");
+            return;
+        }
+        // a mapping stays valid after its channel is closed
+        try (FileChannel channel = FileChannel.open(file, StandardOpenOption.READ)) {
+            ByteBuffer header = channel.map(FileChannel.MapMode.READ_ONLY, 0, HEADER_SIZE)
+                    .order(ByteOrder.LITTLE_ENDIAN);
+            byte[] magic = new byte[MAGIC.length];
+            header.get(magic);
+            if (!Arrays.equals(magic, MAGIC) || header.getInt() != VERSION) {
+                throw new IOException(file + " is not a version " + VERSION + " chunk index");
+            }
+            long chunks = header.getLong();
+            header.getLong(); // distinct section headings
+            long terms = header.getLong();
+            header.getLong(); // postings
+            header.getDouble(); // k1 and b are already folded into the weights
+            header.getDouble();
+            if (chunks > MAX_COUNT || terms > MAX_COUNT) {
+                throw new IOException(file + " holds " + chunks + " chunks and " + terms
+                        + " terms; this reader handles at most " + MAX_COUNT + " of each");
+            }
+
+            Section[] mapped = new Section[SECTION_COUNT];
+            for (int i = 0; i < SECTION_COUNT; i++) {
+                long offset = header.getLong();
+                long length = header.getLong();
+                mapped[i] = new Section(channel, offset, length, window);
+            }
+            sections = mapped;
+            chunkCount = (int) chunks;
+            termCount = (int) terms;
+            System.out.println("Mapped " + chunkCount + " chunks from " + file);
+        } catch (IOException e) {
+            e.printStackTrace();
+        }
+    }
+
+    public int size() {
+        return chunkCount;
+    }
+
+    public List<ChunkHit> search(String query, int k) {
+        List<ChunkHit> hits = new ArrayList<>();
+        if (sections == null || query == null || k <= 0) {
+            return hits;
+        }
+
+        float[] scores = new float[chunkCount];
+        Section postingOffsets = sections[POSTING_OFFSETS];
+        Section docs = sections[POSTING_DOCS];
+        Section weights = sections[POSTING_WEIGHTS];
+        for (String term : tokenize(query)) {
+            int t = termId(term);
+            if (t < 0) {
+                continue;
+            }
+            long start = postingOffsets.getLong(t);
+            long end = postingOffsets.getLong(t + 1L);
+            for (long p = start; p < end; p++) {
+                scores[docs.getInt(p)] += weights.getFloat(p);
+            }
+        }
+
+        // the k best chunks: a min-heap on score, ties broken by position
+        PriorityQueue<Integer> best = new PriorityQueue<>(
+                (a, b) -> scores[a] != scores[b] ? Float.compare(scores[a], scores[b]) : Integer.compare(b, a));
+        for (int i = 0; i < chunkCount; i++) {
+            if (scores[i] <= 0) {
+                continue;
+            }
+            best.add(i);
+            if (best.size() > k) {
+                best.poll();
+            }
+        }
+        while (!best.isEmpty()) {
+            int i = best.poll();
+            hits.add(0, chunk(i, scores[i]));
+        }
+        return hits;
+    }
+
+    private ChunkHit chunk(int i, float score) {
+        long pmcId = Integer.toUnsignedLong(sections[CHUNK_PMC].getInt(i));
+        int ordinal = sections[CHUNK_ORDINAL].getInt(i);
+        int section = sections[CHUNK_SECTION].getInt(i);
+        return new ChunkHit(
+                String.valueOf(pmcId),
+                ordinal,
+                string(sections[SECTION_OFFSETS], sections[SECTIONS], section),
+                string(sections[TEXT_OFFSETS], sections[TEXT], i),
+                score);
+    }
+
+    private static Set<String> tokenize(String text) {
+        Set<String> tokens = new HashSet<>();
+        Matcher m = TOKEN.matcher(text.toLowerCase(Locale.ROOT));
+        while (m.find()) {
+            tokens.add(m.group());
+        }
+        return tokens;
+    }
+
+    // binary search over the bytewise-sorted term table; -1 if absent
+    private int termId(String term) {
+        byte[] key = term.getBytes(StandardCharsets.UTF_8);
+        int lo = 0;
+        int hi = termCount;
+        while (lo < hi) {
+            int mid = (lo + hi) >>> 1;
+            if (Arrays.compareUnsigned(bytes(sections[TERM_OFFSETS], sections[TERMS], mid), key) < 0) {
+                lo = mid + 1;
+            } else {
+                hi = mid;
+            }
+        }
+        if (lo < termCount && Arrays.equals(bytes(sections[TERM_OFFSETS], sections[TERMS], lo), key)) {
+            return lo;
+        }
+        return -1;
+    }
+
+    private static byte[] bytes(Section offsets, Section data, int i) {
+        return data.bytes(offsets.getLong(i), offsets.getLong(i + 1L));
+    }
+
+    private static String string(Section offsets, Section data, int i) {
+        return new String(bytes(offsets, data, i), StandardCharsets.UTF_8);
+    }
+
+    // One section of the file, mapped in windows of at most `window` bytes
+    // and indexed by element. Sections start 8-byte aligned and the window
+    // is a multiple of 8, so a number never straddles two windows; only a
+    // string can, and bytes() copies it across.
+    private static final class Section {
+        private final ByteBuffer[] windows;
+        private final long window;
+
+        Section(FileChannel channel, long offset, long length, long window) throws IOException {
+            if (window <= 0 || window % 8 != 0 || window > Integer.MAX_VALUE) {
+                throw new IllegalArgumentException("window must be a positive multiple of 8 under 2 GB");
+            }
+            this.window = window;
+            windows = new ByteBuffer[Math.toIntExact((length + window - 1) / window)];
+            for (int w = 0; w < windows.length; w++) {
+                long start = w * window;
+                windows[w] = channel.map(FileChannel.MapMode.READ_ONLY, offset + start,
+                        Math.min(window, length - start)).order(ByteOrder.LITTLE_ENDIAN);
+            }
+        }
+
+        int getInt(long i) {
+            long pos = i * 4;
+            return windows[(int) (pos / window)].getInt((int) (pos % window));
+        }
+
+        long getLong(long i) {
+            long pos = i * 8;
+            return windows[(int) (pos / window)].getLong((int) (pos % window));
+        }
+
+        float getFloat(long i) {
+            long pos = i * 4;
+            return windows[(int) (pos / window)].getFloat((int) (pos % window));
+        }
+
+        // the bytes in [start, end)
+        byte[] bytes(long start, long end) {
+            byte[] out = new byte[Math.toIntExact(end - start)];
+            int done = 0;
+            while (done < out.length) {
+                long pos = start + done;
+                ByteBuffer buffer = windows[(int) (pos / window)];
+                int at = (int) (pos % window);
+                int n = Math.min(out.length - done, buffer.limit() - at);
+                buffer.get(at, out, done, n);
+                done += n;
+            }
+            return out;
+        }
+    }
+}
@@ -0,0 +1,24 @@
+package dev.danimania.symbiosis;
+
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.stereotype.Component;
+
+import java.nio.file.Path;
+
+// Where the files built by backend/analysis (chunks.bin, tiles.json,
+// neighbors.json, output_3d.json) are read from: analysis.data.dir, by
+// default the analysis folder as seen from backend/symbiosis, where the app
+// is started. A file's own path property may be absolute or relative to it.
+@Component
+public class DataFiles {
+
+    private final Path dir;
+
+    public DataFiles(@Value("${analysis.data.dir:../analysis}") String dir) {
+        this.dir = Path.of(dir).toAbsolutePath().normalize();
+    }
+
+    public Path resolve(String path) {
+        return dir.resolve(path);
+    }
+}
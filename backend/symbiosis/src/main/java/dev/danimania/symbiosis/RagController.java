@@ -1,6 +1,7 @@
 package dev.danimania.symbiosis;
 
 import org.springframework.web.bind.annotation.*;
+import java.util.List;
 import java.util.Map;
 import java.util.UUID;
 
@@ -11,11 +12,14 @@ public class RagController {
     private final RagService ragService;
     private final InMemoryVectorStore vectorStore;
     private final EmbeddingService embeddingService;
+    private final ChunkIndex chunkIndex;
 
-    public RagController(RagService ragService, InMemoryVectorStore vectorStore, EmbeddingService embeddingService) {
+    public RagController(RagService ragService, InMemoryVectorStore vectorStore, EmbeddingService embeddingService,
+                         ChunkIndex chunkIndex) {
         this.ragService = ragService;
         this.vectorStore = vectorStore;
         this.embeddingService = embeddingService;
+        this.chunkIndex = chunkIndex;
     }
 
     @PostMapping("/add")
@@ -26,6 +30,14 @@ public class RagController {
         return "Added chunk: " + id;
     }
 
+    // Passages from the offline chunk index (chunks.py), best BM25 match first
+    @PostMapping("/search")
+    public List<ChunkHit> search(@RequestBody Map<String, String> payload) {
+        String query = payload.get("query");
+        int k = Integer.parseInt(payload.getOrDefault("k", "5"));
+        return chunkIndex.search(query, k);
+    }
+
     @PostMapping("/ask-topic")
     public String askTopic(@RequestBody Map<String, String> payload) throws Exception {
         String topic = payload.get("topic");
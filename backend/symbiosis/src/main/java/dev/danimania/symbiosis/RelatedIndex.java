@@ -0,0 +1,45 @@
+package dev.danimania.symbiosis;
+
+import com.fasterxml.jackson.core.type.TypeReference;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.stereotype.Service;
+
+import java.io.IOException;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+// Related articles in topic-score space, precomputed by
+// backend/analysis/neighbors.py: neighbors.json maps each PMC id to its
+// nearest articles, nearest first.
+@Service
+public class RelatedIndex {
+
+    private Map<String, List<String>> related = new HashMap<>();
+
+    public RelatedIndex(DataFiles dataFiles, @Value("${umap.neighbors.path:neighbors.json}") String path) {
+        Path file = dataFiles.resolve(path);
+        if (!Files.exists(file)) {
+            System.out.println("No related articles at " + file + ", /umap/related will find nothing.");
+            return;
+        }
+        try {
+            related = new ObjectMapper().readValue(file.toFile(), new TypeReference<Map<String, List<String>>>() {});
+            System.out.println("Loaded related articles for " + related.size() + " articles from " + file);
+        } catch (IOException e) {
+            e.printStackTrace();
+        }
+    }
+
+    // the k nearest articles to id, or null for an unknown id
+    public List<String> related(String id, int k) {
+        List<String> ids = related.get(id);
+        if (ids == null) {
+            return null;
+        }
+        return ids.subList(0, Math.max(0, Math.min(k, ids.size())));
+    }
+}
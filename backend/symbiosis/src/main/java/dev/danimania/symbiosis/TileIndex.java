@@ -0,0 +1,154 @@
+package dev.danimania.symbiosis;
+
+import com.fasterxml.jackson.databind.JsonNode;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.stereotype.Service;
+
+import java.io.IOException;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.channels.FileChannel;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.StandardOpenOption;
+import java.util.ArrayList;
+import java.util.Comparator;
+import java.util.HashMap;
+import java.util.HashSet;
+import java.util.List;
+import java.util.Map;
+import java.util.PriorityQueue;
+import java.util.Set;
+
+// Level-of-detail octree of the 3D map, built by backend/analysis/tiles.py
+// (see the OCTREE section there). tiles.json lists the tiles, tiles.bin
+// holds their 16-byte records (x, y, z float32 and a uint32, little-endian)
+// and is memory-mapped, and titles.json maps a point's row to its PMC id and
+// title. The client draws the coarse tiles first and asks only for the
+// tiles in view instead of every article through /umap/articles.
+@Service
+public class TileIndex {
+
+    private static final int VERSION = 1;
+    private static final String ROOT = "r";
+    private static final int RECORD_SIZE = 16;
+
+    private JsonNode manifest;
+    private final Map<String, JsonNode> tiles = new HashMap<>();
+    private ByteBuffer data;
+    private JsonNode ids;
+    private JsonNode titles;
+
+    public TileIndex(DataFiles dataFiles, @Value("${umap.tiles.path:tiles.json}") String path) {
+        Path file = dataFiles.resolve(path);
+        if (!Files.exists(file)) {
+            System.out.println("No map tiles at " + file + ", /umap/tiles will find nothing.");
+            return;
+        }
+        try {
+            ObjectMapper mapper = new ObjectMapper();
+            JsonNode parsed = mapper.readTree(file.toFile());
+            if (parsed.path("version").asInt() != VERSION) {
+                throw new IOException(file + " is not a version " + VERSION + " tile manifest");
+            }
+            Path dir = file.getParent();
+            // a mapping stays valid after its channel is closed
+            try (FileChannel channel = FileChannel.open(dir.resolve(parsed.get("data").asText()),
+                    StandardOpenOption.READ)) {
+                data = channel.map(FileChannel.MapMode.READ_ONLY, 0, channel.size())
+                        .order(ByteOrder.LITTLE_ENDIAN);
+            }
+            JsonNode lookup = mapper.readTree(dir.resolve(parsed.get("titles").asText()).toFile());
+            ids = lookup.get("ids");
+            titles = lookup.get("titles");
+            for (JsonNode tile : parsed.get("tiles")) {
+                tiles.put(tile.get("key").asText(), tile);
+            }
+            manifest = parsed;
+            System.out.println("Mapped " + tiles.size() + " tiles for " + ids.size() + " articles from " + file);
+        } catch (IOException e) {
+            e.printStackTrace();
+        }
+    }
+
+    public JsonNode manifest() {
+        return manifest;
+    }
+
+    // a tile's records as stored, or null for an unknown key
+    public byte[] tile(String key) {
+        JsonNode tile = tiles.get(key);
+        if (tile == null) {
+            return null;
+        }
+        byte[] out = new byte[tile.get("records").asInt() * RECORD_SIZE];
+        data.get((int) tile.get("offset").asLong(), out);
+        return out;
+    }
+
+    // Keys of the tiles to draw for the box lo..hi, as select_tiles in
+    // tiles.py: coarse tiles are swapped for their children in view,
+    // shallowest and most populated first, while the records fit the budget.
+    public List<String> select(double[] lo, double[] hi, int budget) {
+        JsonNode root = tiles.get(ROOT);
+        if (root == null || !inView(root, lo, hi)) {
+            return new ArrayList<>();
+        }
+        Set<String> selected = new HashSet<>();
+        selected.add(ROOT);
+        int total = root.get("records").asInt();
+        PriorityQueue<JsonNode> queue = new PriorityQueue<>(
+                Comparator.<JsonNode>comparingInt(t -> t.get("level").asInt())
+                        .thenComparingInt(t -> -t.get("count").asInt())
+                        .thenComparing(t -> t.get("key").asText()));
+        queue.add(root);
+        while (!queue.isEmpty()) {
+            JsonNode tile = queue.poll();
+            if ("points".equals(tile.get("kind").asText())) {
+                continue;
+            }
+            String key = tile.get("key").asText();
+            List<JsonNode> children = new ArrayList<>();
+            int cost = -tile.get("records").asInt();
+            for (int octant = 0; octant < 8; octant++) {
+                JsonNode child = tiles.get(key + octant);
+                if (child != null && inView(child, lo, hi)) {
+                    children.add(child);
+                    cost += child.get("records").asInt();
+                }
+            }
+            if (total + cost > budget) {
+                continue;
+            }
+            total += cost;
+            selected.remove(key);
+            for (JsonNode child : children) {
+                selected.add(child.get("key").asText());
+                queue.add(child);
+            }
+        }
+        List<String> keys = new ArrayList<>(selected);
+        keys.sort(null);
+        return keys;
+    }
+
+    private static boolean inView(JsonNode tile, double[] lo, double[] hi) {
+        double size = tile.get("size").asDouble();
+        for (int axis = 0; axis < 3; axis++) {
+            double min = tile.get("min").get(axis).asDouble();
+            if (min > hi[axis] || min + size < lo[axis]) {
+                return false;
+            }
+        }
+        return true;
+    }
+
+    // the id and title of a point's row (the uint32 in a "points" record)
+    public TilePoint point(int row) {
+        if (ids == null || row < 0 || row >= ids.size()) {
+            return null;
+        }
+        return new TilePoint(row, ids.get(row).asText(), titles.get(row).asText());
+    }
+}
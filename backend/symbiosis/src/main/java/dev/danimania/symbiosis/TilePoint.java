@@ -0,0 +1,13 @@
+package dev.danimania.symbiosis;
+
+public class TilePoint {
+    public final int row;
+    public final String id;
+    public final String title;
+
+    public TilePoint(int row, String id, String title) {
+        this.row = row;
+        this.id = id;
+        this.title = title;
+    }
+}
@@ -1,18 +1,26 @@
 package dev.danimania.symbiosis;
 
+import com.fasterxml.jackson.databind.JsonNode;
+import org.springframework.http.MediaType;
 import org.springframework.http.ResponseEntity;
 import org.springframework.web.bind.annotation.*;
 
+import java.util.ArrayList;
 import java.util.Collection;
+import java.util.List;
 
 @RestController
 @RequestMapping("/umap")
 public class UmapController {
 
     private final UmapService umapService;
+    private final TileIndex tileIndex;
+    private final RelatedIndex relatedIndex;
 
-    public UmapController(UmapService umapService) {
+    public UmapController(UmapService umapService, TileIndex tileIndex, RelatedIndex relatedIndex) {
         this.umapService = umapService;
+        this.tileIndex = tileIndex;
+        this.relatedIndex = relatedIndex;
     }
 
     @GetMapping("/coords/{id}")
@@ -28,4 +36,58 @@ public class UmapController {
     public Collection<ArticleCoords> getAllArticles() {
         return umapService.getAllArticles();
     }
+
+    // ids of the articles closest in topic scores (neighbors.py), nearest first
+    @GetMapping("/related/{id}")
+    public ResponseEntity<List<String>> getRelated(@PathVariable String id,
+                                                   @RequestParam(defaultValue = "10") int k) {
+        List<String> related = relatedIndex.related(id, k);
+        if (related == null) {
+            return ResponseEntity.notFound().build();
+        }
+        return ResponseEntity.ok(related);
+    }
+
+    // Level-of-detail tiles of the map (tiles.py): the manifest once, then
+    // only the tiles a view needs, as packed float32 records
+    @GetMapping("/tiles")
+    public ResponseEntity<JsonNode> getTileManifest() {
+        JsonNode manifest = tileIndex.manifest();
+        if (manifest == null) {
+            return ResponseEntity.notFound().build();
+        }
+        return ResponseEntity.ok(manifest);
+    }
+
+    // e.g. /umap/tiles/view?min=-5,-5,-5&max=5,5,5&budget=50000
+    @GetMapping("/tiles/view")
+    public ResponseEntity<List<String>> getTilesInView(@RequestParam double[] min, @RequestParam double[] max,
+                                                       @RequestParam(defaultValue = "50000") int budget) {
+        if (min.length != 3 || max.length != 3) {
+            return ResponseEntity.badRequest().build();
+        }
+        return ResponseEntity.ok(tileIndex.select(min, max, budget));
+    }
+
+    @GetMapping("/tiles/{key}")
+    public ResponseEntity<byte[]> getTile(@PathVariable String key) {
+        byte[] tile = tileIndex.tile(key);
+        if (tile == null) {
+            return ResponseEntity.notFound().build();
+        }
+        return ResponseEntity.ok().contentType(MediaType.APPLICATION_OCTET_STREAM).body(tile);
+    }
+
+    // ids and titles for the rows of the points being shown or hovered
+    @GetMapping("/points")
+    public List<TilePoint> getPoints(@RequestParam List<Integer> rows) {
+        List<TilePoint> points = new ArrayList<>();
+        for (int row : rows) {
+            TilePoint point = tileIndex.point(row);
+            if (point != null) {
+                points.add(point);
+            }
+        }
+        return points;
+    }
 }
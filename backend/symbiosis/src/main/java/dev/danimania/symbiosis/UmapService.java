@@ -2,9 +2,12 @@ package dev.danimania.symbiosis;
 
 import com.fasterxml.jackson.core.type.TypeReference;
 import com.fasterxml.jackson.databind.ObjectMapper;
+import org.springframework.beans.factory.annotation.Value;
 import org.springframework.stereotype.Service;
 
 import java.io.InputStream;
+import java.nio.file.Files;
+import java.nio.file.Path;
 import java.util.Collection;
 import java.util.HashMap;
 import java.util.List;
@@ -14,15 +17,20 @@ import java.util.Map;
 public class UmapService {
 
     private Map<String, ArticleCoords> articleMap = new HashMap<>();
+    private final Path file;
 
-    public UmapService() {
+    // the map backend/analysis/mapa.py last wrote (see DataFiles), else the
+    // snapshot bundled as umap.json
+    public UmapService(DataFiles dataFiles, @Value("${umap.points.path:output_3d.json}") String path) {
+        file = dataFiles.resolve(path);
         loadMap();
     }
 
     public void loadMap() {
         try {
             ObjectMapper mapper = new ObjectMapper();
-            InputStream is = getClass().getResourceAsStream("/umap.json");
+            InputStream is = Files.exists(file) ? Files.newInputStream(file)
+                    : getClass().getResourceAsStream("/umap.json");
             List<ArticleCoords> articles = mapper.readValue(is, new TypeReference<List<ArticleCoords>>() {});
             for (ArticleCoords a : articles) {
                 articleMap.put(a.id, a);
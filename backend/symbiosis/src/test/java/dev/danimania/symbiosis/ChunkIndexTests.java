@@ -0,0 +1,66 @@
+package dev.danimania.symbiosis;
+
+import com.fasterxml.jackson.core.type.TypeReference;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import org.junit.jupiter.api.Test;
+import org.junit.jupiter.params.ParameterizedTest;
+import org.junit.jupiter.params.provider.ValueSource;
+
+import java.nio.file.Path;
+import java.util.List;
+import java.util.Map;
+
+import static org.junit.jupiter.api.Assertions.assertEquals;
+import static org.junit.jupiter.api.Assertions.assertTrue;
+
+// Reads a chunks.bin written by backend/analysis/chunks.py and checks the
+// hits against what chunks.py's own reader returned for the same queries.
+// Both fixtures in src/test/resources/chunks come from three stored articles
+// with body headings:
+//
+//   python chunks.py build --store <three articles> --words 50 --overlap 10
+//
+// and ChunkIndex("chunks.bin").search(query, k) for each expected query.
+class ChunkIndexTests {
+
+    private static Path fixture(String name) throws Exception {
+        return Path.of(ChunkIndexTests.class.getResource("/chunks/" + name).toURI());
+    }
+
+    // small windows split every section, and strings across windows
+    @ParameterizedTest
+    @ValueSource(longs = {ChunkIndex.WINDOW, 64, 8})
+    void searchMatchesPythonReader(long window) throws Exception {
+        ChunkIndex index = new ChunkIndex(fixture("chunks.bin"), window);
+        List<Map<String, Object>> cases = new ObjectMapper().readValue(
+                fixture("expected.json").toFile(), new TypeReference<List<Map<String, Object>>>() {});
+
+        assertEquals(28, index.size());
+        for (Map<String, Object> expected : cases) {
+            String query = (String) expected.get("query");
+            @SuppressWarnings("unchecked")
+            List<Map<String, Object>> hits = (List<Map<String, Object>>) expected.get("hits");
+            List<ChunkHit> actual = index.search(query, (Integer) expected.get("k"));
+
+            assertEquals(hits.size(), actual.size(), query);
+            for (int i = 0; i < hits.size(); i++) {
+                Map<String, Object> hit = hits.get(i);
+                ChunkHit got = actual.get(i);
+                assertEquals(hit.get("pmcId"), got.pmcId, query);
+                assertEquals(hit.get("ordinal"), got.ordinal, query);
+                assertEquals(hit.get("section"), got.section, query);
+                assertEquals(hit.get("text"), got.text, query);
+                // float32 sums, added up in a different term order
+                assertEquals(((Number) hit.get("score")).floatValue(), got.score, 1e-4, query);
+            }
+        }
+    }
+
+    @Test
+    void missingFileFindsNothing() throws Exception {
+        ChunkIndex index = new ChunkIndex(fixture("chunks.bin").resolveSibling("missing.bin"), ChunkIndex.WINDOW);
+
+        assertEquals(0, index.size());
+        assertTrue(index.search("cell", 5).isEmpty());
+    }
+}
@@ -11,6 +11,39 @@ export interface ArticleCoords {
   topic?: string;
 }
 
+// Level-of-detail map tiles (backend/analysis/tiles.py)
+export interface TileInfo {
+  key: string;
+  level: number;
+  min: [number, number, number];
+  size: number;
+  count: number;
+  kind: 'centroids' | 'points';
+  records: number;
+  offset: number;
+}
+
+export interface TileManifest {
+  version: number;
+  points: number;
+  record_size: number;
+  tiles: TileInfo[];
+}
+
+// A decoded tile: xyz triples plus, per record, the point's row (for
+// /umap/points) in "points" tiles or the number of points a centroid
+// stands for in "centroids" tiles
+export interface TileData {
+  positions: Float32Array;
+  values: Uint32Array;
+}
+
+export interface TilePoint {
+  row: number;
+  id: string;
+  title: string;
+}
+
 export interface ChatRequest {
   topic?: string;
   question: string;
@@ -111,6 +144,98 @@ export const umapApi = {
 
     return response.json();
   },
+
+  /**
+   * Get the ids of the articles most related to one, nearest first
+   */
+  async getRelated(id: string, k = 10): Promise<string[] | null> {
+    const response = await fetch(`${API_BASE}/umap/related/${id}?k=${k}`);
+
+    if (response.status === 404) {
+      return null;
+    }
+
+    if (!response.ok) {
+      throw new Error(`Failed to get related articles: ${response.statusText}`);
+    }
+
+    return response.json();
+  },
+
+  /**
+   * Get the map's tile manifest, or null if no tiles were built
+   */
+  async getTileManifest(): Promise<TileManifest | null> {
+    const response = await fetch(`${API_BASE}/umap/tiles`);
+
+    if (response.status === 404) {
+      return null;
+    }
+
+    if (!response.ok) {
+      throw new Error(`Failed to get tile manifest: ${response.statusText}`);
+    }
+
+    return response.json();
+  },
+
+  /**
+   * Get the keys of the tiles to draw for a view box, within a record budget
+   */
+  async getTilesInView(
+    min: [number, number, number],
+    max: [number, number, number],
+    budget = 50000
+  ): Promise<string[]> {
+    const params = new URLSearchParams({
+      min: min.join(','),
+      max: max.join(','),
+      budget: String(budget),
+    });
+    const response = await fetch(`${API_BASE}/umap/tiles/view?${params}`);
+
+    if (!response.ok) {
+      throw new Error(`Failed to get tiles in view: ${response.statusText}`);
+    }
+
+    return response.json();
+  },
+
+  /**
+   * Get one tile's packed records (16 bytes each: x, y, z float32, uint32)
+   */
+  async getTile(key: string): Promise<TileData> {
+    const response = await fetch(`${API_BASE}/umap/tiles/${key}`);
+
+    if (!response.ok) {
+      throw new Error(`Failed to get tile ${key}: ${response.statusText}`);
+    }
+
+    const buffer = await response.arrayBuffer();
+    const floats = new Float32Array(buffer);
+    const words = new Uint32Array(buffer);
+    const count = buffer.byteLength / 16;
+    const positions = new Float32Array(count * 3);
+    const values = new Uint32Array(count);
+    for (let i = 0; i < count; i++) {
+      positions.set(floats.subarray(i * 4, i * 4 + 3), i * 3);
+      values[i] = words[i * 4 + 3];
+    }
+    return { positions, values };
+  },
+
+  /**
+   * Get ids and titles for point rows from "points" tiles
+   */
+  async getPoints(rows: number[]): Promise<TilePoint[]> {
+    const response = await fetch(`${API_BASE}/umap/points?rows=${rows.join(',')}`);
+
+    if (!response.ok) {
+      throw new Error(`Failed to get points: ${response.statusText}`);
+    }
+
+    return response.json();
+  },
 };
 
 // Helper function for error handling